@@ -1,6 +1,13 @@
 from setuptools import setup, find_packages
+import os
 import sys
 
+# The app is a flat set of modules in src/; tests and scratch copies aren't installed
+modules = sorted(
+    name[:-3] for name in os.listdir("src")
+    if name.endswith(".py") and not name.startswith("test_") and name != "conftest.py" and " " not in name
+)
+
 # Define platform-specific dependencies
 extra_requires = []
 if sys.platform == 'darwin':  # macOS
@@ -13,6 +20,7 @@ setup(
     author="Your Name",
     packages=find_packages(where="src"),
     package_dir={"": "src"},
+    py_modules=modules,
     python_requires=">=3.8",
     install_requires=[
         "PyQt6>=6.4.0",
@@ -20,5 +28,12 @@ setup(
         "SQLAlchemy>=2.0.0",
         "pandas>=2.0.0",
         "matplotlib>=3.7.0"
-    ] + extra_requires
+    ] + extra_requires,
+    extras_require={
+        "postgres": ["psycopg[binary]>=3.1"],
+        "analytics": ["pyarrow>=12.0.0"],
+    },
+    entry_points={
+        "console_scripts": ["finance-tracker=cli:main"],
+    }
 )
\ No newline at end of file
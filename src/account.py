@@ -1,49 +1,64 @@
 from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                            QLabel, QComboBox, QDateEdit, QLineEdit, 
                            QPushButton, QTableWidget, QTableWidgetItem, QTabWidget,
-                           QMessageBox, QFileDialog, QGroupBox)
-from PyQt6.QtCore import Qt, QDate
-from PyQt6.QtGui import QPainter
+                           QMessageBox, QFileDialog, QGroupBox, QCheckBox, QSpinBox)
+from PyQt6.QtCore import Qt, QDate, QTimer
+from PyQt6.QtGui import QPainter, QKeySequence, QShortcut
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.image import imread
+import io
+import os
 import sys
 from datetime import datetime
+from types import SimpleNamespace
 from decimal import Decimal, InvalidOperation, ConversionSyntax
 import csv
-from models import Session, User, Account, Transaction, Category, TransactionType, ExchangeRate
+from models import (Session, User, Account, Transaction, Category, TransactionType, ExchangeRate, BudgetPeriod,
+                    RuleKind, find_duplicate)
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError, DatabaseError
 from contextlib import contextmanager
 from balance_inquiry import BalanceInquiry
+from classifier import load_classifier, sync_classifier, classifier_path, MIN_PROBABILITY
+from rules import load_rules, list_rules, add_rule, delete_rule, RuleSet
+from account_context import load_account_context
+from archive import iter_rows_in_range
+from query_cache import query_cache, cached_category_id
+from sql_instrumentation import get_instrumentation
+from tracing import tracer, traced
+from budgets import set_budget, exceeded_budgets, list_budgets
+from scheduler import add_template, run_due
+from backup import backup_service, list_backups, verify_backup
+from future_bridge import FutureBridge
+from maintenance import maintenance_scheduler, format_report
+from chart_cache import chart_cache
+import config
+import models
+from commands import (CommandLog, AddTransaction, DeleteTransaction, EditTransaction,
+                      CurrencyChange, RateChange)
 
 class AccountWindow(QMainWindow):
-    def __init__(self, username):
+    def __init__(self, username, context=None):
         super().__init__()
         self.username = username
-        self.balance_inquiry = BalanceInquiry(username)
-        self.account = self.balance_inquiry.get_account()
-        if not self.account:
-            # Handle the case where the account is not found
-            QMessageBox.critical(self, "Account Error", "Account not found.")
-            self.close()
-            return
-
-        self.balance = self.balance_inquiry.get_balance()  # Get balance from balance_inquiry
-        self.session = Session()
         self.balance_labels = {}
         
         try:
-            # Get user data first
-            user = self.session.query(User).filter_by(username=username).first()
-            if not user:
-                raise ValueError(f"User '{username}' not found")
-                
-            self.user_id = user.id
-            self.account = self.session.query(Account)\
-                .filter_by(user_id=self.user_id)\
-                .first()
+            # Load user, account, categories, rates and the first page of
+            # transactions once; BalanceInquiry shares the same context
+            self.context = context or load_account_context(Session(), username)
+            self.session = self.context.session
+            self.balance_inquiry = BalanceInquiry(username, context=self.context)
             
-            if not self.account:
-                raise ValueError("No account found for user")
+            self.user_id = self.context.user.id
+            self.account = self.balance_inquiry.get_account()
+            
+            # Undo/redo history of edits made in this window
+            self.command_log = CommandLog(self.session)
+            
+            # Category suggestions, loaded on first use so opening costs no queries
+            self.classifier = None
+            self.rule_set = None
             
             # Set initial balance from account
             self.balance = self.balance_inquiry.get_balance()  # Get balance from balance_inquiry
@@ -238,9 +253,14 @@ class AccountWindow(QMainWindow):
         transaction_layout.addWidget(self.type_combo)
         
         self.category_combo = QComboBox()
-        self.category_combo.addItems(["Salary", "Food", "Transport", "Utilities"])
+        self.category_combo.addItems(sorted(category.name for category in self.context.categories))
         transaction_layout.addWidget(self.category_combo)
         
+        self.description_input = QLineEdit()
+        self.description_input.setPlaceholderText("Description")
+        self.description_input.editingFinished.connect(self.suggest_category)
+        transaction_layout.addWidget(self.description_input)
+        
         self.amount_input = QLineEdit()
         self.amount_input.setPlaceholderText("Amount")
         transaction_layout.addWidget(self.amount_input)
@@ -261,7 +281,32 @@ class AccountWindow(QMainWindow):
         delete_btn.clicked.connect(self.delete_transaction)
         transaction_layout.addWidget(delete_btn)
         
+        edit_btn = QPushButton("Update Selected")
+        edit_btn.clicked.connect(self.edit_transaction)
+        transaction_layout.addWidget(edit_btn)
+        
         layout.addLayout(transaction_layout)
+        
+        # Undo/redo of adds, deletes, edits, currency and rate changes
+        history_layout = QHBoxLayout()
+        self.undo_btn = QPushButton("Undo")
+        self.undo_btn.clicked.connect(self.undo)
+        history_layout.addWidget(self.undo_btn)
+        self.redo_btn = QPushButton("Redo")
+        self.redo_btn.clicked.connect(self.redo)
+        history_layout.addWidget(self.redo_btn)
+        history_layout.addStretch()
+        layout.addLayout(history_layout)
+        
+        QShortcut(QKeySequence.StandardKey.Undo, self, activated=self.undo)
+        QShortcut(QKeySequence.StandardKey.Redo, self, activated=self.redo)
+        self.update_undo_buttons()
+        
+        # Inline warning shown when an expense takes a budget over its limit
+        self.budget_label = QLabel("")
+        self.budget_label.setStyleSheet("color: #f44336; font-weight: bold;")
+        self.budget_label.setWordWrap(True)
+        layout.addWidget(self.budget_label)
     
     def setup_reports_tab(self):
         layout = QVBoxLayout(self.reports_tab)
@@ -288,6 +333,10 @@ class AccountWindow(QMainWindow):
         export_btn.clicked.connect(self.export_to_csv)
         report_buttons.addWidget(export_btn)
         
+        parquet_btn = QPushButton("Export to Parquet")
+        parquet_btn.clicked.connect(self.export_to_parquet)
+        report_buttons.addWidget(parquet_btn)
+        
         refresh_btn = QPushButton("Refresh Charts")
         refresh_btn.clicked.connect(self.update_charts)
         report_buttons.addWidget(refresh_btn)
@@ -346,57 +395,426 @@ class AccountWindow(QMainWindow):
         rates_group.setLayout(rates_layout)
         layout.addWidget(rates_group)
         
-        # Load existing rates
+        # Budgets Section
+        budgets_group = QGroupBox("Budgets")
+        budgets_layout = QVBoxLayout()
+        
+        self.budget_table = QTableWidget()
+        self.budget_table.setColumnCount(5)
+        self.budget_table.setHorizontalHeaderLabels([
+            "Category", "Period", "Limit", "Spent", "Remaining"
+        ])
+        self.budget_table.horizontalHeader().setStretchLastSection(True)
+        budgets_layout.addWidget(self.budget_table)
+        
+        budget_form = QHBoxLayout()
+        
+        self.budget_category = QComboBox()
+        self.budget_category.addItems(sorted(
+            category.name for category in self.context.categories
+            if category.type == TransactionType.EXPENSE
+        ))
+        budget_form.addWidget(self.budget_category)
+        
+        self.budget_period = QComboBox()
+        self.budget_period.addItems([period.value.title() for period in BudgetPeriod])
+        self.budget_period.setCurrentText(BudgetPeriod.MONTHLY.value.title())
+        budget_form.addWidget(self.budget_period)
+        
+        self.budget_input = QLineEdit()
+        self.budget_input.setPlaceholderText("Limit")
+        budget_form.addWidget(self.budget_input)
+        
+        set_budget_btn = QPushButton("Set Budget")
+        set_budget_btn.clicked.connect(self.update_budget)
+        set_budget_btn.setStyleSheet(
+            "background-color: #4CAF50; color: white; padding: 5px;"
+        )
+        budget_form.addWidget(set_budget_btn)
+        
+        budgets_layout.addLayout(budget_form)
+        budgets_group.setLayout(budgets_layout)
+        layout.addWidget(budgets_group)
+        
+        # Recurring Transactions Section
+        recurring_group = QGroupBox("Recurring Transactions")
+        recurring_layout = QVBoxLayout()
+        
+        recurring_form = QHBoxLayout()
+        
+        self.recurring_type = QComboBox()
+        self.recurring_type.addItems(["Income", "Expense"])
+        recurring_form.addWidget(self.recurring_type)
+        
+        self.recurring_category = QComboBox()
+        self.recurring_category.addItems(sorted(category.name for category in self.context.categories))
+        recurring_form.addWidget(self.recurring_category)
+        
+        self.recurring_amount = QLineEdit()
+        self.recurring_amount.setPlaceholderText("Amount")
+        recurring_form.addWidget(self.recurring_amount)
+        
+        self.recurring_schedule = QLineEdit()
+        self.recurring_schedule.setPlaceholderText("Schedule, e.g. 0 9 1 * * (min hour day month weekday)")
+        recurring_form.addWidget(self.recurring_schedule)
+        
+        add_recurring_btn = QPushButton("Add Recurring")
+        add_recurring_btn.clicked.connect(self.add_recurring)
+        add_recurring_btn.setStyleSheet(
+            "background-color: #4CAF50; color: white; padding: 5px;"
+        )
+        recurring_form.addWidget(add_recurring_btn)
+        
+        run_recurring_btn = QPushButton("Run Due Now")
+        run_recurring_btn.clicked.connect(self.run_recurring)
+        recurring_form.addWidget(run_recurring_btn)
+        
+        recurring_layout.addLayout(recurring_form)
+        recurring_group.setLayout(recurring_layout)
+        layout.addWidget(recurring_group)
+        
+        self.setup_rules_panel(layout)
+        
+        # Backups and maintenance only apply to SQLite database files
+        if models.DB_PATH:
+            self.setup_backup_panel(layout)
+            self.setup_maintenance_panel(layout)
+        
+        if tracer.enabled:
+            dump_traces_btn = QPushButton("Dump Latency Histograms")
+            dump_traces_btn.clicked.connect(self.dump_traces)
+            layout.addWidget(dump_traces_btn)
+        
+        # SQL debug panel, only when FINANCE_TRACKER_SQL_DEBUG is set
+        if get_instrumentation() is not None:
+            self.setup_sql_debug_panel(layout)
+        
+        # Load existing rates; budgets aren't needed for the first paint
         self.load_exchange_rates()
+        QTimer.singleShot(0, self.load_budgets)
     
+    def setup_sql_debug_panel(self, layout):
+        debug_group = QGroupBox("SQL Debug")
+        debug_layout = QVBoxLayout()
+        
+        self.sql_summary_label = QLabel("")
+        self.sql_summary_label.setWordWrap(True)
+        debug_layout.addWidget(self.sql_summary_label)
+        
+        self.sql_table = QTableWidget()
+        self.sql_table.setColumnCount(6)
+        self.sql_table.setHorizontalHeaderLabels([
+            "Statement", "Count", "Total ms", "Avg ms", "Max ms", "Top Call Site"
+        ])
+        self.sql_table.horizontalHeader().setStretchLastSection(True)
+        debug_layout.addWidget(self.sql_table)
+        
+        self.n_plus_one_label = QLabel("")
+        self.n_plus_one_label.setWordWrap(True)
+        self.n_plus_one_label.setStyleSheet("color: #f44336;")
+        debug_layout.addWidget(self.n_plus_one_label)
+        
+        debug_buttons = QHBoxLayout()
+        refresh_btn = QPushButton("Refresh")
+        refresh_btn.clicked.connect(self.refresh_sql_debug)
+        debug_buttons.addWidget(refresh_btn)
+        reset_btn = QPushButton("Reset")
+        reset_btn.clicked.connect(self.reset_sql_debug)
+        debug_buttons.addWidget(reset_btn)
+        debug_layout.addLayout(debug_buttons)
+        
+        debug_group.setLayout(debug_layout)
+        layout.addWidget(debug_group)
+        self.refresh_sql_debug()
+
+    def refresh_sql_debug(self):
+        """Show the statements that took the most time and any N+1 suspects"""
+        instrumentation = get_instrumentation()
+        if instrumentation is None:
+            return
+        cache = query_cache.stats()
+        self.sql_summary_label.setText(
+            f"{instrumentation.total_queries:,} statements, "
+            f"{instrumentation.slow_queries:,} slow (>= {instrumentation.slow_query_ms:g} ms, "
+            f"logged to {instrumentation.slow_log_path}). "
+            f"Query cache: {cache['hits']:,} hits, {cache['misses']:,} misses ({cache['hit_rate']:.0%})"
+        )
+        rows = instrumentation.report()
+        self.sql_table.setRowCount(len(rows))
+        for row, stats in enumerate(rows):
+            self.sql_table.setItem(row, 0, QTableWidgetItem(stats['statement']))
+            self.sql_table.setItem(row, 1, QTableWidgetItem(f"{stats['count']:,}"))
+            self.sql_table.setItem(row, 2, QTableWidgetItem(f"{stats['total_ms']:.1f}"))
+            self.sql_table.setItem(row, 3, QTableWidgetItem(f"{stats['avg_ms']:.2f}"))
+            self.sql_table.setItem(row, 4, QTableWidgetItem(f"{stats['max_ms']:.1f}"))
+            self.sql_table.setItem(row, 5, QTableWidgetItem(stats['top_call_site']))
+        suspects = instrumentation.n_plus_one_suspects()
+        self.n_plus_one_label.setText("\n".join(
+            f"Possible N+1 at {site} ({count}x): {statement[:120]}"
+            for site, statement, count in suspects[:5]
+        ))
+
+    def setup_rules_panel(self, layout):
+        """Category rules, filled in when the Settings tab is first shown"""
+        rules_group = QGroupBox("Category Rules")
+        rules_layout = QVBoxLayout()
+        
+        self.rules_table = QTableWidget()
+        self.rules_table.setColumnCount(4)
+        self.rules_table.setHorizontalHeaderLabels(["Pattern", "Kind", "Category", "Priority"])
+        self.rules_table.horizontalHeader().setStretchLastSection(True)
+        rules_layout.addWidget(self.rules_table)
+        
+        rules_form = QHBoxLayout()
+        self.rule_pattern = QLineEdit()
+        self.rule_pattern.setPlaceholderText("Description contains, e.g. GRAB")
+        rules_form.addWidget(self.rule_pattern)
+        
+        self.rule_regex = QCheckBox("Regex")
+        rules_form.addWidget(self.rule_regex)
+        
+        self.rule_category = QComboBox()
+        self.rule_category.addItems(sorted(category.name for category in self.context.categories))
+        rules_form.addWidget(self.rule_category)
+        
+        self.rule_priority = QSpinBox()
+        self.rule_priority.setRange(-100, 100)
+        self.rule_priority.setToolTip("Higher wins when several rules match")
+        rules_form.addWidget(self.rule_priority)
+        
+        add_rule_btn = QPushButton("Add Rule")
+        add_rule_btn.clicked.connect(self.add_category_rule)
+        add_rule_btn.setStyleSheet("background-color: #4CAF50; color: white; padding: 5px;")
+        rules_form.addWidget(add_rule_btn)
+        
+        delete_rule_btn = QPushButton("Delete Rule")
+        delete_rule_btn.clicked.connect(self.delete_category_rule)
+        rules_form.addWidget(delete_rule_btn)
+        
+        rules_layout.addLayout(rules_form)
+        rules_group.setLayout(rules_layout)
+        layout.addWidget(rules_group)
+        self.rules_loaded = False
+        self.tab_widget.currentChanged.connect(self.on_tab_changed)
+
+    def on_tab_changed(self, index):
+        if self.tab_widget.widget(index) is self.settings_tab and not self.rules_loaded:
+            self.load_rules_table()
+
+    def load_rules_table(self):
+        """Fill the rules table, keeping each row's rule id"""
+        try:
+            rules = list_rules(self.session, self.user_id)
+            self.rule_set = RuleSet(rules)
+            self.rules_table.setRowCount(len(rules))
+            for row, rule in enumerate(rules):
+                pattern_item = QTableWidgetItem(rule.pattern)
+                pattern_item.setData(Qt.ItemDataRole.UserRole, rule.id)
+                self.rules_table.setItem(row, 0, pattern_item)
+                self.rules_table.setItem(row, 1, QTableWidgetItem(rule.kind.value.title()))
+                self.rules_table.setItem(row, 2, QTableWidgetItem(rule.category))
+                self.rules_table.setItem(row, 3, QTableWidgetItem(str(rule.priority)))
+            self.rules_loaded = True
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to load rules: {str(e)}")
+
+    def add_category_rule(self):
+        """Save the rule in the form and recompile the user's rules"""
+        try:
+            category_name = self.rule_category.currentText()
+            category_id = next((category.id for category in self.context.categories
+                                if category.name == category_name), None)
+            if category_id is None:
+                raise ValueError("Invalid category selected")
+            kind = RuleKind.REGEX if self.rule_regex.isChecked() else RuleKind.CONTAINS
+            with transaction_scope(self):
+                add_rule(self.session, self.user_id, self.rule_pattern.text(), category_id,
+                         kind, self.rule_priority.value())
+            self.rule_pattern.clear()
+            self.load_rules_table()
+        except ValueError as e:
+            QMessageBox.warning(self, "Input Error", str(e))
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to add rule: {str(e)}")
+
+    def delete_category_rule(self):
+        current_row = self.rules_table.currentRow()
+        if current_row < 0:
+            QMessageBox.warning(self, "Error", "Please select a rule to delete")
+            return
+        try:
+            rule_id = self.rules_table.item(current_row, 0).data(Qt.ItemDataRole.UserRole)
+            with transaction_scope(self):
+                delete_rule(self.session, self.user_id, rule_id)
+            self.load_rules_table()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to delete rule: {str(e)}")
+
+    def setup_backup_panel(self, layout):
+        backup_group = QGroupBox("Backups")
+        backup_layout = QHBoxLayout()
+        
+        self.backup_label = QLabel("")
+        self.backup_label.setWordWrap(True)
+        backup_layout.addWidget(self.backup_label, 1)
+        
+        self.backup_btn = QPushButton("Back Up Now")
+        self.backup_btn.clicked.connect(self.start_backup)
+        backup_layout.addWidget(self.backup_btn)
+        
+        verify_btn = QPushButton("Verify Latest")
+        verify_btn.clicked.connect(self.verify_latest_backup)
+        backup_layout.addWidget(verify_btn)
+        
+        backup_group.setLayout(backup_layout)
+        layout.addWidget(backup_group)
+        
+        # Backups run on a worker thread; the result comes back as a signal
+        self.backup_bridge = FutureBridge(self)
+        self.backup_bridge.finished.connect(self.on_backup_finished)
+        self.show_latest_backup()
+
+    def setup_maintenance_panel(self, layout):
+        maintenance_group = QGroupBox("Database Maintenance")
+        maintenance_layout = QHBoxLayout()
+        
+        self.maintenance_label = QLabel("Runs after a few idle minutes and when the app closes")
+        self.maintenance_label.setWordWrap(True)
+        maintenance_layout.addWidget(self.maintenance_label, 1)
+        
+        maintenance_btn = QPushButton("Run Now")
+        maintenance_btn.clicked.connect(self.run_maintenance_now)
+        maintenance_layout.addWidget(maintenance_btn)
+        
+        maintenance_group.setLayout(maintenance_layout)
+        layout.addWidget(maintenance_group)
+        
+        # Restarted by every edit, so it only fires once the user has paused
+        self.idle_timer = QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.setInterval(config.get_maintenance_options()['idle_seconds'] * 1000)
+        self.idle_timer.timeout.connect(self.run_idle_maintenance)
+        self.idle_timer.start()
+
+    def note_activity(self):
+        if hasattr(self, 'idle_timer'):
+            self.idle_timer.start()
+
+    def run_idle_maintenance(self):
+        try:
+            report = maintenance_scheduler.on_idle()
+            if report is not None:
+                self.maintenance_label.setText(f"Last run: {format_report(report)}")
+        except Exception as e:
+            self.maintenance_label.setText(f"Maintenance failed: {str(e)}")
+
+    def run_maintenance_now(self):
+        try:
+            report = maintenance_scheduler.run()
+            self.maintenance_label.setText(f"Last run: {format_report(report)}")
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Maintenance failed: {str(e)}")
+
+    def show_latest_backup(self):
+        backups = list_backups()
+        if backups:
+            stamp = datetime.fromtimestamp(os.path.getmtime(backups[0])).strftime("%Y-%m-%d %H:%M")
+            self.backup_label.setText(f"Latest of {len(backups)} backup(s): {stamp}. "
+                                      f"Restore with: finance-tracker backup restore PATH")
+        else:
+            self.backup_label.setText("No backups yet")
+
+    def start_backup(self):
+        """Snapshot the database in the background; the window stays usable"""
+        self.backup_btn.setEnabled(False)
+        self.backup_label.setText("Backing up...")
+        self.backup_bridge.watch(backup_service.backup())
+
+    def on_backup_finished(self, future):
+        self.backup_btn.setEnabled(True)
+        try:
+            result = future.result()
+            self.backup_label.setText(f"Backed up to {result.path} in {result.seconds:.1f}s")
+        except Exception as e:
+            self.show_latest_backup()
+            QMessageBox.critical(self, "Error", f"Backup failed: {str(e)}")
+
+    def verify_latest_backup(self):
+        backups = list_backups()
+        if not backups:
+            QMessageBox.information(self, "Backups", "No backups yet")
+            return
+        result = verify_backup(backups[0])
+        if result.ok:
+            QMessageBox.information(self, "Backups",
+                                    f"{result.path} is intact ({result.transactions:,} transactions, "
+                                    f"{result.archives} archived year(s))")
+        else:
+            QMessageBox.critical(self, "Backups", f"{result.path} is damaged:\n" + "\n".join(result.problems))
+
+    def dump_traces(self):
+        try:
+            path = tracer.dump()
+            QMessageBox.information(self, "Tracing", f"Latency histograms written to {path}")
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to write traces: {str(e)}")
+
+    def reset_sql_debug(self):
+        instrumentation = get_instrumentation()
+        if instrumentation is not None:
+            instrumentation.reset()
+            self.refresh_sql_debug()
+
     def load_transactions(self):
         """Load transactions and initialize balance from database"""
         try:
-            # Get user's account and balance
-            account = self.session.query(Account)\
-                .filter_by(user_id=self.user_id)\
-                .first()
-                
-            if not account:
-                raise ValueError("No account found for user")
-                
             # Initialize balance from account
-            self.balance = float(account.balance)
+            self.balance = float(self.account.balance)
             self.balance_label.setText(
                 f"Current Balance: {self.currency_combo.currentText()} {self.balance:,.2f}")
             
-            # Load transactions from database
-            transactions = self.session.query(Transaction)\
-                .filter_by(account_id=account.id)\
-                .order_by(Transaction.date)\
-                .all()
+            # Paint the page preloaded with the account context first and
+            # fetch the rest of the history once the window is showing
+            transactions = self.context.take_first_page()
+            load_remaining = transactions is not None and self.context.has_more
+            if transactions is None:
+                transactions = self.context.load_transactions()
             
             # Clear existing table
             self.transactions_table.setRowCount(0)
             
-            # Add transactions to table
-            running_balance = 0.0
-            for transaction in transactions:
-                running_balance += float(transaction.amount)
-                self.add_transaction_to_table(transaction, running_balance)
+            # Add transactions to table, starting from any archived history
+            self.running_balance = self.opening_balance()
+            self.append_transactions(transactions)
             
+            if load_remaining:
+                QTimer.singleShot(0, self.load_remaining_transactions)
                 
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to load transactions: {str(e)}")
 
+    def load_remaining_transactions(self):
+        """Append the history beyond the first page"""
+        try:
+            transactions = self.context.load_transactions(offset=self.transactions_table.rowCount())
+            self.append_transactions(transactions)
+            self.update_charts()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to load transactions: {str(e)}")
+
+    def append_transactions(self, transactions):
+        """Add transactions to the table, continuing the running balance"""
+        for transaction in transactions:
+            self.running_balance = round(self.running_balance + self.convert_amount(
+                transaction.amount, transaction.currency, self.account.currency), 2)
+            self.add_transaction_to_table(transaction, self.running_balance)
+
+    @traced()
     def add_transaction(self):
         """Add a new transaction with float handling"""
         try:
             # Sanitize and validate amount input
-            amount_str = self.amount_input.text().strip().replace(',', '')
-            try:
-                # Validate and convert amount
-                amount = self.parse_amount_string(amount_str)
-                if amount == 0:
-                    raise ValueError("Please enter a valid amount (e.g., 123.45)")
-            except ValueError:
-                raise ValueError("Please enter a valid amount (e.g., 123.45)")
-                
+            amount = self.read_amount_input()
             current_currency = self.currency_combo.currentText()
             transaction_type = TransactionType.EXPENSE if self.type_combo.currentText() == "Expense" else TransactionType.INCOME
             
@@ -405,50 +823,31 @@ class AccountWindow(QMainWindow):
                 amount = -amount
                 
             # Get category
-            category = self.session.query(Category)\
-                .filter_by(name=self.category_combo.currentText())\
-                .first()
-            if not category:
+            category_id = cached_category_id(self.session, self.category_combo.currentText())
+            if category_id is None:
                 raise ValueError("Invalid category selected")
                 
-            # Create new transaction with proper decimal conversion
-            transaction = Transaction(
-                user_id=self.user_id,
-                account_id=self.account.id,
-                date=self.date_edit.date().toPyDate(),
-                type=transaction_type,
-                category_id=category.id,
-                amount=amount,  # Use float directly
-                currency=current_currency,
-                description=""
-            )
+            values = {
+                'user_id': self.user_id,
+                'account_id': self.account.id,
+                'date': datetime.combine(self.date_edit.date().toPyDate(), datetime.min.time()),
+                'type': transaction_type,
+                'category_id': category_id,
+                'amount': amount,  # Use float directly
+                'currency': current_currency,
+                'description': self.description_input.text().strip(),
+            }
+            if find_duplicate(self.session, values) is not None and not self.confirm_duplicate(values):
+                return
             
-            # Save transaction and update balance within transaction scope
-            with transaction_scope(self):
-                self.session.add(transaction)
-                
-                # Convert amount if currencies differ
-                if current_currency != self.account.currency:
-                    converted_amount = self.convert_amount(amount, current_currency, self.account.currency)
-                else:
-                    converted_amount = amount
-                    
-                # Update account balance with float
-                self.account.balance += converted_amount
-                
-                # Update UI
-                self.account = self.balance_inquiry.get_account()
-                self.balance = self.balance_inquiry.get_balance()  # Get balance from balance_inquiry
-                self.balance_label.setText(
-                    f"Current Balance: {self.account.currency} {self.balance:,.2f}"
-                )
-                
-                # Add to transactions table
-                self.add_transaction_to_table(transaction)
+            # Save transaction and update balance in one undoable step
+            converted_amount = self.convert_amount(amount, current_currency, self.account.currency)
+            self.run_command(AddTransaction(values, converted_amount))
                 
-            # Clear input and update charts
+            # Clear input and warn if a budget is exceeded
             self.amount_input.clear()
-            self.update_charts()
+            self.description_input.clear()
+            self.show_budget_warning(category_id, amount, values['date'])
                 
         except ValueError as e:
             QMessageBox.warning(self, "Input Error", str(e))
@@ -456,67 +855,315 @@ class AccountWindow(QMainWindow):
             self.session.rollback()
             QMessageBox.critical(self, "Database Error", f"Failed to save transaction: {str(e)}")
 
-    def add_transaction_to_table(self, transaction, running_balance=None):
-        amount = 0.00
+    @traced()
+    def edit_transaction(self):
+        """Apply the type, category and amount inputs to the selected transaction"""
+        current_row = self.transactions_table.currentRow()
+        if current_row < 0:
+            QMessageBox.warning(self, "Error", "Please select a transaction to update")
+            return
+        try:
+            transaction = self.session.get(Transaction, self.row_transaction_id(current_row))
+            if not transaction:
+                raise ValueError("Transaction not found in database")
+            amount = self.read_amount_input()
+            transaction_type = TransactionType.EXPENSE if self.type_combo.currentText() == "Expense" else TransactionType.INCOME
+            if transaction_type == TransactionType.EXPENSE:
+                amount = -amount
+            category_id = cached_category_id(self.session, self.category_combo.currentText())
+            if category_id is None:
+                raise ValueError("Invalid category selected")
+            
+            # Only the difference in the account's currency moves the balance
+            balance_delta = round(
+                self.convert_amount(amount, transaction.currency, self.account.currency)
+                - self.convert_amount(transaction.amount, transaction.currency, self.account.currency), 2)
+            command = EditTransaction(
+                transaction,
+                {'type': transaction_type, 'category_id': category_id, 'amount': amount},
+                balance_delta
+            )
+            if not command.changes:
+                return
+            self.run_command(command)
+            self.amount_input.clear()
+            self.show_budget_warning(category_id, amount, transaction.date)
+        except ValueError as e:
+            QMessageBox.warning(self, "Input Error", str(e))
+        except Exception as e:
+            QMessageBox.critical(self, "Database Error", f"Failed to update transaction: {str(e)}")
+
+    def suggest_category(self):
+        """Select the category a rule or the classifier gives the description"""
+        transaction_type = TransactionType.EXPENSE if self.type_combo.currentText() == "Expense" else TransactionType.INCOME
+        allowed = {category.id for category in self.context.categories if category.type == transaction_type}
+        description = self.description_input.text()
+        if self.rule_set is None:
+            self.rule_set = load_rules(self.session, self.user_id)
+        # The user's own rules win over learned suggestions
+        category_id = self.rule_set.match(description, transaction_type)
+        if category_id is not None:
+            self.category_combo.setCurrentText(self.context.category_name(category_id))
+            return
+        prediction = self.get_classifier().predict(description, allowed=allowed)
+        if prediction is not None and prediction.probability >= MIN_PROBABILITY:
+            self.category_combo.setCurrentText(self.context.category_name(prediction.category_id))
+
+    def get_classifier(self):
+        """The user's category classifier, loading it on first use"""
+        if self.classifier is None:
+            self.classifier = load_classifier(self.session, self.user_id)
+        return self.classifier
+
+    def teach_classifier(self, command, undone):
+        """Keep a loaded classifier in step with an add, delete or recategorization"""
+        if self.classifier is None:
+            return  # Loading it checks it against the ledger
+        sign = -1 if undone else 1
+        changes = []
+        if isinstance(command, AddTransaction):
+            values = command.values
+            changes.append((sign, command.transaction_id, values['description'], values['category_id']))
+        elif isinstance(command, DeleteTransaction):
+            values = command.values
+            changes.append((-sign, command.transaction_id, values['description'], values['category_id']))
+        elif isinstance(command, EditTransaction) and 'category_id' in command.changes:
+            old, new = command.changes['category_id']
+            transaction = self.session.get(Transaction, command.transaction_id)
+            description = transaction.description if transaction is not None else None
+            changes.append((-sign, command.transaction_id, description, old))
+            changes.append((sign, command.transaction_id, description, new))
         try:
-            row_position = self.transactions_table.rowCount()
-            self.transactions_table.insertRow(row_position)
-            
-            # Format date
-            date_item = QTableWidgetItem(transaction.date.strftime("%Y-%m-%d"))
-            self.transactions_table.setItem(row_position, 0, date_item)
-            
-            # Transaction type
-            type_item = QTableWidgetItem(transaction.type.value)
-            self.transactions_table.setItem(row_position, 1, type_item)
-            
-            # Category
-            category = self.session.query(Category).get(transaction.category_id)
-            category_item = QTableWidgetItem(category.name if category else "Unknown")
-            self.transactions_table.setItem(row_position, 2, category_item)
-            
-            # Amount with currency
-            #if (transaction.amount).isdigit():
-            #amount = float(transaction.amount)
-            amount = transaction.amount
-            amount_str = f"{transaction.currency} {abs(amount):,.2f}"
-            if amount < 0:
-                amount_str = f"{transaction.currency} -{abs(amount):,.2f}"
-            amount_item = QTableWidgetItem(amount_str)
-            amount_item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
-            self.transactions_table.setItem(row_position, 3, amount_item)
-            
-            # Calculate running balance
-            if running_balance is not None:
-                new_balance = running_balance
+            if sync_classifier(self.session, self.classifier, self.user_id, changes):
+                self.classifier.save(classifier_path(self.user_id))
+        except OSError as e:
+            # Suggestions are a convenience; the change is already saved
+            QMessageBox.warning(self, "Classifier", f"Could not save category suggestions: {str(e)}")
+
+    def confirm_duplicate(self, values):
+        """Ask before adding a transaction identical to one already in the ledger"""
+        reply = QMessageBox.question(
+            self, 'Possible Duplicate',
+            f"A transaction of {values['amount']:,.2f} {values['currency']} on "
+            f"{values['date']:%Y-%m-%d} is already recorded. Add it again?",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+            QMessageBox.StandardButton.No
+        )
+        return reply == QMessageBox.StandardButton.Yes
+
+    def read_amount_input(self):
+        """Parse the amount input as a positive float"""
+        amount_str = self.amount_input.text().strip().replace(',', '')
+        amount = abs(self.parse_amount_string(amount_str))
+        if amount == 0:
+            raise ValueError("Please enter a valid amount (e.g., 123.45)")
+        return amount
+
+    def run_command(self, command):
+        """Execute a command through the log and update the view from its delta"""
+        self.command_log.execute(command)
+        self.apply_command_to_view(command, undone=False)
+        self.note_activity()
+
+    @traced()
+    def undo(self):
+        try:
+            command = self.command_log.undo()
+            if command is not None:
+                self.apply_command_to_view(command, undone=True)
+                self.note_activity()
+        except Exception as e:
+            QMessageBox.critical(self, "Undo Error", f"Failed to undo: {str(e)}")
+
+    @traced()
+    def redo(self):
+        try:
+            command = self.command_log.redo()
+            if command is not None:
+                self.apply_command_to_view(command, undone=False)
+                self.note_activity()
+        except Exception as e:
+            QMessageBox.critical(self, "Redo Error", f"Failed to redo: {str(e)}")
+
+    def apply_command_to_view(self, command, undone):
+        """Update the table, balances and rates from a command's delta
+
+        Rows before the change keep their running balance; later rows are
+        shifted by the balance delta, so nothing is reloaded.
+        """
+        if isinstance(command, AddTransaction):
+            if undone:
+                self.remove_transaction_row(self.find_transaction_row(command.transaction_id),
+                                            command.balance_delta)
             else:
-                if row_position == 0:
-                    new_balance = amount
-                else:
-                    # Get the balance from the database, not the screen
-                    prev_balance = self.balance_inquiry.get_balance()
-                    new_balance = round(prev_balance + amount, 2)
-
-            # Format balance
-            balance_item = QTableWidgetItem(f"{transaction.currency} {new_balance:,.2f}")
-            balance_item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
-            self.transactions_table.setItem(row_position, 4, balance_item)
-            
-            # Color code amounts
-            if amount < 0:
-                amount_item.setForeground(Qt.GlobalColor.red)
+                row = command.row if command.row is not None else self.transactions_table.rowCount()
+                command.row = self.insert_transaction_row(
+                    SimpleNamespace(id=command.transaction_id, **command.values), row,
+                    command.balance_delta)
+        elif isinstance(command, DeleteTransaction):
+            if undone:
+                self.insert_transaction_row(SimpleNamespace(**command.values), command.row,
+                                            -command.balance_delta)
             else:
-                amount_item.setForeground(Qt.GlobalColor.darkGreen)
-                
+                self.remove_transaction_row(self.find_transaction_row(command.transaction_id),
+                                            -command.balance_delta)
+        elif isinstance(command, EditTransaction):
+            row = self.find_transaction_row(command.transaction_id)
+            if row is not None:
+                index = 0 if undone else 1
+                values = {name: change[index] for name, change in command.changes.items()}
+                self.set_transaction_cells(row, SimpleNamespace(
+                    **{**self.row_values(row), **values}))
+                self.shift_running_balances(row, -command.balance_delta if undone else command.balance_delta)
+        elif isinstance(command, CurrencyChange):
+            old, new = (command.new_currency, command.old_currency) if undone else \
+                (command.old_currency, command.new_currency)
+            self.convert_running_balances(old, new)
+            # Keep the combo in sync without triggering another change
+            self.currency_combo.blockSignals(True)
+            self.currency_combo.setCurrentText(new)
+            self.currency_combo.blockSignals(False)
+        elif isinstance(command, RateChange):
+            self.context.reload_rates()
+            self.load_exchange_rates()
+        self.teach_classifier(command, undone)
+        
+        self.balance = float(self.account.balance)
+        self.balance_label.setText(
+            f"Current Balance: {self.account.currency} {self.balance:,.2f}"
+        )
+        self.update_balances()
+        self.update_undo_buttons()
+
+    def update_undo_buttons(self):
+        undo_label = self.command_log.undo_stack[-1].label if self.command_log.can_undo else ""
+        redo_label = self.command_log.redo_stack[-1].label if self.command_log.can_redo else ""
+        self.undo_btn.setEnabled(self.command_log.can_undo)
+        self.undo_btn.setToolTip(f"Undo {undo_label}".strip())
+        self.redo_btn.setEnabled(self.command_log.can_redo)
+        self.redo_btn.setToolTip(f"Redo {redo_label}".strip())
+
+    def add_transaction_to_table(self, transaction, running_balance=None):
+        """Append a transaction row, continuing the running balance"""
+        try:
+            row = self.transactions_table.rowCount()
+            amount = self.convert_amount(transaction.amount, transaction.currency, self.account.currency)
+            if running_balance is None:
+                running_balance = round(self.running_balance_at(row - 1) + amount, 2)
+            self.transactions_table.insertRow(row)
+            self.set_transaction_cells(row, transaction)
+            self.set_running_balance(row, running_balance)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to add transaction to table: {str(e)}")
 
+    def set_transaction_cells(self, row, transaction):
+        """Fill the date, type, category and amount cells of a row"""
+        # The id lets commands find the row again after rows move
+        date_item = QTableWidgetItem(transaction.date.strftime("%Y-%m-%d"))
+        date_item.setData(Qt.ItemDataRole.UserRole, transaction.id)
+        self.transactions_table.setItem(row, 0, date_item)
+        
+        # Transaction type
+        type_item = QTableWidgetItem(transaction.type.value)
+        self.transactions_table.setItem(row, 1, type_item)
+        
+        # Category
+        category_name = self.context.category_name(transaction.category_id)
+        category_item = QTableWidgetItem(category_name or "Unknown")
+        category_item.setData(Qt.ItemDataRole.UserRole, transaction.category_id)
+        self.transactions_table.setItem(row, 2, category_item)
+        
+        # Amount with currency
+        amount = transaction.amount
+        amount_str = f"{transaction.currency} {abs(amount):,.2f}"
+        if amount < 0:
+            amount_str = f"{transaction.currency} -{abs(amount):,.2f}"
+        amount_item = QTableWidgetItem(amount_str)
+        amount_item.setData(Qt.ItemDataRole.UserRole, (amount, transaction.currency))
+        amount_item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+        
+        # Color code amounts
+        if amount < 0:
+            amount_item.setForeground(Qt.GlobalColor.red)
+        else:
+            amount_item.setForeground(Qt.GlobalColor.darkGreen)
+        self.transactions_table.setItem(row, 3, amount_item)
+
+    def row_values(self, row):
+        """Transaction fields shown in a row, read back from the table"""
+        amount, currency = self.transactions_table.item(row, 3).data(Qt.ItemDataRole.UserRole)
+        return {
+            'id': self.row_transaction_id(row),
+            'date': datetime.strptime(self.transactions_table.item(row, 0).text(), "%Y-%m-%d"),
+            'type': TransactionType(self.transactions_table.item(row, 1).text()),
+            'category_id': self.transactions_table.item(row, 2).data(Qt.ItemDataRole.UserRole),
+            'amount': amount,
+            'currency': currency,
+        }
+
+    def row_transaction_id(self, row):
+        return self.transactions_table.item(row, 0).data(Qt.ItemDataRole.UserRole)
+
+    def find_transaction_row(self, transaction_id):
+        for row in range(self.transactions_table.rowCount()):
+            if self.row_transaction_id(row) == transaction_id:
+                return row
+        return None
+
+    def opening_balance(self):
+        """Transactions of archived years carried forward, in the account's currency"""
+        return round(sum(
+            self.convert_amount(opening.total_minor / 100.0, opening.currency, self.account.currency)
+            for opening in self.account.opening_balances
+        ), 2)
+
+    def running_balance_at(self, row):
+        """Running balance after a row, in the account's currency"""
+        if row < 0:
+            return self.opening_balance()
+        return self.transactions_table.item(row, 4).data(Qt.ItemDataRole.UserRole)
+
+    def set_running_balance(self, row, balance):
+        balance_item = QTableWidgetItem(f"{self.account.currency} {balance:,.2f}")
+        balance_item.setData(Qt.ItemDataRole.UserRole, balance)
+        balance_item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+        self.transactions_table.setItem(row, 4, balance_item)
+
+    def shift_running_balances(self, from_row, delta):
+        """Add delta to the running balance of from_row and every row after it"""
+        if not delta:
+            return
+        for row in range(from_row, self.transactions_table.rowCount()):
+            self.set_running_balance(row, round(self.running_balance_at(row) + delta, 2))
+
+    def convert_running_balances(self, from_curr, to_curr):
+        for row in range(self.transactions_table.rowCount()):
+            self.set_running_balance(row, self.convert_amount(self.running_balance_at(row), from_curr, to_curr))
+
+    def insert_transaction_row(self, transaction, row, amount):
+        """Insert a row at its old position and shift the rows after it"""
+        row = min(row, self.transactions_table.rowCount())
+        self.transactions_table.insertRow(row)
+        self.set_transaction_cells(row, transaction)
+        self.set_running_balance(row, round(self.running_balance_at(row - 1) + amount, 2))
+        self.shift_running_balances(row + 1, amount)
+        return row
+
+    def remove_transaction_row(self, row, amount):
+        """Remove a row whose running-balance contribution was amount"""
+        if row is None:
+            return
+        self.transactions_table.removeRow(row)
+        self.shift_running_balances(row, -amount)
+
     def update_currency(self):
         self.balance_label.setText(
             f"Current Balance: {self.currency_combo.currentText()} {self.balance:,.2f}")
     
+    @traced()
     def update_charts(self):
         self.ax.clear()
+        self.ax.set_position([0, 0, 1, 1])
         
         # Group transactions by category
         expenses = {}
@@ -542,19 +1189,73 @@ class AccountWindow(QMainWindow):
                     f"Error processing amount in row {row + 1}: {str(e)}"
                 )
         
-        # Create pie chart
-        if expenses:
-            labels = expenses.keys()
-            sizes = expenses.values()
-            self.ax.pie(sizes, labels=labels, autopct='%1.1f%%')
-            self.ax.set_title("Expenses by Category")
+        # Rendered offscreen through the chart cache, so unchanged data is a file read
+        # Rounded so float summation noise doesn't change the cache key
+        series = sorted(((category, round(total, 2)) for category, total in expenses.items()),
+                        key=lambda item: (-item[1], item[0]))
+        if series:
+            figure_width, figure_height = self.figure.get_size_inches()
+            png = chart_cache.render('expenses_by_category', series, 'png', {
+                'width': round(float(figure_width), 2),
+                'height': round(float(figure_height), 2),
+                'dpi': int(self.figure.dpi),
+            })
+            self.ax.imshow(imread(io.BytesIO(png), format='png'))
+        self.ax.axis('off')
         
-        self.canvas.draw()
+        with tracer.span('render'):
+            self.canvas.draw()
     
+    @traced()
     def export_to_csv(self):
-        # Add CSV export logic here
-        pass
+        """Export the account's transactions to a CSV file"""
+        try:
+            filename, _ = QFileDialog.getSaveFileName(
+                self,
+                "Export Transactions",
+                "",
+                "CSV Files (*.csv);;All Files (*)"
+            )
+            if not filename:
+                return
+            
+            # Streamed as read-only rows, so the history is never held in memory
+            count = 0
+            with open(filename, 'w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(["Date", "Type", "Category", "Amount", "Currency", "Description"])
+                for row in iter_rows_in_range(self.session, account_id=self.account.id):
+                    writer.writerow([
+                        row.date.strftime("%Y-%m-%d"),
+                        row.type.value,
+                        self.context.category_name(row.category_id) or "Unknown",
+                        f"{row.amount:.2f}",
+                        row.currency,
+                        row.description or "",
+                    ])
+                    count += 1
+            
+            QMessageBox.information(self, "Success", f"Exported {count:,} transactions to {filename}")
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to export: {str(e)}")
+    
+    def export_to_parquet(self):
+        """Export transactions, categories and rates for analytics"""
+        try:
+            out_dir = QFileDialog.getExistingDirectory(self, "Export to Parquet")
+            if not out_dir:
+                return
+            from columnar import export_all
+            counts = export_all(self.session.get_bind(), out_dir)
+            QMessageBox.information(
+                self, 
+                "Success", 
+                f"Exported {counts['transactions']:,} transactions to {out_dir}"
+            )
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to export: {str(e)}")
     
+    @traced()
     def delete_transaction(self):
         current_row = self.transactions_table.currentRow()
         if current_row < 0:
@@ -562,44 +1263,16 @@ class AccountWindow(QMainWindow):
             return
             
         try:
-            with transaction_scope(self):
-                # Get transaction details
-                date_str = self.transactions_table.item(current_row, 0).text()
-                amount_text = self.transactions_table.item(current_row, 3).text()
-                amount = self.parse_amount_string(amount_text)
-                
-                # Find transaction in database
-                transaction = self.session.query(Transaction)\
-                    .filter(Transaction.user.has(username=self.username))\
-                    .filter(Transaction.date == datetime.strptime(date_str, "%Y-%m-%d"))\
-                    .filter(Transaction.amount == amount)\
-                    .first()
-                
-                if not transaction:
-                    raise ValueError("Transaction not found in database")
-                
-                # Get and update account balance
-                account = self.session.query(Account)\
-                    .filter_by(user_id=self.user_id)\
-                    .first()
-                
-                if account:
-                    # Reverse the transaction amount
-                    account.balance -= transaction.amount
-                    
-                # Delete the transaction
-                self.session.delete(transaction)
-                
-                # Remove from table and update UI
-                self.transactions_table.removeRow(current_row)
-                self.update_balances()
-                self.update_charts()
-                
-                # Update balance display with new account balance
-                self.balance = float(account.balance)
-                self.balance_label.setText(
-                    f"Current Balance: {self.currency_combo.currentText()} {self.balance:,.2f}"
-                )
+            # Rows carry their transaction id, so no lookup by date and amount
+            transaction = self.session.get(Transaction, self.row_transaction_id(current_row))
+            if not transaction:
+                raise ValueError("Transaction not found in database")
+            
+            # Reverse the transaction amount in the account's currency
+            balance_delta = -self.convert_amount(
+                transaction.amount, transaction.currency, self.account.currency
+            )
+            self.run_command(DeleteTransaction(transaction, balance_delta, row=current_row))
                 
         except ValueError as e:
             QMessageBox.warning(self, "Error", str(e))
@@ -627,66 +1300,25 @@ class AccountWindow(QMainWindow):
     def update_balances(self):
         """Update balances in all currencies using float"""
         try:
-            with transaction_scope(self):
-                # Get base balance from balance_inquiry
-                self.account = self.balance_inquiry.get_account()
-                if not self.account:
-                    QMessageBox.critical(self, "Account Error", "Account not found.")
-                    return
-                base_balance = self.balance_inquiry.get_balance()  # Get balance from balance_inquiry
-                
-                # Update balance in all currencies
-                for currency, label in self.balance_labels.items():
-                    if currency == self.account.currency:
-                        balance = base_balance
-                    else:
-                        balance = self.convert_amount(base_balance, self.account.currency, currency)
-                    label.setText(f"{currency} {balance:,.2f}")
-                
-                # Update running balances in transaction table
-                running_balance_sgd = 0.0
-                running_balance_account = 0.0
-                
-                for row in range(self.transactions_table.rowCount()):
-                    # Get amount from amount column
-                    amount_text = self.transactions_table.item(row, 3).text()
-                    curr,amt = amount_text.split() # Get currency
-                    amount = float(amt.replace(',', '')) # Get amount
-                    print(f'curr: {curr}, amount: {amount}')
+            # Read-only: no transaction scope, so loaded rows aren't expired
+            # Get base balance from balance_inquiry
+            self.account = self.balance_inquiry.get_account()
+            if not self.account:
+                QMessageBox.critical(self, "Account Error", "Account not found.")
+                return
+            base_balance = self.balance_inquiry.get_balance()  # Get balance from balance_inquiry
+            
+            # Update balance in all currencies; running balances in the
+            # table are kept current as rows change, so no rescan here
+            for currency, label in self.balance_labels.items():
+                if currency == self.account.currency:
+                    balance = base_balance
+                else:
+                    balance = self.convert_amount(base_balance, self.account.currency, currency)
+                label.setText(f"{currency} {balance:,.2f}")
                     
-                    try:
-                        # Parse amount using the improved method
-                        #amount = self.parse_amount_string(amount_text)
-                        
-                        # Convert to SGD and account currency
-                        if curr != 'SGD':
-                            amount_sgd = self.convert_amount(amount, curr, 'SGD')
-                        else:
-                            amount_sgd = amount
-                            
-                        if curr != self.account.currency:
-                            amount_account = self.convert_amount(amount, curr, self.account.currency)
-                        else:
-                            amount_account = amount
-                        
-                        running_balance_sgd = round(running_balance_sgd + amount_sgd, 2)
-                        running_balance_account = round(running_balance_account + amount_account, 2)
-                        
-                        # Update balance column
-                        balance_text = f"SGD {running_balance_sgd:,.2f} / {self.account.currency} {running_balance_account:,.2f}"
-                        balance_item = QTableWidgetItem(balance_text)
-                        balance_item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
-                        self.transactions_table.setItem(row, 4, balance_item)
-                        
-                    except ValueError as e:
-                        QMessageBox.warning(
-                            self, 
-                            "Conversion Error", 
-                            f"Error processing amount in row {row + 1}: {str(e)}"
-                        )
-                        
-                # Update charts
-                self.update_charts()
+            # Update charts
+            self.update_charts()
                 
         except Exception as e:
             QMessageBox.critical(
@@ -698,11 +1330,9 @@ class AccountWindow(QMainWindow):
     def load_exchange_rates(self):
         """Load exchange rates from database"""
         try:
-            from models import ExchangeRate
-            rates = self.session.query(ExchangeRate).all()
             self.rate_table.setRowCount(0)
             
-            for rate in rates:
+            for rate in self.context.exchange_rates:
                 row = self.rate_table.rowCount()
                 self.rate_table.insertRow(row)
                 self.rate_table.setItem(row, 0, QTableWidgetItem(rate.from_currency))
@@ -715,6 +1345,94 @@ class AccountWindow(QMainWindow):
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to load exchange rates: {str(e)}")
 
+    def load_budgets(self):
+        """Fill the budgets table with the current period's spending"""
+        try:
+            statuses = list_budgets(self.session, self.user_id)
+            self.budget_table.setRowCount(len(statuses))
+            for row, status in enumerate(statuses):
+                self.budget_table.setItem(row, 0, QTableWidgetItem(status.category))
+                self.budget_table.setItem(row, 1, QTableWidgetItem(status.period.value.title()))
+                self.budget_table.setItem(row, 2, QTableWidgetItem(f"{status.currency} {status.limit:,.2f}"))
+                self.budget_table.setItem(row, 3, QTableWidgetItem(f"{status.spent:,.2f}"))
+                self.budget_table.setItem(row, 4, QTableWidgetItem(f"{status.remaining:,.2f}"))
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to load budgets: {str(e)}")
+
+    def update_budget(self):
+        """Create or update the budget for the selected category"""
+        try:
+            category_name = self.budget_category.currentText()
+            category_id = next((category.id for category in self.context.categories
+                                if category.name == category_name), None)
+            if category_id is None:
+                raise ValueError("Invalid category selected")
+            limit_amount = self.parse_amount_string(self.budget_input.text().strip().replace(',', ''))
+            period = BudgetPeriod(self.budget_period.currentText().upper())
+            with transaction_scope(self):
+                set_budget(self.session, self.user_id, category_id, limit_amount,
+                           self.account.currency, period)
+            self.budget_input.clear()
+            self.load_budgets()
+        except ValueError as e:
+            QMessageBox.warning(self, "Input Error", str(e))
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to set budget: {str(e)}")
+
+    def add_recurring(self):
+        """Save a recurring template for the selected category and schedule"""
+        try:
+            amount = self.parse_amount_string(self.recurring_amount.text().strip().replace(',', ''))
+            if amount == 0:
+                raise ValueError("Please enter a valid amount (e.g., 123.45)")
+            amount = abs(amount)
+            if self.recurring_type.currentText() == "Expense":
+                amount = -amount
+            category_name = self.recurring_category.currentText()
+            category_id = next((category.id for category in self.context.categories
+                                if category.name == category_name), None)
+            if category_id is None:
+                raise ValueError("Invalid category selected")
+            with transaction_scope(self):
+                add_template(self.session, self.user_id, self.account.id, category_id, amount,
+                             self.currency_combo.currentText(),
+                             self.recurring_schedule.text().strip())
+            self.recurring_amount.clear()
+            self.recurring_schedule.clear()
+        except ValueError as e:
+            QMessageBox.warning(self, "Input Error", str(e))
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to add recurring transaction: {str(e)}")
+
+    @traced()
+    def run_recurring(self):
+        """Add recurring transactions due since the last run and refresh the view"""
+        try:
+            with transaction_scope(self):
+                result = run_due(self.session, user_id=self.user_id)
+            if result.inserted:
+                self.load_account_data()
+                self.update_charts()
+            QMessageBox.information(self, "Recurring Transactions",
+                                    f"Added {result.inserted} recurring transaction(s)")
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to add recurring transactions: {str(e)}")
+
+    def show_budget_warning(self, category_id, amount, date):
+        """Warn inline if an expense's category is over budget"""
+        if amount >= 0:
+            self.budget_label.setText("")
+            return
+        exceeded = exceeded_budgets(self.session, self.user_id, category_id, date)
+        self.budget_label.setText("\n".join(
+            f"Over {status.period.value.lower()} budget for {status.category}: "
+            f"{status.currency} {status.spent:,.2f} of {status.limit:,.2f}"
+            for status in exceeded
+        ))
+        if hasattr(self, 'budget_table'):
+            self.load_budgets()
+
+    @traced()
     def update_exchange_rate(self):
         """Add or update exchange rate"""
         try:
@@ -725,31 +1443,14 @@ class AccountWindow(QMainWindow):
                 raise ValueError("From and To currencies must be different")
                 
             try:
-                if (self.rate_input.text()).isdigit():
-                    rate = float(self.rate_input.text())
+                rate = float(self.rate_input.text().strip())
                 if rate <= 0:
                     raise ValueError("Rate must be positive")
             except ValueError:
                 raise ValueError("Please enter a valid rate")
-            
-            from models import ExchangeRate
-            # Check if rate exists
-            existing_rate = self.session.query(ExchangeRate)\
-                .filter_by(from_currency=from_curr, to_currency=to_curr)\
-                .first()
-                
-            with transaction_scope(self):
-                if existing_rate:
-                    existing_rate.rate = rate
-                else:
-                    new_rate = ExchangeRate(
-                        from_currency=from_curr,
-                        to_currency=to_curr,
-                        rate=rate
-                    )
-                    self.session.add(new_rate)
-                
-            self.load_exchange_rates()
+
+            old_rate = self.context.rates.get((from_curr, to_curr))
+            self.run_command(RateChange(from_curr, to_curr, old_rate, rate))
             self.rate_input.clear()
             QMessageBox.information(self, "Success", "Exchange rate updated successfully")
             
@@ -764,21 +1465,11 @@ class AccountWindow(QMainWindow):
             return round(float(amount), 2)
             
         try:
-            # Get conversion rate
-            rate = self.session.query(ExchangeRate)\
-                .filter_by(from_currency=from_curr, to_currency=to_curr)\
-                .first()
+            # Get conversion rate, falling back to the reverse pair
+            rate = self.context.get_rate(from_curr, to_curr)
                 
             if rate:
-                return round(float(amount) * rate.rate, 2)
-                
-            # Try reverse rate
-            reverse_rate = self.session.query(ExchangeRate)\
-                .filter_by(from_currency=to_curr, to_currency=from_curr)\
-                .first()
-                
-            if reverse_rate:
-                return round(float(amount) / reverse_rate.rate, 2)
+                return round(float(amount) * rate, 2)
                 
             raise ValueError(f"No exchange rate found for {from_curr} to {to_curr}")
                 
@@ -786,33 +1477,17 @@ class AccountWindow(QMainWindow):
             QMessageBox.critical(self, "Conversion Error", str(e))
             return round(float(amount), 2)
 
+    @traced()
     def handle_currency_change(self, new_currency:str):
         """Handle currency change and update all amounts"""
+        old_currency = self.account.currency
         try:
-            old_currency = self.account.currency
             if old_currency == new_currency:
                 return
             
-            # Update account currency in database
-            with transaction_scope(self):
-                # Convert account balance
-                self.balance = self.convert_amount(
-                    self.balance, 
-                    old_currency, 
-                    new_currency
-                )
-                self.account.currency = new_currency
-                self.account.balance = self.balance
-                
-                # Update balance display
-                self.account = self.balance_inquiry.get_account()
-                self.balance = self.balance_inquiry.get_balance()  # Get balance from balance_inquiry
-                self.balance_label.setText(
-                    f"Current Balance: {new_currency} {self.balance:,.2f}"
-                )
-                
-                # Reload transactions with new currency
-                self.load_transactions()
+            # Convert account balance and record the change for undo
+            new_balance = self.convert_amount(self.account.balance, old_currency, new_currency)
+            self.run_command(CurrencyChange(self.account, new_currency, new_balance))
                 
         except Exception as e:
             QMessageBox.critical(
@@ -821,9 +1496,11 @@ class AccountWindow(QMainWindow):
                 f"Failed to update currency: {str(e)}"
             )
             # Revert currency combo box
+            self.currency_combo.blockSignals(True)
             index = self.currency_combo.findText(old_currency)
             if index >= 0:
                 self.currency_combo.setCurrentIndex(index)
+            self.currency_combo.blockSignals(False)
 
     def parse_amount_string(self, amount_str):
         """Parse amount string to float, handling currency symbols and formatting"""
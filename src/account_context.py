@@ -0,0 +1,88 @@
+from sqlalchemy.orm import joinedload
+from models import User, Account, Category
+from query_cache import cached_exchange_rates
+from transaction_rows import load_transaction_rows
+
+# Transactions painted before the rest of the history is fetched
+DEFAULT_PAGE_SIZE = 200
+
+class AccountContext:
+    """User, accounts, categories, rates and the first page of transactions
+
+    Loaded once when an account is opened and shared by BalanceInquiry and
+    AccountWindow so they don't each query the same rows again.
+    """
+    def __init__(self, session, user, categories, exchange_rates, first_page, page_size):
+        self.session = session
+        self.user = user
+        self.accounts = sorted(user.accounts, key=lambda account: account.id)
+        self.categories = categories
+        self.category_names = {category.id: category.name for category in categories}
+        self.exchange_rates = exchange_rates
+        self.rates = {(rate.from_currency, rate.to_currency): rate.rate for rate in exchange_rates}
+        self.page_size = page_size
+        # One extra row is fetched to know whether more pages exist
+        self.has_more = len(first_page) > page_size
+        self.first_page = first_page[:page_size]
+
+    @property
+    def account(self):
+        """The user's primary account"""
+        return self.accounts[0]
+
+    def category_name(self, category_id):
+        """Get a category name, querying only for categories added since loading"""
+        if category_id not in self.category_names:
+            category = self.session.get(Category, category_id)
+            if category is None:
+                return None
+            self.categories.append(category)
+            self.category_names[category.id] = category.name
+        return self.category_names[category_id]
+
+    def get_rate(self, from_curr, to_curr):
+        """Get the rate between two currencies, falling back to the inverse pair"""
+        rate = self.rates.get((from_curr, to_curr))
+        if rate:
+            return rate
+        reverse_rate = self.rates.get((to_curr, from_curr))
+        if reverse_rate:
+            return 1 / reverse_rate
+        return None
+
+    def reload_rates(self):
+        """Refresh exchange rates after they were changed"""
+        self.exchange_rates = cached_exchange_rates(self.session)
+        self.rates = {(rate.from_currency, rate.to_currency): rate.rate for rate in self.exchange_rates}
+
+    def take_first_page(self):
+        """Return the preloaded first page once; later calls return None"""
+        page, self.first_page = self.first_page, None
+        return page
+
+    def load_transactions(self, offset=0):
+        """Load the account's transactions in date order, starting at offset
+
+        Returns read-only TransactionRow tuples, not ORM instances.
+        """
+        return load_transaction_rows(self.session, self.account.id, offset)
+
+def load_account_context(session, username, page_size=DEFAULT_PAGE_SIZE):
+    """Load everything needed to open an account in at most four queries
+
+    Exchange rates come from the query cache when they haven't changed.
+    """
+    user = session.query(User)\
+        .options(joinedload(User.accounts).joinedload(Account.opening_balances))\
+        .filter_by(username=username)\
+        .first()
+    if not user:
+        raise ValueError(f"User '{username}' not found")
+    if not user.accounts:
+        raise ValueError("No account found for user")
+
+    account = min(user.accounts, key=lambda account: account.id)
+    categories = session.query(Category).all()
+    exchange_rates = cached_exchange_rates(session)
+    first_page = load_transaction_rows(session, account.id, limit=page_size + 1)
+    return AccountContext(session, user, categories, exchange_rates, first_page, page_size)
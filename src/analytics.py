@@ -0,0 +1,154 @@
+"""Vectorized reports over a typed DataFrame of transactions.
+
+Transactions are loaded once with read_sql into fixed dtypes (categorical
+currency/category/type, int64 cents, datetime64 dates) and cached until
+the database changes. On SQLite the cache key is PRAGMA data_version read
+from a dedicated connection, which changes whenever any other connection
+commits; other databases fall back to a cheap aggregate fingerprint.
+"""
+import sqlite3
+import pandas as pd
+from sqlalchemy import select, func
+from models import Account, Transaction, Category, ExchangeRate
+from archive import transaction_tables
+
+# The type column is an Enum and is converted to a category after loading
+FRAME_DTYPES = {
+    'id': 'int64',
+    'account_id': 'int64',
+    'category': 'category',
+    'currency': 'category',
+    'amount_minor': 'int64',
+}
+
+def _transactions_query(table, account_id=None):
+    # Archive files keep the rows of deleted accounts; the join leaves them out
+    query = select(
+        table.c.id,
+        table.c.account_id,
+        table.c.date,
+        table.c.type,
+        Category.name.label('category'),
+        table.c.currency,
+        func.round(table.c.amount * 100).label('amount_minor'),
+    ).join(Category, Category.id == table.c.category_id)\
+        .join(Account, Account.id == table.c.account_id)
+    if account_id is not None:
+        query = query.where(table.c.account_id == account_id)
+    return query
+
+def load_transactions_frame(connection, account_id=None):
+    """Load transactions, archived years included, into a DataFrame with explicit dtypes"""
+    frames = [
+        pd.read_sql(_transactions_query(table, account_id), connection, parse_dates=['date'])
+        for table in transaction_tables(connection)
+    ]
+    # Categories are set after concatenating, which would drop differing ones
+    frame = pd.concat(frames, ignore_index=True).astype(FRAME_DTYPES)
+    frame['type'] = frame['type'].map(lambda value: getattr(value, 'value', value)).astype('category')
+    frame['date'] = frame['date'].astype('datetime64[ns]')
+    return frame
+
+def load_rates(connection):
+    """Exchange rates as a {(from, to): rate} dict"""
+    rows = connection.execute(select(ExchangeRate.from_currency, ExchangeRate.to_currency,
+                                     ExchangeRate.rate)).all()
+    return {(from_curr, to_curr): rate for from_curr, to_curr, rate in rows}
+
+def rate_to(rates, from_curr, to_curr):
+    """Rate from one currency to another, using the inverse pair if needed"""
+    if from_curr == to_curr:
+        return 1.0
+    if (from_curr, to_curr) in rates:
+        return rates[(from_curr, to_curr)]
+    if (to_curr, from_curr) in rates:
+        return 1.0 / rates[(to_curr, from_curr)]
+    raise ValueError(f"No exchange rate found for {from_curr} to {to_curr}")
+
+def with_base_amounts(frame, rates, base_currency):
+    """Add an amount column converted to base_currency"""
+    factors = {currency: rate_to(rates, currency, base_currency)
+               for currency in frame['currency'].cat.categories}
+    factor = frame['currency'].map(factors).astype('float64')
+    return frame.assign(amount=frame['amount_minor'] / 100.0 * factor)
+
+def category_by_month(frame, rates, base_currency):
+    """Net amount per category (rows) and month (columns) in base_currency"""
+    converted = with_base_amounts(frame, rates, base_currency)
+    return converted.pivot_table(
+        index='category',
+        columns=converted['date'].dt.to_period('M'),
+        values='amount',
+        aggfunc='sum',
+        fill_value=0.0,
+        observed=True,
+    ).round(2)
+
+def currency_exposure(frame, rates, base_currency):
+    """Net holdings per currency, in that currency and in base_currency"""
+    totals = frame.groupby('currency', observed=True)['amount_minor'].sum() / 100.0
+    exposure = totals.to_frame('amount')
+    exposure[f'amount_{base_currency}'] = [
+        amount * rate_to(rates, currency, base_currency) for currency, amount in totals.items()
+    ]
+    total = exposure[f'amount_{base_currency}'].abs().sum()
+    exposure['share'] = exposure[f'amount_{base_currency}'].abs() / total if total else 0.0
+    return exposure.round(4)
+
+def savings_rate(frame, rates, base_currency):
+    """Income, expenses and savings rate per month in base_currency"""
+    converted = with_base_amounts(frame, rates, base_currency)
+    month = converted['date'].dt.to_period('M')
+    income = converted['amount'].clip(lower=0).groupby(month).sum()
+    expenses = converted['amount'].clip(upper=0).groupby(month).sum().abs()
+    report = pd.DataFrame({'income': income, 'expenses': expenses})
+    report['savings'] = report['income'] - report['expenses']
+    report['savings_rate'] = (report['savings'] / report['income'].where(report['income'] != 0)).fillna(0.0)
+    return report.round(4)
+
+class AnalyticsEngine:
+    """Caches the transactions frame until the database changes"""
+    def __init__(self, engine):
+        self.engine = engine
+        self._version_connection = None
+        if engine.url.get_backend_name() == 'sqlite' and engine.url.database:
+            # Never writes, so its data_version moves on every commit by the app
+            self._version_connection = sqlite3.connect(engine.url.database, check_same_thread=False)
+        self._cache = {}
+
+    def data_version(self):
+        """A value that changes whenever transactions or rates may have changed"""
+        if self._version_connection is not None:
+            return self._version_connection.execute('PRAGMA data_version').fetchone()[0]
+        with self.engine.connect() as connection:
+            transactions = connection.execute(select(
+                func.count(Transaction.id), func.max(Transaction.id), func.sum(Transaction.amount)
+            )).one()
+            rates = connection.execute(select(func.max(ExchangeRate.updated_at))).scalar()
+        return tuple(transactions) + (rates,)
+
+    def frame(self, account_id=None):
+        """Transactions and rates, reloaded only if the database changed"""
+        version = self.data_version()
+        cached = self._cache.get(account_id)
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+        with self.engine.connect() as connection:
+            frame = load_transactions_frame(connection, account_id)
+            rates = load_rates(connection)
+        self._cache[account_id] = (version, frame, rates)
+        return frame, rates
+
+    def report(self, base_currency='SGD', account_id=None):
+        """All pivot reports for the given account, or every account"""
+        frame, rates = self.frame(account_id)
+        return {
+            'category_by_month': category_by_month(frame, rates, base_currency),
+            'currency_exposure': currency_exposure(frame, rates, base_currency),
+            'savings_rate': savings_rate(frame, rates, base_currency),
+        }
+
+    def close(self):
+        if self._version_connection is not None:
+            self._version_connection.close()
+            self._version_connection = None
@@ -0,0 +1,307 @@
+"""Archival of closed years into per-year SQLite files.
+
+archive_through(session, 2023) moves every transaction dated up to the end
+of 2023 out of the main database, one file per year (archive/<db>-2023.db
+in the data directory), and adds what each account moved, per currency, to
+its OpeningBalance. Running balances and the reconciler start from the
+opening balances, so the main transactions table and its indexes only hold
+open years and stay small enough to live in the page cache.
+
+Archived years are read only when asked for: iter_rows_in_range ATTACHes a
+year's file to the connection the first time a date range reaches it and
+keeps it attached for later queries on that connection. Reports and exports
+that need every year read each table transaction_tables yields in turn.
+
+    python archive.py --through 2023
+    python archive.py --list
+"""
+import argparse
+import os
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from sqlalchemy import MetaData, select, delete, update, func
+from sqlalchemy.schema import CreateTable, CreateIndex
+import config
+from models import (Transaction, BalanceCheckpoint, OpeningBalance, ArchivedYear, FINGERPRINT_FIELDS,
+                    session_scope, init_db, dialect_insert, next_fingerprint)
+from transaction_rows import iter_transaction_rows, DEFAULT_BATCH_SIZE
+
+ARCHIVE_DIRNAME = 'archive'
+# SQLite allows 10 attached databases per connection by default
+MAX_ATTACHED = 8
+
+# Main rows in [start, end); dates are stored as ISO strings
+_IN_RANGE = "main.transactions.date >= ? AND main.transactions.date < ?"
+
+ArchiveResult = namedtuple('ArchiveResult', ['year', 'path', 'transactions', 'accounts'])
+
+def archive_dir():
+    path = os.path.join(config.get_data_dir(), ARCHIVE_DIRNAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def archive_filename(year):
+    from models import DB_PATH
+    stem = os.path.splitext(os.path.basename(DB_PATH or config.DB_FILENAME))[0]
+    return f"{stem}-{year}.db"
+
+def archived_years(session):
+    """Archived years, oldest first"""
+    return [year for year, in session.execute(select(ArchivedYear.year).order_by(ArchivedYear.year))]
+
+def _schema(year):
+    return f"archive_{year}"
+
+def attach_year(connection, year, filename=None):
+    """Schema name of a year's archive on this connection, attaching it if needed
+
+    The least recently used archive is detached when too many are attached.
+    """
+    if connection.dialect.name != 'sqlite':
+        raise ValueError("Archived years need a SQLite database")
+    attached = connection.info.setdefault('archive_attached', OrderedDict())
+    schema = _schema(year)
+    if schema in attached:
+        attached.move_to_end(schema)
+        return schema
+    while len(attached) >= MAX_ATTACHED:
+        oldest, _ = attached.popitem(last=False)
+        connection.exec_driver_sql(f"DETACH DATABASE {oldest}")
+    path = os.path.join(archive_dir(), filename or archive_filename(year))
+    connection.exec_driver_sql(f"ATTACH DATABASE ? AS {schema}", (path,))
+    attached[schema] = path
+    return schema
+
+def archived_table(schema):
+    """Transactions table of an attached archive, for Core queries that also join main tables"""
+    table = _archived_tables.get(schema)
+    if table is None:
+        table = _archived_tables[schema] = Transaction.__table__.to_metadata(MetaData(), schema=schema)
+    return table
+
+_archived_tables = {}
+
+def transaction_tables(connection):
+    """Transactions tables holding every year: each archived year's, then main's
+
+    A generator that attaches each archive as it is reached, so read each
+    table before asking for the next; any number of years then fits in
+    the MAX_ATTACHED limit.
+    """
+    if connection.dialect.name == 'sqlite':
+        archived = connection.execute(
+            select(ArchivedYear.year, ArchivedYear.filename).order_by(ArchivedYear.year)
+        ).all()
+        for year, filename in archived:
+            yield archived_table(attach_year(connection, year, filename))
+    yield Transaction.__table__
+
+def _archive_columns(connection, schema):
+    """Columns of the archived transactions table, creating it if missing"""
+    columns = [row[1] for row in connection.exec_driver_sql(f"PRAGMA {schema}.table_info(transactions)")]
+    if columns:
+        return columns
+    options = {'schema_translate_map': {None: schema}}
+    table = Transaction.__table__
+    connection.execute(CreateTable(table), execution_options=options)
+    for index in table.indexes:
+        connection.execute(CreateIndex(index), execution_options=options)
+    return [column.name for column in table.columns]
+
+def _copy_year(session, year, start, end):
+    """Copy a year's rows into its file; safe to repeat
+
+    Rows already in the file (by id) are left alone. A row whose id or
+    fingerprint a different archived row already has gets a new one first,
+    instead of replacing it: SQLite reuses the ids of deleted rows at the
+    top of the table, and identical rows are numbered as if entered after
+    the archived one. Their fingerprints are kept in the main database
+    (archived_fingerprints), so importing a statement again doesn't
+    duplicate archived rows.
+    """
+    connection = session.connection()
+    schema = attach_year(connection, year)
+    columns = ", ".join(_archive_columns(connection, schema))
+    dates = (str(start), str(end))
+    reused = connection.exec_driver_sql(
+        f"SELECT main.transactions.id FROM main.transactions JOIN {schema}.transactions AS archived "
+        f"ON archived.id = main.transactions.id AND archived.fingerprint IS NOT main.transactions.fingerprint "
+        f"WHERE {_IN_RANGE}",
+        dates
+    ).scalars().all()
+    if reused:
+        next_id = 1 + max(
+            connection.exec_driver_sql(f"SELECT COALESCE(MAX(id), 0) FROM {name}.transactions").scalar()
+            for name in ('main', schema)
+        )
+        for offset, row_id in enumerate(reused):
+            connection.execute(update(Transaction).where(Transaction.id == row_id).values(id=next_id + offset))
+    _index_fingerprints(connection, schema, year)
+    colliding = connection.exec_driver_sql(
+        f"SELECT {', '.join(f'main.transactions.{name}' for name in ('id',) + FINGERPRINT_FIELDS)} "
+        f"FROM main.transactions JOIN {schema}.transactions AS archived "
+        f"ON archived.fingerprint = main.transactions.fingerprint AND archived.id != main.transactions.id "
+        f"WHERE {_IN_RANGE}",
+        dates
+    ).mappings().all()
+    for row in colliding:
+        values = {name: row[name] for name in FINGERPRINT_FIELDS}
+        values['date'] = datetime.fromisoformat(values['date'])
+        connection.execute(
+            update(Transaction).where(Transaction.id == row['id'])
+            .values(fingerprint=next_fingerprint(connection, values, exclude_id=row['id']))
+        )
+    connection.exec_driver_sql(
+        f"INSERT INTO {schema}.transactions ({columns}) "
+        f"SELECT {columns} FROM main.transactions WHERE date >= ? AND date < ? "
+        f"ON CONFLICT (id) DO NOTHING",
+        dates
+    )
+    _index_fingerprints(connection, schema, year)
+
+def _index_fingerprints(connection, schema, year):
+    connection.exec_driver_sql(
+        f"INSERT OR IGNORE INTO main.archived_fingerprints (fingerprint, transaction_id, account_id, year) "
+        f"SELECT fingerprint, id, account_id, ? FROM {schema}.transactions WHERE fingerprint IS NOT NULL",
+        (year,)
+    )
+
+def _check_copied(session, year, start, end):
+    """Raise unless every row of the year in main is in its file, unchanged"""
+    connection = session.connection()
+    schema = attach_year(connection, year)
+    _archive_columns(connection, schema)
+    dates = (str(start), str(end))
+    in_main = connection.exec_driver_sql(
+        f"SELECT COUNT(*) FROM main.transactions WHERE {_IN_RANGE}", dates
+    ).scalar()
+    copied = connection.exec_driver_sql(
+        f"SELECT COUNT(*) FROM main.transactions JOIN {schema}.transactions AS archived "
+        f"ON archived.id = main.transactions.id AND archived.fingerprint IS main.transactions.fingerprint "
+        f"WHERE {_IN_RANGE}",
+        dates
+    ).scalar()
+    if copied != in_main:
+        raise ValueError(f"Only {copied} of {in_main} transactions of {year} are in its archive; "
+                         f"nothing was removed")
+
+def archive_year(session, year):
+    """Move one year's transactions to its archive file
+
+    Commits twice: once the rows are safely in the archive file, and again
+    once they are removed from the main database. SQLite doesn't make a
+    transaction over several WAL databases atomic, and copying is
+    idempotent, so an interrupted run can simply be repeated.
+    """
+    start, end = datetime(year, 1, 1), datetime(year + 1, 1, 1)
+    _copy_year(session, year, start, end)
+    session.commit()
+
+    _check_copied(session, year, start, end)
+    in_year = (Transaction.date >= start) & (Transaction.date < end)
+    in_months = BalanceCheckpoint.month.between(f"{year:04d}-01", f"{year:04d}-12")
+    totals = session.execute(
+        select(Transaction.account_id, Transaction.currency,
+               func.sum(func.round(Transaction.amount * 100)), func.count(Transaction.id))
+        .where(in_year)
+        .group_by(Transaction.account_id, Transaction.currency)
+    ).all()
+    moved = sum(count for _, _, _, count in totals)
+    if totals:
+        # Booked values carry over from the year's checkpoints, unless one is unknown
+        booked = {
+            (account_id, currency): booked_minor if known == months else None
+            for account_id, currency, booked_minor, known, months in session.execute(
+                select(BalanceCheckpoint.account_id, BalanceCheckpoint.currency,
+                       func.sum(BalanceCheckpoint.booked_minor), func.count(BalanceCheckpoint.booked_minor),
+                       func.count(BalanceCheckpoint.id))
+                .where(in_months)
+                .group_by(BalanceCheckpoint.account_id, BalanceCheckpoint.currency)
+            )
+        }
+        stmt = dialect_insert(session, OpeningBalance).values([
+            {'account_id': account_id, 'currency': currency, 'total_minor': int(total),
+             'booked_minor': booked.get((account_id, currency)), 'count': count, 'through_year': year}
+            for account_id, currency, total, count in totals
+        ])
+        table = OpeningBalance.__table__
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=['account_id', 'currency'],
+            set_={'total_minor': table.c.total_minor + stmt.excluded.total_minor,
+                  'booked_minor': table.c.booked_minor + stmt.excluded.booked_minor,
+                  'count': table.c.count + stmt.excluded.count,
+                  'through_year': stmt.excluded.through_year}
+        ))
+    session.execute(delete(Transaction).where(in_year))
+    # The opening balances now carry these months
+    session.execute(delete(BalanceCheckpoint).where(in_months))
+    existing = session.get(ArchivedYear, year)
+    if existing is None:
+        session.add(ArchivedYear(year=year, filename=archive_filename(year), transactions=moved))
+    else:
+        existing.transactions += moved
+        existing.archived_at = datetime.now()
+    session.commit()
+    accounts = len({account_id for account_id, _, _, _ in totals})
+    return ArchiveResult(year, os.path.join(archive_dir(), archive_filename(year)), moved, accounts)
+
+def archive_through(session, year):
+    """Archive every year up to and including year, oldest first
+
+    Only closed years can be archived, and always from the oldest, so the
+    archived years all come before the main table's rows.
+    """
+    if session.get_bind().dialect.name != 'sqlite':
+        raise ValueError("Archival needs a SQLite database")
+    if year >= datetime.now().year:
+        raise ValueError(f"{year} is not closed yet")
+    first = session.execute(
+        select(func.min(Transaction.date)).where(Transaction.date < datetime(year + 1, 1, 1))
+    ).scalar()
+    if first is None:
+        return []
+    return [archive_year(session, archived) for archived in range(first.year, year + 1)]
+
+def iter_rows_in_range(session, account_id=None, start=None, end=None, batch_size=DEFAULT_BATCH_SIZE):
+    """TransactionRow tuples in [start, end) in date order, archived years included
+
+    Only the archives of years the range reaches are attached and read.
+    """
+    connection = session.connection()
+    archived = session.execute(
+        select(ArchivedYear.year, ArchivedYear.filename).order_by(ArchivedYear.year)
+    ).all()
+    for year, filename in archived:
+        if (start is not None and year < start.year) or (end is not None and datetime(year, 1, 1) >= end):
+            continue
+        schema = attach_year(connection, year, filename)
+        yield from iter_transaction_rows(connection, account_id, batch_size=batch_size,
+                                         start=start, end=end, schema=schema)
+    yield from iter_transaction_rows(session, account_id, batch_size=batch_size, start=start, end=end)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move closed years to per-year database files")
+    parser.add_argument('--through', type=int, help="Archive every year up to and including this one")
+    parser.add_argument('--list', action='store_true', help="List archived years")
+    args = parser.parse_args(argv)
+    if args.through is None and not args.list:
+        parser.error("--through or --list is required")
+
+    init_db()
+    try:
+        with session_scope() as session:
+            if args.through is not None:
+                for result in archive_through(session, args.through):
+                    print(f"{result.year}: moved {result.transactions:,} transaction(s) "
+                          f"of {result.accounts} account(s) to {result.path}")
+            if args.list:
+                for archived in session.query(ArchivedYear).order_by(ArchivedYear.year):
+                    print(f"{archived.year}\t{archived.transactions:,}\t"
+                          f"{os.path.join(archive_dir(), archived.filename)}")
+    except Exception as e:
+        print(f"archive: {str(e)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,38 +1,169 @@
-from hashlib import pbkdf2_hmac
+from hashlib import pbkdf2_hmac, sha256
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import hmac
 import os
+import time
 from models import User, Session
+import config
+
+# Stored format: <scheme>$<iterations>$<salt>$<hash>, salt and hash unpadded base64
+HASH_SCHEME = 'pbkdf2_sha256'
+SALT_BYTES = 16
+MIN_ITERATIONS = 100000
+DEFAULT_ITERATIONS = 100000
+DEFAULT_TARGET_MS = 250
+CALIBRATION_SAMPLE = 20000
+# Same answer for an unknown user as for a wrong password, so sign-in
+# doesn't reveal which usernames exist
+INVALID_CREDENTIALS = "Invalid username or password"
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+# Iterations -> dummy hash, see PasswordAuth.dummy_hash
+_dummy_hashes = {}
 
 class PasswordAuth:
+    # Current cost; replaced by calibrate() at startup
+    iterations = DEFAULT_ITERATIONS
+
     @staticmethod
-    def hash_password(password: str, salt: bytes = None) -> tuple[str, bytes]:
-        """Hash a password using PBKDF2 with SHA256"""
+    def hash_password(password: str, iterations: int = None, salt: bytes = None) -> str:
+        """Hash a password using PBKDF2 with SHA256 into the versioned format"""
+        if iterations is None:
+            iterations = PasswordAuth.iterations
         if salt is None:
-            salt = os.urandom(16)
-        hash_bytes = pbkdf2_hmac('sha256', password.encode(), salt, 100000)
-        return hash_bytes.hex(), salt
+            salt = os.urandom(SALT_BYTES)
+        hash_bytes = pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+        return f"{HASH_SCHEME}${iterations}${_b64encode(salt)}${_b64encode(hash_bytes)}"
+
+    @staticmethod
+    def parse_hash(stored_hash: str) -> tuple[str, int, bytes, bytes]:
+        """Split a stored hash into scheme, iterations, salt and digest"""
+        parts = stored_hash.split('$')
+        if len(parts) == 4 and parts[0] == HASH_SCHEME:
+            return parts[0], int(parts[1]), _b64decode(parts[2]), _b64decode(parts[3])
+        if len(stored_hash) == 64 and '$' not in stored_hash:
+            # Legacy unsalted SHA256 hex digest written by older sign-ups
+            return 'sha256', 0, b'', bytes.fromhex(stored_hash)
+        raise ValueError("Unrecognized password hash format")
+
+    @staticmethod
+    def verify_password(password: str, stored_hash: str) -> bool:
+        """Verify a password against its stored hash in constant time"""
+        try:
+            scheme, iterations, salt, digest = PasswordAuth.parse_hash(stored_hash)
+        except ValueError:
+            return False
+        if scheme == 'sha256':
+            attempt = sha256(password.encode()).digest()
+        else:
+            attempt = pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+        return hmac.compare_digest(attempt, digest)
+
+    @staticmethod
+    def dummy_hash() -> str:
+        """A hash at the current cost, verified against for unknown users
+
+        Checking a password against it takes as long as against a real
+        user's, so the delay doesn't reveal whether the username exists.
+        """
+        iterations = PasswordAuth.iterations
+        if _dummy_hashes.get(iterations) is None:
+            _dummy_hashes[iterations] = PasswordAuth.hash_password(_b64encode(os.urandom(SALT_BYTES)))
+        return _dummy_hashes[iterations]
+
+    @staticmethod
+    def needs_rehash(stored_hash: str) -> bool:
+        """Check whether a hash was made with a different scheme or cost"""
+        try:
+            scheme, iterations, _, _ = PasswordAuth.parse_hash(stored_hash)
+        except ValueError:
+            return True
+        return scheme != HASH_SCHEME or iterations != PasswordAuth.iterations
+
+    @staticmethod
+    def calibrate(target_ms: int = DEFAULT_TARGET_MS, force: bool = False) -> int:
+        """Pick the iteration count that takes about target_ms on this machine
+
+        The result is saved in the config so the cost stays stable between
+        runs; pass force=True to measure again.
+        """
+        settings = config.load_config()
+        iterations = settings.get('kdf_iterations')
+        if force or not iterations or settings.get('kdf_target_ms') != target_ms:
+            salt = os.urandom(SALT_BYTES)
+            elapsed = min(
+                PasswordAuth._time_iterations(CALIBRATION_SAMPLE, salt) for _ in range(3)
+            )
+            iterations = int(CALIBRATION_SAMPLE * (target_ms / 1000.0) / elapsed)
+            # Round down to 10k steps so small timing noise doesn't change the cost
+            iterations = max(MIN_ITERATIONS, iterations - iterations % 10000)
+            config.save_config({'kdf_iterations': iterations, 'kdf_target_ms': target_ms})
+        PasswordAuth.iterations = int(iterations)
+        # Made now rather than on the first failed sign-in, which would then take twice as long
+        PasswordAuth.dummy_hash()
+        return PasswordAuth.iterations
 
     @staticmethod
-    def verify_password(password: str, stored_hash: str, salt: bytes) -> bool:
-        """Verify a password against its hash"""
-        hash_attempt, _ = PasswordAuth.hash_password(password, salt)
-        return stored_hash == hash_attempt
+    def _time_iterations(iterations: int, salt: bytes) -> float:
+        started = time.perf_counter()
+        pbkdf2_hmac('sha256', b'calibration', salt, iterations)
+        return max(time.perf_counter() - started, 1e-6)
 
     @staticmethod
     def authenticate_user(username: str, password: str) -> tuple[bool, str, User]:
-        """Authenticate a user with username and password"""
+        """Authenticate a user, upgrading the stored hash if its cost changed"""
+        session = None
         try:
             session = Session()
             user = session.query(User).filter_by(username=username).first()
-            
+
             if not user:
-                return False, "User not found", None
-                
-            if not PasswordAuth.verify_password(password, user.password_hash, user.salt):
-                return False, "Invalid password", None
-                
+                PasswordAuth.verify_password(password, PasswordAuth.dummy_hash())
+                return False, INVALID_CREDENTIALS, None
+
+            if not PasswordAuth.verify_password(password, user.password):
+                return False, INVALID_CREDENTIALS, None
+
+            if PasswordAuth.needs_rehash(user.password):
+                user.password = PasswordAuth.hash_password(password)
+                session.commit()
+                session.refresh(user)
+
             return True, "Authentication successful", user
-            
+
         except Exception as e:
+            if session is not None:
+                session.rollback()
             return False, f"Authentication error: {str(e)}", None
         finally:
-            session.close()
\ No newline at end of file
+            if session is not None:
+                session.close()
+
+class AuthService:
+    """Runs password hashing and verification on a worker thread
+
+    Methods return concurrent.futures.Future objects so the UI thread never
+    blocks on the key derivation.
+    """
+    def __init__(self, max_workers=1):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='auth')
+
+    def authenticate(self, username, password):
+        """Verify credentials in the background, resolving to (ok, message, user)"""
+        return self._executor.submit(PasswordAuth.authenticate_user, username, password)
+
+    def hash_password(self, password):
+        """Hash a new password in the background, resolving to the stored string"""
+        return self._executor.submit(PasswordAuth.hash_password, password)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+auth_service = AuthService()
@@ -0,0 +1,290 @@
+"""Online backups of the SQLite database.
+
+Snapshots are taken with SQLite's online backup API while the app keeps
+running. The copy holds a read transaction on the live database, so in WAL
+mode (see models.create_db_engine) writers are never blocked and the
+snapshot is consistent without restarting when they commit. Pages are
+copied a few hundred at a time, with a short pause between steps, on a
+worker thread. Each snapshot is integrity-checked before it is given its
+final name, and only the newest few are kept.
+
+Archived years (see archive.py) live in their own files, so a snapshot
+<name>.db comes with a <name>.archive directory holding a copy of every
+archive file the snapshot's archived_years table lists. Verifying checks
+them too, and restoring puts them back in the archive directory.
+
+    python backup.py create           # snapshot into <data dir>/backups
+    python backup.py list
+    python backup.py verify PATH
+    python backup.py restore PATH     # snapshots the current database first
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import config
+
+BACKUP_DIRNAME = 'backups'
+DEFAULT_KEEP = 7
+# Pages copied per step (1 MiB at the default 4 KiB page size)
+PAGES_PER_STEP = 256
+# Pause between steps, so the app's own statements get a turn
+STEP_PAUSE = 0.005
+# Tables a usable snapshot must contain
+REQUIRED_TABLES = ('users', 'accounts', 'transactions', 'categories', 'exchange_rates')
+
+BackupResult = namedtuple('BackupResult', ['path', 'pages', 'seconds', 'removed'])
+VerifyResult = namedtuple('VerifyResult', ['path', 'ok', 'problems', 'transactions', 'archives'])
+
+def backup_dir():
+    path = os.path.join(config.get_data_dir(), BACKUP_DIRNAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _database_path(db_path=None):
+    if db_path is None:
+        from models import DB_PATH as db_path
+    if not db_path or db_path == ':memory:':
+        raise ValueError("Online backups need a SQLite database file; use pg_dump for PostgreSQL")
+    return db_path
+
+def archives_path(path):
+    """Directory holding the archived years of the snapshot at path"""
+    return os.path.splitext(path)[0] + '.archive'
+
+def _live_archive_dir():
+    from archive import archive_dir
+    return archive_dir()
+
+def listed_archives(path):
+    """Archive filenames a database's archived_years table lists"""
+    connection = sqlite3.connect(config.read_only_uri(path), uri=True)
+    try:
+        tables = {row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if 'archived_years' not in tables:
+            return []
+        return [row[0] for row in connection.execute("SELECT filename FROM archived_years ORDER BY year")]
+    finally:
+        connection.close()
+
+def list_backups(directory=None):
+    """Snapshot paths, newest first"""
+    directory = directory or backup_dir()
+    names = [name for name in os.listdir(directory) if name.endswith('.db')]
+    # Timestamped names sort chronologically
+    return [os.path.join(directory, name) for name in sorted(names, reverse=True)]
+
+def copy_database(source_path, dest_path, pages=PAGES_PER_STEP, pause=STEP_PAUSE, progress=None):
+    """Copy a live database page by page, returning the number of pages
+
+    progress(remaining, total) is called after every step.
+    """
+    source = sqlite3.connect(source_path, isolation_level=None, check_same_thread=False)
+    dest = sqlite3.connect(dest_path)
+    copied = 0
+    try:
+        # A read transaction pins the snapshot for the whole copy
+        source.execute("BEGIN")
+        source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+
+        def step(status, remaining, total):
+            nonlocal copied
+            copied = total
+            if progress is not None:
+                progress(remaining, total)
+            if remaining and pause:
+                time.sleep(pause)
+
+        source.backup(dest, pages=pages, progress=step)
+        source.execute("COMMIT")
+    finally:
+        source.close()
+        dest.close()
+    return copied
+
+def _check_database(path, required_tables):
+    """Integrity problems of a database file opened read-only, and its transaction count"""
+    problems = []
+    transactions = None
+    try:
+        connection = sqlite3.connect(config.read_only_uri(path), uri=True)
+        try:
+            problems.extend(row[0] for row in connection.execute("PRAGMA integrity_check")
+                            if row[0] != 'ok')
+            tables = {row[0] for row in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'")}
+            problems.extend(f"missing table {table}" for table in required_tables if table not in tables)
+            if 'transactions' in tables:
+                transactions = connection.execute("SELECT count(*) FROM transactions").fetchone()[0]
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        problems.append(str(e))
+    return problems, transactions
+
+def verify_backup(path, archives=None, require_archives=True):
+    """Integrity check of a snapshot and its archived years, opened read-only
+
+    archives is the directory of archive copies, archives_path(path) by
+    default. Without require_archives, missing copies aren't a problem.
+    """
+    problems, transactions = _check_database(path, REQUIRED_TABLES)
+    filenames = [] if problems else listed_archives(path)
+    archives = archives or archives_path(path)
+    for filename in filenames:
+        archive = os.path.join(archives, filename)
+        if not os.path.exists(archive):
+            if require_archives:
+                problems.append(f"missing archive {filename}")
+            continue
+        archive_problems, _ = _check_database(archive, ('transactions',))
+        problems.extend(f"{filename}: {problem}" for problem in archive_problems)
+    return VerifyResult(path, not problems, problems, transactions, len(filenames))
+
+def rotate(directory=None, keep=DEFAULT_KEEP):
+    """Delete all but the newest keep snapshots, returning the deleted paths"""
+    removed = list_backups(directory)[keep:]
+    for path in removed:
+        os.remove(path)
+        shutil.rmtree(archives_path(path), ignore_errors=True)
+    return removed
+
+def create_backup(db_path=None, directory=None, keep=DEFAULT_KEEP, label='backup', progress=None,
+                  require_archives=True):
+    """Snapshot the database and its archived years, verify them and rotate old snapshots
+
+    Without require_archives, archive files that have gone missing are left out.
+    """
+    db_path = _database_path(db_path)
+    directory = directory or backup_dir()
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    name = f"{stem}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{label}.db"
+    path = os.path.join(directory, name)
+    partial = path + '.partial'
+    partial_archives = archives_path(path) + '.partial'
+    started = time.perf_counter()
+    try:
+        pages = copy_database(db_path, partial, progress=progress)
+        # After the main database, so every year it lists as archived is
+        # already complete in its file
+        for filename in listed_archives(partial):
+            source = os.path.join(_live_archive_dir(), filename)
+            if not os.path.exists(source):
+                if require_archives:
+                    raise ValueError(f"Archive {source} is missing")
+                continue
+            os.makedirs(partial_archives, exist_ok=True)
+            pages += copy_database(source, os.path.join(partial_archives, filename))
+        result = verify_backup(partial, partial_archives, require_archives)
+        if not result.ok:
+            raise ValueError(f"Backup failed verification: {'; '.join(result.problems)}")
+        if os.path.exists(partial_archives):
+            os.replace(partial_archives, archives_path(path))
+        os.replace(partial, path)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        shutil.rmtree(partial_archives, ignore_errors=True)
+        raise
+    removed = rotate(directory, keep) if keep else []
+    return BackupResult(path, pages, time.perf_counter() - started, removed)
+
+def latest_backup_age(directory=None):
+    """Time since the newest snapshot was written, or None if there is none"""
+    backups = list_backups(directory)
+    if not backups:
+        return None
+    return datetime.now() - datetime.fromtimestamp(os.path.getmtime(backups[0]))
+
+def restore_backup(path, db_path=None, engine=None, progress=None):
+    """Replace the database contents and archived years with a verified snapshot
+
+    The current database is snapshotted first (labelled pre-restore), so a
+    restore can itself be undone. Archive files the snapshot doesn't list
+    (years archived since) are removed. Pooled connections are closed; sessions
+    must be reopened afterwards. Returns the pre-restore BackupResult.
+    """
+    result = verify_backup(path)
+    if not result.ok:
+        raise ValueError(f"Refusing to restore {path}: {'; '.join(result.problems)}")
+    db_path = _database_path(db_path)
+    # Whatever is left, even if an archive file was lost: that may be why we restore
+    safety = create_backup(db_path, directory=os.path.dirname(os.path.abspath(path)),
+                           keep=0, label='pre-restore', require_archives=False)
+    if engine is None:
+        from models import ENGINE as engine
+    engine.dispose()
+    # Through the backup API, so the live file's WAL and locks are honoured
+    copy_database(path, db_path, progress=progress)
+    live_archives = _live_archive_dir()
+    filenames = listed_archives(path)
+    for filename in filenames:
+        copy_database(os.path.join(archives_path(path), filename), os.path.join(live_archives, filename))
+    for filename in os.listdir(live_archives):
+        if filename.endswith('.db') and filename not in filenames:
+            os.remove(os.path.join(live_archives, filename))
+    return safety
+
+class BackupService:
+    """Runs backups on a worker thread, returning concurrent.futures.Future objects"""
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='backup')
+
+    def backup(self, keep=DEFAULT_KEEP, progress=None):
+        return self._executor.submit(create_backup, keep=keep, progress=progress)
+
+    def backup_if_stale(self, max_age=timedelta(days=1), keep=DEFAULT_KEEP):
+        """Start a backup if the newest one is older than max_age, else return None"""
+        age = latest_backup_age()
+        if age is not None and age < max_age:
+            return None
+        return self.backup(keep)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+backup_service = BackupService()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Online backups of the SQLite database")
+    commands = parser.add_subparsers(dest='command', required=True)
+    create = commands.add_parser('create', help="Snapshot the database now")
+    create.add_argument('--keep', type=int, default=DEFAULT_KEEP, help="Snapshots to keep")
+    commands.add_parser('list', help="List snapshots, newest first")
+    verify = commands.add_parser('verify', help="Integrity-check a snapshot")
+    verify.add_argument('path')
+    restore = commands.add_parser('restore', help="Replace the database with a snapshot")
+    restore.add_argument('path')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'create':
+            result = create_backup(keep=args.keep)
+            print(f"Wrote {result.path} ({result.pages:,} pages in {result.seconds:.2f}s), "
+                  f"removed {len(result.removed)} old snapshot(s)")
+        elif args.command == 'list':
+            for path in list_backups():
+                print(f"{path}\t{os.path.getsize(path):,} bytes")
+        elif args.command == 'verify':
+            result = verify_backup(args.path)
+            if not result.ok:
+                for problem in result.problems:
+                    print(f"{args.path}: {problem}")
+                return 1
+            print(f"{args.path}: ok, {result.transactions:,} transactions, "
+                  f"{result.archives} archived year(s)")
+        elif args.command == 'restore':
+            safety = restore_backup(args.path)
+            print(f"Restored {args.path}; previous database saved as {safety.path}")
+    except Exception as e:
+        print(f"backup {args.command}: {str(e)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,19 +1,23 @@
 from models import Session, Account, User  # Import the User model
+from query_cache import cached_account_id
 from PyQt6.QtWidgets import QMessageBox
 
 class BalanceInquiry:
-    def __init__(self, username):
+    def __init__(self, username, context=None):
         self.username = username
-        self.session = Session()
+        # Reuse the account loaded by AccountContext instead of querying again
+        self.context = context
+        self.session = context.session if context else Session()
         self.account = self.get_account()
 
     def get_account(self):
         """Get user account"""
+        if self.context is not None:
+            return self.context.account
         try:
-            account = self.session.query(Account)\
-                .join(User)\
-                .filter(User.username == self.username)\
-                .first()
+            # The id is cached; get() is then served from the identity map
+            account_id = cached_account_id(self.session, self.username)
+            account = self.session.get(Account, account_id) if account_id is not None else None
             if not account:
                 QMessageBox.warning(None, "Account Error", "Account not found")
                 return None
@@ -30,4 +34,4 @@ class BalanceInquiry:
 
     def close_session(self):
         """Close the database session"""
-        self.session.close()
\ No newline at end of file
+        self.session.close()
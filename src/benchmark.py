@@ -0,0 +1,241 @@
+"""Database benchmarks.
+
+Runs against the configured database, so pointing FINANCE_TRACKER_DATABASE_URL
+(or --url) at a local PostgreSQL instance compares it with the SQLite file:
+
+    python benchmark.py --url postgresql+psycopg://localhost/finance_bench --users 8
+
+--memory-rows compares the memory needed to read a large ledger as ORM
+objects and as read-only TransactionRow tuples, in a scratch SQLite file:
+
+    python benchmark.py --memory-rows 1000000
+
+At 1,000,000 rows the ORM objects peaked at 1,456 MiB (1,527 bytes/row)
+and the row tuples at 264 MiB (277 bytes/row).
+"""
+import argparse
+import gc
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.orm import sessionmaker
+
+from models import (Base, User, Account, Transaction, Category, TransactionType,
+                    create_db_engine, init_default_exchange_rates, upsert_exchange_rate)
+from transaction_rows import load_transaction_rows
+
+BENCH_PREFIX = 'bench_'
+
+def setup_database(engine):
+    """Create the schema and a category for each transaction type"""
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        categories = {}
+        for transaction_type in TransactionType:
+            category = session.query(Category).filter_by(type=transaction_type).first()
+            if not category:
+                category = Category(name=f"{BENCH_PREFIX}{transaction_type.value}", type=transaction_type)
+                session.add(category)
+                session.flush()
+            categories[transaction_type] = category.id
+        init_default_exchange_rates(session)
+        session.commit()
+        return categories
+    finally:
+        session.close()
+
+def run_user(engine, user_index, categories, transactions_per_user):
+    """Simulate one user: sign up, add transactions, read the balance back"""
+    session = sessionmaker(bind=engine)()
+    timings = {'insert': 0.0, 'read': 0.0, 'upsert': 0.0}
+    try:
+        name = f"{BENCH_PREFIX}{user_index}_{int(time.time() * 1000)}"
+        user = User(username=name, email=f"{name}@example.com", password='x')
+        account = Account(name='Benchmark', currency='SGD', user=user)
+        session.add_all([user, account])
+        session.commit()
+
+        start_date = datetime(2020, 1, 1)
+        started = time.perf_counter()
+        for i in range(transactions_per_user):
+            transaction_type = random.choice(list(TransactionType))
+            amount = round(random.uniform(1, 500), 2)
+            if transaction_type == TransactionType.EXPENSE:
+                amount = -amount
+            session.add(Transaction(
+                user_id=user.id,
+                account_id=account.id,
+                date=start_date + timedelta(days=i % 1500),
+                type=transaction_type,
+                category_id=categories[transaction_type],
+                amount=amount,
+                currency='SGD',
+                description=f"Benchmark {i}"
+            ))
+            account.balance += amount
+            if i % 50 == 49:
+                session.commit()
+        session.commit()
+        timings['insert'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(20):
+            session.query(func.sum(Transaction.amount))\
+                .filter_by(account_id=account.id)\
+                .scalar()
+            session.query(Transaction)\
+                .filter_by(account_id=account.id)\
+                .order_by(Transaction.date)\
+                .limit(100)\
+                .all()
+        timings['read'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(20):
+            upsert_exchange_rate(session, 'SGD', 'USD', round(random.uniform(0.7, 0.8), 4))
+            session.commit()
+        timings['upsert'] = time.perf_counter() - started
+        return timings
+    finally:
+        session.close()
+
+def cleanup(engine):
+    """Remove all benchmark users and their data"""
+    session = sessionmaker(bind=engine)()
+    try:
+        for user in session.query(User).filter(User.username.like(f"{BENCH_PREFIX}%")).all():
+            session.delete(user)
+        session.commit()
+    finally:
+        session.close()
+
+def run_concurrent(url=None, users=4, transactions_per_user=500):
+    """Run the multi-user benchmark and return aggregate timings"""
+    engine = create_db_engine(url)
+    try:
+        categories = setup_database(engine)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=users) as executor:
+            results = list(executor.map(
+                lambda i: run_user(engine, i, categories, transactions_per_user),
+                range(users)
+            ))
+        elapsed = time.perf_counter() - started
+        cleanup(engine)
+        total = users * transactions_per_user
+        return {
+            'backend': engine.url.get_backend_name(),
+            'users': users,
+            'transactions': total,
+            'elapsed': elapsed,
+            'transactions_per_second': total / elapsed if elapsed else 0.0,
+            'insert': max(r['insert'] for r in results),
+            'read': max(r['read'] for r in results),
+            'upsert': max(r['upsert'] for r in results),
+        }
+    finally:
+        engine.dispose()
+
+def _fill_ledger(engine, rows, chunk_size=50000):
+    """Bulk insert rows transactions for one account, returning the account id"""
+    categories = setup_database(engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        user = User(username=f"{BENCH_PREFIX}memory", email=f"{BENCH_PREFIX}memory@example.com",
+                    password='x')
+        account = Account(name='Benchmark', currency='SGD', user=user)
+        session.add_all([user, account])
+        session.commit()
+        start_date = datetime(2000, 1, 1)
+        for offset in range(0, rows, chunk_size):
+            session.execute(Transaction.__table__.insert(), [
+                {
+                    'user_id': user.id,
+                    'account_id': account.id,
+                    'date': start_date + timedelta(minutes=i),
+                    'type': TransactionType.EXPENSE,
+                    'category_id': categories[TransactionType.EXPENSE],
+                    'amount': -round(random.uniform(1, 500), 2),
+                    'currency': 'SGD',
+                    'description': "",
+                }
+                for i in range(offset, min(offset + chunk_size, rows))
+            ])
+        session.commit()
+        return account.id
+    finally:
+        session.close()
+
+def _measure(load):
+    """Seconds taken and peak traced bytes while the result of load() is alive"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = len(result)
+    del result
+    gc.collect()
+    return {'rows': count, 'seconds': elapsed, 'peak_bytes': peak}
+
+def compare_read_memory(rows=1000000):
+    """Load a ledger of rows transactions as ORM objects and as TransactionRow tuples"""
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_db_engine(f"sqlite:///{os.path.join(directory, 'memory_bench.db')}")
+        try:
+            account_id = _fill_ledger(engine, rows)
+            Session = sessionmaker(bind=engine)
+
+            def load_orm():
+                session = Session()
+                try:
+                    # Still referenced by the session's identity map until closed
+                    return session.query(Transaction).filter_by(account_id=account_id).all()
+                finally:
+                    session.close()
+
+            def load_rows():
+                with engine.connect() as connection:
+                    return load_transaction_rows(connection, account_id)
+
+            return {'orm': _measure(load_orm), 'rows': _measure(load_rows)}
+        finally:
+            engine.dispose()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Finance Tracker database benchmarks")
+    parser.add_argument('--url', help="Database URL (defaults to the configured database)")
+    parser.add_argument('--users', type=int, default=4, help="Concurrent simulated users")
+    parser.add_argument('--transactions', type=int, default=500, help="Transactions per user")
+    parser.add_argument('--memory-rows', type=int,
+                        help="Instead, compare ORM and row-tuple read memory at this many rows")
+    args = parser.parse_args(argv)
+
+    if args.memory_rows:
+        result = compare_read_memory(args.memory_rows)
+        for name, label in (('orm', 'ORM objects'), ('rows', 'Row tuples')):
+            measured = result[name]
+            print(f"{label + ':':13} {measured['rows']:,} rows in {measured['seconds']:.2f}s, "
+                  f"peak {measured['peak_bytes'] / 2**20:,.1f} MiB "
+                  f"({measured['peak_bytes'] / measured['rows']:,.0f} bytes/row)")
+        return
+
+    result = run_concurrent(args.url, args.users, args.transactions)
+    print(f"Backend:      {result['backend']}")
+    print(f"Users:        {result['users']}")
+    print(f"Transactions: {result['transactions']}")
+    print(f"Elapsed:      {result['elapsed']:.2f}s ({result['transactions_per_second']:,.0f} tx/s)")
+    print(f"Slowest user: insert {result['insert']:.2f}s, read {result['read']:.2f}s, "
+          f"upsert {result['upsert']:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Per-category budgets with spent-to-date counters.
+
+budget_spend holds one counter per budget, period and currency. The ORM
+flush hooks in models.py adjust it on every insert, edit and delete of an
+expense, so checking a budget is a lookup by key rather than a sum over
+history. A new budget sums its current period once when it is set.
+Counters are converted to the budget's currency when read, at the current
+rates; an expense removed after a rate change takes back exactly what it
+added.
+
+    set_budget(session, user.id, food.id, 400, 'SGD')
+    for status in exceeded_budgets(session, user.id, food.id, date.today()):
+        print(f"{status.category}: {status.spent:.2f} of {status.limit:.2f}")
+"""
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import and_, case
+from models import (Budget, BudgetPeriod, BudgetSpend, Category, Transaction,
+                    budget_period_start, convert_amount)
+
+BudgetStatus = namedtuple('BudgetStatus', [
+    'budget_id', 'category', 'period', 'period_start', 'limit', 'spent',
+    'remaining', 'currency', 'exceeded'
+])
+
+def period_end(period_start, period):
+    """First day after the budget period starting at period_start"""
+    if period == BudgetPeriod.WEEKLY:
+        return period_start + timedelta(days=7)
+    if period == BudgetPeriod.YEARLY:
+        return period_start.replace(year=period_start.year + 1)
+    if period_start.month == 12:
+        return period_start.replace(year=period_start.year + 1, month=1)
+    return period_start.replace(month=period_start.month + 1)
+
+def _sum_period(session, budget, period_start):
+    """Sum a budget's expenses in one period, in cents per currency"""
+    start = datetime.combine(period_start, datetime.min.time())
+    end = datetime.combine(period_end(period_start, budget.period), datetime.min.time())
+    rows = session.query(Transaction.currency, Transaction.amount)\
+        .filter(Transaction.user_id == budget.user_id,
+                Transaction.category_id == budget.category_id,
+                Transaction.amount < 0,
+                Transaction.date >= start,
+                Transaction.date < end)\
+        .all()
+    totals = defaultdict(int)
+    for currency, amount in rows:
+        totals[currency] += round(-amount * 100)
+    return totals
+
+def set_budget(session, user_id, category_id, limit_amount, currency, period=BudgetPeriod.MONTHLY):
+    """Create or update a budget, counting the current period's spending once"""
+    try:
+        limit_amount = float(limit_amount)
+        if limit_amount <= 0:
+            raise ValueError("Budget must be greater than zero")
+        period = BudgetPeriod(period)
+        budget = session.query(Budget)\
+            .filter_by(user_id=user_id, category_id=category_id, period=period)\
+            .first()
+        if budget is not None:
+            # Counters are per expense currency, so they stay valid
+            budget.limit_amount = limit_amount
+            budget.currency = currency
+            return budget
+
+        budget = Budget(user_id=user_id, category_id=category_id, period=period,
+                        limit_amount=limit_amount, currency=currency, created_at=datetime.now())
+        session.add(budget)
+        session.flush()
+
+        period_start = budget_period_start(budget.created_at, period)
+        session.add_all([
+            BudgetSpend(budget_id=budget.id, period_start=period_start, currency=spent_currency,
+                        spent_minor=spent_minor)
+            for spent_currency, spent_minor in _sum_period(session, budget, period_start).items()
+        ])
+        session.flush()
+        return budget
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Failed to set budget: {str(e)}")
+
+def delete_budget(session, budget_id):
+    """Remove a budget and its counters"""
+    session.query(BudgetSpend).filter_by(budget_id=budget_id).delete(synchronize_session=False)
+    session.query(Budget).filter_by(id=budget_id).delete(synchronize_session=False)
+
+def _statuses(session, date, *criteria):
+    """Budgets matching criteria with their counters for the period containing date, in one query"""
+    starts = {period: budget_period_start(date, period) for period in BudgetPeriod}
+    period_start = case(*[(Budget.period == period, start) for period, start in starts.items()])
+    rows = session.query(Budget, Category.name, BudgetSpend.currency, BudgetSpend.spent_minor)\
+        .join(Category, Category.id == Budget.category_id)\
+        .outerjoin(BudgetSpend, and_(BudgetSpend.budget_id == Budget.id,
+                                     BudgetSpend.period_start == period_start))\
+        .filter(*criteria)\
+        .order_by(Category.name, Budget.period)\
+        .all()
+    spending = {}
+    for budget, category, currency, spent_minor in rows:
+        entry = spending.setdefault(budget.id, [budget, category, 0.0])
+        if spent_minor:
+            entry[2] += convert_amount(session, spent_minor / 100.0, currency, budget.currency)
+    statuses = []
+    for budget, category, spent in spending.values():
+        spent = round(spent, 2)
+        statuses.append(BudgetStatus(
+            budget.id, category, budget.period, starts[budget.period],
+            budget.limit_amount, spent, round(budget.limit_amount - spent, 2),
+            budget.currency, spent > budget.limit_amount
+        ))
+    return statuses
+
+def check_budget(session, user_id, category_id, date):
+    """Status of each budget on a category for the period containing date"""
+    return _statuses(session, date, Budget.user_id == user_id, Budget.category_id == category_id)
+
+def exceeded_budgets(session, user_id, category_id, date):
+    """Budgets on a category that are over their limit for the period containing date"""
+    return [status for status in check_budget(session, user_id, category_id, date) if status.exceeded]
+
+def list_budgets(session, user_id, date=None):
+    """Status of all of a user's budgets for the period containing date"""
+    return _statuses(session, date or datetime.now(), Budget.user_id == user_id)
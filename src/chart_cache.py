@@ -0,0 +1,137 @@
+"""On-disk LRU cache of rendered charts, keyed by what they show.
+
+A chart is fully determined by its kind, its aggregated series, its style
+and the image format, so a hash of those (plus the matplotlib version)
+names the file it renders to. An unchanged chart, in the account window or
+in any number of generated statements, then costs a file read instead of a
+matplotlib render. Files live in chart_cache/ in the data directory; a hit
+refreshes the file's mtime, and once the directory is over max_bytes the
+least recently used files are removed.
+
+Several processes (statement workers) may share the directory: files are
+written under a temporary name and renamed into place, and a file removed
+by another process's eviction is simply a miss. A process only counts its
+own writes, so it rescans the directory each time it has written another
+RESCAN_FRACTION of max_bytes; the others' files then count towards the
+limit too.
+
+    png = chart_cache.render('balance', [("2024-05-01", 100.0)], 'png')
+"""
+import hashlib
+import json
+import os
+import threading
+import uuid
+import config
+
+CACHE_DIRNAME = 'chart_cache'
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+RESCAN_FRACTION = 1 / 16
+
+def chart_key(kind, series, fmt, style):
+    """Hex digest identifying a rendered chart"""
+    import matplotlib
+    payload = json.dumps([matplotlib.__version__, kind, fmt, style or {}, series],
+                         sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.blake2b(payload.encode(), digest_size=20).hexdigest()
+
+class ChartCache:
+    """Rendered chart files, evicted least recently used first"""
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self._directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = None  # Bytes in the directory, counted on first write
+        self._unscanned = 0  # Bytes written since the directory was last counted
+
+    @property
+    def directory(self):
+        # Resolved late so the data directory can be configured after import
+        path = self._directory or os.path.join(config.get_data_dir(), CACHE_DIRNAME)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _path(self, key, fmt):
+        return os.path.join(self.directory, f"{key}.{fmt}")
+
+    def get(self, key, fmt):
+        """Cached bytes, or None"""
+        path = self._path(key, fmt)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path)  # Most recently used
+        except OSError:
+            return None
+        return data
+
+    def put(self, key, fmt, data):
+        path = self._path(key, fmt)
+        partial = f"{path}.{uuid.uuid4().hex}.partial"
+        with open(partial, 'wb') as file:
+            file.write(data)
+        os.replace(partial, path)
+        with self._lock:
+            self._unscanned += len(data)
+            if self._size is None or self._unscanned >= RESCAN_FRACTION * self.max_bytes:
+                self._size = self._scan_size()
+                self._unscanned = 0
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self.evict()
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith('.partial'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, max_bytes=None):
+        """Remove least recently used files until the cache fits max_bytes"""
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass  # Already evicted by another process
+            total -= size
+        self._size = total
+        self._unscanned = 0
+        return removed
+
+    def clear(self):
+        return self.evict(0)
+
+    def render(self, kind, series, fmt='png', style=None):
+        """Chart bytes from the cache, rendering and storing them on a miss"""
+        key = chart_key(kind, series, fmt, style)
+        data = self.get(key, fmt)
+        if data is not None:
+            self.hits += 1
+            return data
+        self.misses += 1
+        from charts import render_chart
+        data = render_chart(kind, series, fmt, style)
+        self.put(key, fmt, data)
+        return data
+
+chart_cache = ChartCache()
@@ -0,0 +1,63 @@
+"""Chart drawing shared by the account window and generated statements.
+
+Charts are described by a kind, a series of (label, value) pairs and a
+style dict, and drawn with matplotlib's object API (Figure and an Agg/SVG
+canvas) rather than pyplot, so worker processes render without a GUI
+backend or global figure state.
+
+    png = render_chart('expenses_by_category', [("Food", 120.0), ("Transport", 45.5)])
+"""
+import io
+from matplotlib.figure import Figure
+
+DEFAULT_STYLE = {
+    'width': 6.0,   # Inches
+    'height': 4.0,
+    'dpi': 100,
+    'title': None,
+}
+
+def draw_expenses_by_category(ax, series, style):
+    """Pie of expenses per category"""
+    if series:
+        labels = [label for label, _ in series]
+        values = [value for _, value in series]
+        ax.pie(values, labels=labels, autopct='%1.1f%%')
+    ax.set_title(style['title'] or "Expenses by Category")
+
+def draw_balance(ax, series, style):
+    """Balance over time; labels are ISO dates"""
+    if series:
+        ax.plot([label for label, _ in series], [value for _, value in series], drawstyle='steps-post')
+        ax.tick_params(axis='x', labelrotation=45, labelsize=7)
+        # At most about eight date labels
+        step = max(len(series) // 8, 1)
+        ax.set_xticks(range(0, len(series), step))
+    ax.set_title(style['title'] or "Balance")
+    ax.grid(True, alpha=0.3)
+
+CHART_KINDS = {
+    'expenses_by_category': draw_expenses_by_category,
+    'balance': draw_balance,
+}
+
+def chart_style(style=None):
+    return dict(DEFAULT_STYLE, **(style or {}))
+
+def draw_chart(ax, kind, series, style=None):
+    """Draw a chart onto existing axes, e.g. the account window's canvas"""
+    if kind not in CHART_KINDS:
+        raise ValueError(f"Unknown chart kind {kind}")
+    CHART_KINDS[kind](ax, series, chart_style(style))
+
+def render_chart(kind, series, fmt='png', style=None):
+    """Chart image as bytes in fmt ('png' or 'svg')"""
+    if fmt not in ('png', 'svg'):
+        raise ValueError(f"Unsupported chart format {fmt}")
+    style = chart_style(style)
+    figure = Figure(figsize=(style['width'], style['height']), dpi=style['dpi'])
+    draw_chart(figure.add_subplot(), kind, series, style)
+    figure.tight_layout()
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format=fmt)
+    return buffer.getvalue()
@@ -0,0 +1,283 @@
+"""Category suggestions from transaction descriptions.
+
+A multinomial naive Bayes model over description words, trained on the
+user's own categorized transactions. Training only adds to per-category
+word counts, so learning one newly categorized row is O(words) and
+forgetting a recategorized one is the same in reverse. Prediction scores
+every category in one pass over the description's words, with the
+per-category denominators cached between calls so a whole import is
+classified without recomputing them.
+
+The counts are saved as JSON in the data directory (classifier-<user>.json)
+together with the highest transaction id they include and a checksum of
+the rows learned up to it (count, sum of ids, of id * category id and of
+description lengths). Opening the model again only learns the
+transactions added since, unless the ledger's checksum up to that id
+differs: rows deleted, recategorized or added under a reused id elsewhere
+(another window, the command line) then make it retrain. Within a window,
+sync_classifier follows adds, deletes and recategorizations, undone or
+redone, as they happen.
+
+    classifier = load_classifier(session, user_id)
+    prediction = classifier.predict("GRAB *TRIP 1234", allowed=expense_ids)
+    python classifier.py --user alice --retrain
+"""
+import argparse
+import json
+import math
+import os
+from collections import Counter, defaultdict, namedtuple
+from sqlalchemy import select, func
+import config
+from models import Transaction, Category, normalize_description
+
+FILENAME_TEMPLATE = 'classifier-{user_id}.json'
+FORMAT_VERSION = 2
+# Laplace smoothing added to every word count
+SMOOTHING = 1.0
+# Suggestions less likely than this are not applied automatically
+MIN_PROBABILITY = 0.5
+
+Prediction = namedtuple('Prediction', ['category_id', 'probability'])
+
+def tokenize(text):
+    """Description words, without the numbers that vary between receipts"""
+    return [word for word in normalize_description(text).split() if not word.isdigit()]
+
+class CategoryClassifier:
+    """Multinomial naive Bayes over description words"""
+    def __init__(self):
+        self.documents = Counter()              # category_id -> transactions learned
+        self.words = defaultdict(Counter)       # category_id -> word -> count
+        self.word_totals = Counter()            # category_id -> words learned
+        self.vocabulary = Counter()             # word -> categories using it
+        self.last_transaction_id = 0
+        self.checksum = [0, 0, 0, 0]            # See ledger_checksum()
+        self._log_denominators = None
+
+    def _update(self, description, category_id, sign):
+        tokens = tokenize(description)
+        if not tokens:
+            return False
+        counts = self.words[category_id]
+        for word, count in Counter(tokens).items():
+            before = counts[word]
+            counts[word] = before + sign * count
+            if before <= 0 < counts[word]:
+                self.vocabulary[word] += 1
+            elif counts[word] <= 0 < before:
+                self.vocabulary[word] -= 1
+                if self.vocabulary[word] <= 0:
+                    del self.vocabulary[word]
+            if counts[word] <= 0:
+                del counts[word]
+        self.word_totals[category_id] += sign * len(tokens)
+        self.documents[category_id] += sign
+        if self.documents[category_id] <= 0:
+            for counter in (self.documents, self.word_totals):
+                counter.pop(category_id, None)
+            self.words.pop(category_id, None)
+        self._log_denominators = None
+        return True
+
+    def learn(self, description, category_id):
+        """Add one categorized description; returns False if it had no words"""
+        return self._update(description, category_id, 1)
+
+    def forget(self, description, category_id):
+        """Undo learn(), e.g. when a transaction is recategorized"""
+        return self._update(description, category_id, -1)
+
+    def _count_row(self, row_id, description, category_id, sign):
+        for index, value in enumerate((1, row_id, row_id * category_id, len(description))):
+            self.checksum[index] += sign * value
+
+    def learn_row(self, row_id, description, category_id):
+        """Learn a ledger row, counting it in the checksum"""
+        self._count_row(row_id, description, category_id, 1)
+        return self.learn(description, category_id)
+
+    def forget_row(self, row_id, description, category_id):
+        """Undo learn_row(), e.g. when the row is deleted"""
+        self._count_row(row_id, description, category_id, -1)
+        return self.forget(description, category_id)
+
+    def learn_rows(self, rows):
+        """Learn (id, description, category_id) rows, remembering the highest id"""
+        learned = 0
+        for row_id, description, category_id in rows:
+            learned += self.learn_row(row_id, description, category_id)
+            self.last_transaction_id = max(self.last_transaction_id, row_id)
+        return learned
+
+    def _denominators(self):
+        if self._log_denominators is None:
+            size = len(self.vocabulary)
+            self._log_denominators = {
+                category_id: math.log(self.word_totals[category_id] + SMOOTHING * size)
+                for category_id in self.documents
+            }
+        return self._log_denominators
+
+    def predict(self, description, allowed=None):
+        """Most likely category for a description, or None
+
+        allowed limits the candidates, e.g. to expense categories. None is
+        returned when none of the words has been seen before.
+        """
+        tokens = [word for word in tokenize(description) if word in self.vocabulary]
+        denominators = self._denominators()
+        candidates = [category_id for category_id in denominators
+                      if allowed is None or category_id in allowed]
+        if not tokens or not candidates:
+            return None
+        total_documents = sum(self.documents[category_id] for category_id in candidates)
+        scores = {}
+        for category_id in candidates:
+            counts = self.words[category_id]
+            score = math.log(self.documents[category_id] / total_documents)
+            for word in tokens:
+                score += math.log(counts.get(word, 0) + SMOOTHING) - denominators[category_id]
+            scores[category_id] = score
+        best = max(scores, key=scores.get)
+        # Normalize in log space so long descriptions don't underflow
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return Prediction(best, 1.0 / total)
+
+    def predict_many(self, descriptions, allowed=None):
+        """predict() for each description, sharing the cached denominators"""
+        return [self.predict(description, allowed) for description in descriptions]
+
+    def to_dict(self):
+        return {
+            'version': FORMAT_VERSION,
+            'last_transaction_id': self.last_transaction_id,
+            'checksum': self.checksum,
+            'documents': {str(category_id): count for category_id, count in self.documents.items()},
+            'words': {str(category_id): dict(counts) for category_id, counts in self.words.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported classifier format {data.get('version')}")
+        classifier = cls()
+        classifier.last_transaction_id = data['last_transaction_id']
+        classifier.checksum = list(data['checksum'])
+        classifier.documents.update({int(category_id): count for category_id, count in data['documents'].items()})
+        for category_id, counts in data['words'].items():
+            classifier.words[int(category_id)].update(counts)
+            classifier.word_totals[int(category_id)] = sum(counts.values())
+            classifier.vocabulary.update(counts.keys())
+        return classifier
+
+    def save(self, path):
+        """Write the model atomically, so a crash never leaves half a file"""
+        partial = path + '.partial'
+        with open(partial, 'w') as file:
+            json.dump(self.to_dict(), file)
+        os.replace(partial, path)
+
+def classifier_path(user_id):
+    return os.path.join(config.get_data_dir(), FILENAME_TEMPLATE.format(user_id=user_id))
+
+def _described(user_id):
+    return (Transaction.user_id == user_id,
+            Transaction.description.isnot(None), Transaction.description != "")
+
+def _categorized_rows(session, user_id, after_id=0):
+    return session.execute(
+        select(Transaction.id, Transaction.description, Transaction.category_id)
+        .where(*_described(user_id), Transaction.id > after_id)
+        .order_by(Transaction.id)
+        .execution_options(yield_per=1000)
+    )
+
+def ledger_checksum(session, user_id, through_id):
+    """Checksum of the user's described transactions up to through_id, as learn_row counts it"""
+    row = session.execute(
+        select(func.count(Transaction.id),
+               func.coalesce(func.sum(Transaction.id), 0),
+               func.coalesce(func.sum(Transaction.id * Transaction.category_id), 0),
+               func.coalesce(func.sum(func.length(Transaction.description)), 0))
+        .where(*_described(user_id), Transaction.id <= through_id)
+    ).one()
+    return [int(value) for value in row]
+
+def update_classifier(session, classifier, user_id):
+    """Learn the user's transactions added since the model last saw the ledger"""
+    return classifier.learn_rows(_categorized_rows(session, user_id, classifier.last_transaction_id))
+
+def sync_classifier(session, classifier, user_id, changes=()):
+    """Follow rows added or removed in this session, then learn newer ones
+
+    changes are (sign, id, description, category_id): +1 for a row that
+    was added (or recategorized to category_id), -1 for one removed (or
+    recategorized away from it). Rows above last_transaction_id haven't
+    been learned yet and are left to update_classifier, which reads them
+    as they are now. Returns whether the model changed.
+    """
+    changed = False
+    for sign, row_id, description, category_id in changes:
+        if description and row_id <= classifier.last_transaction_id:
+            if sign > 0:
+                classifier.learn_row(row_id, description, category_id)
+            else:
+                classifier.forget_row(row_id, description, category_id)
+            changed = True
+    return bool(update_classifier(session, classifier, user_id)) or changed
+
+def load_classifier(session, user_id, retrain=False):
+    """The user's saved model, updated with transactions added since it was saved
+
+    A missing or unreadable file, one that no longer matches the ledger up
+    to its last transaction, or retrain, trains from the whole ledger.
+    """
+    path = classifier_path(user_id)
+    classifier = None
+    if not retrain and os.path.exists(path):
+        try:
+            with open(path) as file:
+                classifier = CategoryClassifier.from_dict(json.load(file))
+        except (OSError, ValueError, KeyError):
+            classifier = None
+    if classifier is not None and \
+            classifier.checksum != ledger_checksum(session, user_id, classifier.last_transaction_id):
+        classifier = None
+    stale = classifier is None
+    if stale:
+        classifier = CategoryClassifier()
+    if update_classifier(session, classifier, user_id) or stale:
+        classifier.save(path)
+    return classifier
+
+def main(argv=None):
+    from models import User, session_scope, init_db
+    parser = argparse.ArgumentParser(description="Train or query the category classifier")
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--retrain', action='store_true', help="Train from the whole ledger again")
+    parser.add_argument('descriptions', nargs='*', help="Descriptions to classify")
+    args = parser.parse_args(argv)
+
+    init_db()
+    try:
+        with session_scope() as session:
+            user = session.query(User).filter_by(username=args.user).first()
+            if user is None:
+                raise ValueError(f"User {args.user} not found")
+            classifier = load_classifier(session, user.id, retrain=args.retrain)
+            names = dict(session.query(Category.id, Category.name))
+            print(f"{sum(classifier.documents.values()):,} transactions, "
+                  f"{len(classifier.vocabulary):,} words, {len(classifier.documents)} categories")
+            for description, prediction in zip(args.descriptions, classifier.predict_many(args.descriptions)):
+                if prediction is None:
+                    print(f"{description}\t-")
+                else:
+                    print(f"{description}\t{names.get(prediction.category_id)}\t{prediction.probability:.2f}")
+    except Exception as e:
+        print(f"classifier: {str(e)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
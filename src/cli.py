@@ -0,0 +1,462 @@
+"""Headless command-line interface to the ledger.
+
+    finance-tracker balance
+    finance-tracker export --user alice > alice.csv
+    finance-tracker export --format parquet --output export/
+    finance-tracker import statement.csv --user alice
+    finance-tracker match statement.csv --user alice --days 3
+    finance-tracker report --base SGD
+    finance-tracker rates --set USD SGD 1.35
+    finance-tracker reconcile --repair
+    finance-tracker archive --through 2023
+    finance-tracker backup create
+    finance-tracker maintenance --full
+
+Nothing here imports Qt, and each command imports only the modules it
+uses (pandas only for report and Parquet), so the process starts quickly
+enough to run from cron and in shell pipelines. On SQLite, balance and
+rates (listing only) query the file with sqlite3 and don't import
+SQLAlchemy or the models at all, which is most of the start-up time.
+Output is tab-separated where it is a table. Read-only commands don't
+create or migrate the schema; import, rates --set and reconcile do.
+"""
+import argparse
+import sys
+
+CSV_HEADER = ["Date", "Type", "Category", "Amount", "Currency", "Description"]
+
+def _user_accounts(session, username):
+    """(id, currency) of the user's accounts, first account first"""
+    from sqlalchemy import select
+    from models import Account, User
+    query = select(Account.id, Account.currency).join(User, User.id == Account.user_id)
+    if username is not None:
+        query = query.where(User.username == username)
+    accounts = session.execute(query.order_by(Account.id)).all()
+    if not accounts:
+        raise ValueError(f"No account found for user {username}" if username else "No accounts found")
+    return accounts
+
+def _read_only_sqlite():
+    """sqlite3 connection to the configured database file, opened read-only, or None
+
+    None unless the database is a plain SQLite file that exists, in which
+    case callers query through SQLAlchemy as usual.
+    """
+    import os
+    import config
+    url = config.get_database_url()
+    prefix = 'sqlite:///'
+    if not url.startswith(prefix) or '?' in url:
+        return None
+    path = url[len(prefix):]
+    if not path or path == ':memory:' or not os.path.exists(path):
+        return None
+    import sqlite3
+    return sqlite3.connect(config.read_only_uri(path), uri=True)
+
+def _balances(args):
+    connection = _read_only_sqlite()
+    if connection is not None:
+        where, params = (" WHERE users.username = ?", (args.user,)) if args.user else ("", ())
+        try:
+            return connection.execute(
+                "SELECT users.username, accounts.id, accounts.name, accounts.currency, accounts.balance "
+                f"FROM accounts JOIN users ON users.id = accounts.user_id{where} "
+                "ORDER BY users.username, accounts.id", params
+            ).fetchall()
+        finally:
+            connection.close()
+    from sqlalchemy import select
+    from models import Account, User, Session
+    session = Session()
+    try:
+        query = (select(User.username, Account.id, Account.name, Account.currency, Account.balance)
+                 .join(User, User.id == Account.user_id).order_by(User.username, Account.id))
+        if args.user:
+            query = query.where(User.username == args.user)
+        return session.execute(query).all()
+    finally:
+        session.close()
+
+def cmd_balance(args, out):
+    for username, account_id, name, currency, balance in _balances(args):
+        out.write(f"{username}\t{account_id}\t{name}\t{currency}\t{balance or 0.0:.2f}\n")
+    return 0
+
+def _write_csv(session, account_ids, out, start=None, end=None):
+    import csv
+    from sqlalchemy import select
+    from models import Category
+    from archive import iter_rows_in_range
+    names = dict(session.execute(select(Category.id, Category.name)).all())
+    writer = csv.writer(out)
+    writer.writerow(CSV_HEADER)
+    count = 0
+    for account_id in account_ids:
+        # Archived years are only read if the range reaches them
+        for row in iter_rows_in_range(session, account_id, start, end):
+            writer.writerow([
+                row.date.strftime("%Y-%m-%d"),
+                row.type.value,
+                names.get(row.category_id, "Unknown"),
+                f"{row.amount:.2f}",
+                row.currency,
+                row.description or "",
+            ])
+            count += 1
+    return count
+
+def _date_arg(text):
+    from datetime import datetime
+    if not text:
+        return None
+    try:
+        return datetime.strptime(text, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"Invalid date {text}, expected YYYY-MM-DD")
+
+def cmd_export(args, out):
+    from models import ENGINE, Session
+    if args.format == 'parquet':
+        if not args.output:
+            raise ValueError("--output directory is required for Parquet export")
+        from columnar import export_all
+        counts = export_all(ENGINE, args.output)
+        print(f"Exported {counts['transactions']:,} transactions to {args.output}", file=sys.stderr)
+        return 0
+
+    session = Session()
+    try:
+        if args.account is not None:
+            account_ids = [args.account]
+        else:
+            account_ids = [account_id for account_id, _ in _user_accounts(session, args.user)]
+        start, end = _date_arg(args.since), _date_arg(args.until)
+        if args.output:
+            with open(args.output, 'w', newline='') as file:
+                count = _write_csv(session, account_ids, file, start, end)
+        else:
+            count = _write_csv(session, account_ids, out, start, end)
+    finally:
+        session.close()
+    print(f"Exported {count:,} transactions", file=sys.stderr)
+    return 0
+
+def import_csv(session, path, account_id):
+    """Bulk insert a CSV in the export format into an account
+
+    Amounts are signed, in the row's currency. Checkpoints, budget counters
+    and the account balance are updated for the whole file at once, as for
+    the Parquet import. Rows already
+    in the ledger (by fingerprint) are skipped, so a file can be imported
+    again safely. Rows with a blank Category get the one the user's rules
+    assign, or else the one the classifier predicts from the description
+    with at least MIN_PROBABILITY; rows that get neither are left out.
+    Returns (rows inserted, duplicates skipped, line numbers left out).
+    """
+    import csv
+    from collections import defaultdict
+    from datetime import datetime
+    from sqlalchemy import select
+    from models import (Account, Category, Transaction, TransactionType, LEDGER_FIELDS,
+                        add_to_balances, apply_ledger_changes, assign_fingerprints)
+
+    user_id = session.execute(select(Account.user_id).where(Account.id == account_id)).scalar()
+    if user_id is None:
+        raise ValueError(f"Account {account_id} not found")
+    categories = {}
+    category_types = defaultdict(set)
+    for category_id, name, category_type in session.execute(select(Category.id, Category.name, Category.type)):
+        categories[name] = category_id
+        category_types[category_type].add(category_id)
+
+    rows = []
+    unclassified = []
+    with open(path, newline='') as file:
+        for line, record in enumerate(csv.DictReader(file), start=2):
+            try:
+                if record["Category"].strip():
+                    category_id = categories[record["Category"]]
+                else:
+                    category_id = None
+                    unclassified.append((line, len(rows)))
+                rows.append({
+                    'date': datetime.strptime(record["Date"], "%Y-%m-%d"),
+                    'type': TransactionType(record["Type"].upper()),
+                    'category_id': category_id,
+                    'amount': float(record["Amount"].replace(",", "")),
+                    'currency': record["Currency"].strip().upper(),
+                    'description': record.get("Description") or "",
+                    'account_id': account_id,
+                    'user_id': user_id,
+                })
+            except KeyError as e:
+                raise ValueError(f"{path}:{line}: unknown category or missing column {str(e)}")
+            except Exception as e:
+                raise ValueError(f"{path}:{line}: {str(e)}")
+    uncategorized = []
+    if unclassified:
+        from rules import load_rules
+        from classifier import MIN_PROBABILITY
+        rule_set = load_rules(session, user_id)
+        classifier = None
+        for line, index in unclassified:
+            row = rows[index]
+            # The user's rules decide first, learned suggestions fill the rest
+            row['category_id'] = rule_set.match(row['description'], row['type'])
+            if row['category_id'] is not None:
+                continue
+            if classifier is None:
+                from classifier import load_classifier
+                classifier = load_classifier(session, user_id)
+            prediction = classifier.predict(row['description'], allowed=category_types[row['type']])
+            if prediction is None or prediction.probability < MIN_PROBABILITY:
+                uncategorized.append(line)
+                continue
+            row['category_id'] = prediction.category_id
+        rows = [row for row in rows if row['category_id'] is not None]
+    rows, duplicates = assign_fingerprints(session.connection(), rows, skip_duplicates=True)
+    if not rows:
+        return 0, len(duplicates), uncategorized
+
+    session.execute(Transaction.__table__.insert(), rows)
+    add_to_balances(session, rows)
+    apply_ledger_changes(session.connection(), [
+        (None, {name: row[name] for name in LEDGER_FIELDS}) for row in rows
+    ])
+    return len(rows), len(duplicates), uncategorized
+
+def cmd_import(args, out):
+    import os
+    from models import init_db, session_scope
+    init_db()
+    uncategorized = []
+    with session_scope() as session:
+        if os.path.isdir(args.path):
+            from columnar import import_reference_data, import_transactions
+            import_reference_data(session, args.path)
+            count, duplicates = import_transactions(session, args.path)
+        else:
+            if args.account is not None:
+                account_id = args.account
+            elif args.user:
+                account_id = _user_accounts(session, args.user)[0][0]
+            else:
+                raise ValueError("--user or --account is required for CSV import")
+            count, duplicates, uncategorized = import_csv(session, args.path, account_id)
+    skipped = f", skipped {duplicates:,} duplicates" if duplicates else ""
+    out.write(f"Imported {count:,} transactions{skipped}\n")
+    if uncategorized:
+        lines = ", ".join(str(line) for line in uncategorized)
+        out.write(f"Left out {len(uncategorized):,} rows with no category that none could be "
+                  f"suggested for (lines {lines})\n")
+    return 0
+
+def cmd_match(args, out):
+    from models import Session
+    from statement_matcher import read_statement_csv, match_statement
+    if args.account is None and not args.user:
+        raise ValueError("--user or --account is required")
+    session = Session()
+    try:
+        account_id = args.account if args.account is not None else _user_accounts(session, args.user)[0][0]
+        lines = read_statement_csv(args.path, args.currency.upper())
+        result = match_statement(session, account_id, lines, args.days, args.amount)
+    finally:
+        session.close()
+
+    def line_text(line):
+        return f"{line.line}\t{line.date}\t{line.currency} {line.amount:.2f}\t{line.description}"
+
+    def row_text(row):
+        return f"#{row.id}\t{row.date:%Y-%m-%d}\t{row.currency} {row.amount:.2f}\t{row.description or ''}"
+
+    out.write(f"== matched ({len(result.matched)}) ==\n")
+    for match in result.matched:
+        out.write(f"{line_text(match.line)}\t-> {row_text(match.transaction)}\n")
+    out.write(f"== ambiguous ({len(result.ambiguous)}) ==\n")
+    for line, candidates in result.ambiguous:
+        out.write(f"{line_text(line)}\t-> {' | '.join(row_text(row) for row in candidates)}\n")
+    out.write(f"== unmatched statement lines ({len(result.unmatched)}) ==\n")
+    for line in result.unmatched:
+        out.write(line_text(line) + "\n")
+    out.write(f"== ledger transactions not on the statement ({len(result.unmatched_transactions)}) ==\n")
+    for row in result.unmatched_transactions:
+        out.write(row_text(row) + "\n")
+    return 0
+
+def cmd_report(args, out):
+    import pandas as pd
+    from analytics import AnalyticsEngine
+    from models import ENGINE
+    engine = AnalyticsEngine(ENGINE)
+    try:
+        report = engine.report(args.base.upper(), args.account)
+    finally:
+        engine.close()
+    with pd.option_context('display.width', 200, 'display.max_rows', None,
+                           'display.max_columns', None):
+        for name, frame in report.items():
+            out.write(f"== {name.replace('_', ' ')} ({args.base.upper()}) ==\n")
+            out.write(frame.to_csv(sep='\t') if args.tsv else f"{frame.to_string()}\n")
+            out.write("\n")
+    return 0
+
+def _rates():
+    """(from, to, rate, "YYYY-MM-DD HH:MM" or "") of every exchange rate"""
+    connection = _read_only_sqlite()
+    if connection is not None:
+        try:
+            rows = connection.execute(
+                "SELECT from_currency, to_currency, rate, updated_at FROM exchange_rates "
+                "ORDER BY from_currency, to_currency"
+            ).fetchall()
+        finally:
+            connection.close()
+        # SQLAlchemy stores DateTime as ISO text
+        return [(from_currency, to_currency, rate, (updated_at or "")[:16])
+                for from_currency, to_currency, rate, updated_at in rows]
+    from sqlalchemy import select
+    from models import ExchangeRate, session_scope
+    with session_scope() as session:
+        query = select(ExchangeRate.from_currency, ExchangeRate.to_currency, ExchangeRate.rate,
+                       ExchangeRate.updated_at).order_by(ExchangeRate.from_currency,
+                                                         ExchangeRate.to_currency)
+        return [(from_currency, to_currency, rate,
+                 updated_at.strftime("%Y-%m-%d %H:%M") if updated_at else "")
+                for from_currency, to_currency, rate, updated_at in session.execute(query)]
+
+def cmd_rates(args, out):
+    if args.set:
+        from models import init_db, session_scope, upsert_exchange_rate
+        from_currency, to_currency, rate = args.set
+        try:
+            rate = float(rate)
+        except ValueError:
+            raise ValueError(f"Invalid rate: {rate}")
+        if rate <= 0:
+            raise ValueError("Rate must be positive")
+        init_db()
+        with session_scope() as session:
+            upsert_exchange_rate(session, from_currency.upper(), to_currency.upper(), rate)
+    for from_currency, to_currency, rate, updated in _rates():
+        out.write(f"{from_currency}\t{to_currency}\t{rate:.6g}\t{updated}\n")
+    return 0
+
+def cmd_reconcile(args, out):
+    import reconcile
+    return reconcile.main(args.extra)
+
+def cmd_archive(args, out):
+    import archive
+    return archive.main(args.extra)
+
+def cmd_maintenance(args, out):
+    import maintenance
+    return maintenance.main(args.extra)
+
+def cmd_backup(args, out):
+    import backup
+    return backup.main(args.extra)
+
+def cmd_classify(args, out):
+    import classifier
+    return classifier.main(args.extra)
+
+def cmd_rules(args, out):
+    import rules
+    return rules.main(args.extra)
+
+def cmd_statements(args, out):
+    import statements
+    return statements.main(args.extra)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='finance-tracker',
+                                     description="Finance Tracker ledger operations")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    balance = commands.add_parser('balance', help="Account balances")
+    balance.add_argument('--user', help="Only this username's accounts")
+    balance.set_defaults(func=cmd_balance)
+
+    export = commands.add_parser('export', help="Export transactions as CSV or Parquet")
+    export.add_argument('--user', help="Export this username's accounts")
+    export.add_argument('--account', type=int, help="Export this account id")
+    export.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    export.add_argument('--since', metavar='YYYY-MM-DD', help="CSV: first date to include")
+    export.add_argument('--until', metavar='YYYY-MM-DD', help="CSV: day after the last date to include")
+    export.add_argument('--output', '-o', help="File (CSV, default stdout) or directory (Parquet)")
+    export.set_defaults(func=cmd_export)
+
+    import_ = commands.add_parser('import', help="Import a CSV file or a Parquet export directory")
+    import_.add_argument('path')
+    import_.add_argument('--user', help="Import a CSV into this username's first account")
+    import_.add_argument('--account', type=int, help="Import a CSV into this account id")
+    import_.set_defaults(func=cmd_import)
+
+    match = commands.add_parser('match', help="Match a bank statement CSV against the ledger")
+    match.add_argument('path')
+    match.add_argument('--user', help="Match against this username's first account")
+    match.add_argument('--account', type=int, help="Match against this account id")
+    match.add_argument('--days', type=int, default=2, help="Date tolerance in days")
+    match.add_argument('--amount', type=float, default=0.0, help="Amount tolerance")
+    match.add_argument('--currency', default='SGD', help="Currency of lines without one")
+    match.set_defaults(func=cmd_match)
+
+    report = commands.add_parser('report', help="Category, currency and savings reports")
+    report.add_argument('--base', default='SGD', help="Currency to report in")
+    report.add_argument('--account', type=int, help="Only this account id")
+    report.add_argument('--tsv', action='store_true', help="Tab-separated output")
+    report.set_defaults(func=cmd_report)
+
+    rates = commands.add_parser('rates', help="List or set exchange rates")
+    rates.add_argument('--set', nargs=3, metavar=('FROM', 'TO', 'RATE'))
+    rates.set_defaults(func=cmd_rates)
+
+    # Options (including --help) are parsed by reconcile.main
+    reconcile = commands.add_parser('reconcile', add_help=False,
+                                     help="Verify balances (see reconcile --help)")
+    reconcile.set_defaults(func=cmd_reconcile, passthrough=True)
+
+    archive = commands.add_parser('archive', add_help=False,
+                                  help="Move closed years to per-year files (see archive --help)")
+    archive.set_defaults(func=cmd_archive, passthrough=True)
+
+    maintenance = commands.add_parser('maintenance', add_help=False,
+                                      help="Vacuum, analyze and checkpoint (see maintenance --help)")
+    maintenance.set_defaults(func=cmd_maintenance, passthrough=True)
+
+    backup = commands.add_parser('backup', add_help=False,
+                                 help="Create, list, verify or restore snapshots (see backup --help)")
+    backup.set_defaults(func=cmd_backup, passthrough=True)
+
+    classify = commands.add_parser('classify', add_help=False,
+                                   help="Train or query the category classifier (see classify --help)")
+    classify.set_defaults(func=cmd_classify, passthrough=True)
+
+    rules = commands.add_parser('rules', add_help=False,
+                                help="Add, delete, list or test categorization rules (see rules --help)")
+    rules.set_defaults(func=cmd_rules, passthrough=True)
+
+    statements = commands.add_parser('statements', add_help=False,
+                                     help="Generate HTML or PDF statements in parallel (see statements --help)")
+    statements.set_defaults(func=cmd_statements, passthrough=True)
+    return parser
+
+def main(argv=None, out=None):
+    out = out or sys.stdout
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if extra and not getattr(args, 'passthrough', False):
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    args.extra = extra
+    try:
+        return args.func(args, out)
+    except Exception as e:
+        print(f"finance-tracker {args.command}: {str(e)}", file=sys.stderr)
+        return 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
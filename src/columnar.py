@@ -0,0 +1,280 @@
+"""Parquet/Arrow export and import for analytics.
+
+Transactions are written as a Parquet dataset partitioned by year and
+account (hive layout: transactions/year=2024/account_id=1/*.parquet), so
+readers only open the partitions a filter selects and skip row groups by
+their statistics. Accounts, categories and exchange rates are small and go
+to Arrow IPC files next to it.
+
+Ids only mean something in the database they were exported from, so an
+import matches accounts by username and account name and categories by
+name and type, and lets the target database assign new transaction ids.
+
+    export_all(ENGINE, 'export/')
+    frame = load_transactions('export/', years=[2024], filters=[('currency', '=', 'SGD')])
+"""
+import os
+import shutil
+import uuid
+from collections import defaultdict
+import pandas as pd
+from sqlalchemy import select, func, extract
+from models import (Account, Transaction, Category, ExchangeRate, TransactionType, User,
+                    LEDGER_FIELDS, add_to_balances, apply_ledger_changes, assign_fingerprints, upsert)
+from archive import transaction_tables
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # Optional: pip install -e .[analytics]
+    pa = None
+
+TRANSACTIONS_DIR = 'transactions'
+ACCOUNTS_FILE = 'accounts.arrow'
+CATEGORIES_FILE = 'categories.arrow'
+RATES_FILE = 'exchange_rates.arrow'
+DEFAULT_COMPRESSION = 'zstd'
+CHUNK_SIZE = 250000
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("Parquet export needs pyarrow: pip install -e .[analytics]")
+
+def transaction_schema():
+    """Arrow schema of exported transactions; amounts are int64 cents"""
+    _require_pyarrow()
+    return pa.schema([
+        ('id', pa.int64()),
+        ('date', pa.timestamp('us')),
+        ('type', pa.dictionary(pa.int8(), pa.string())),
+        ('category_id', pa.int32()),
+        ('category', pa.dictionary(pa.int32(), pa.string())),
+        ('amount_minor', pa.int64()),
+        ('currency', pa.dictionary(pa.int8(), pa.string())),
+        ('description', pa.string()),
+        ('user_id', pa.int32()),
+        ('year', pa.int16()),
+        ('account_id', pa.int32()),
+    ])
+
+def _transactions_query(table):
+    # Archive files keep the rows of deleted accounts; the join leaves them out
+    return select(
+        table.c.id,
+        table.c.date,
+        table.c.type,
+        table.c.category_id,
+        Category.name.label('category'),
+        func.round(table.c.amount * 100).label('amount_minor'),
+        table.c.currency,
+        table.c.description,
+        table.c.user_id,
+        extract('year', table.c.date).label('year'),
+        table.c.account_id,
+    ).join(Category, Category.id == table.c.category_id)\
+        .join(Account, Account.id == table.c.account_id)\
+        .order_by(table.c.account_id, table.c.date, table.c.id)
+
+def _to_arrow(frame, schema):
+    """Convert a chunk read from SQL to a typed Arrow table"""
+    frame['type'] = frame['type'].map(lambda value: getattr(value, 'value', value))
+    frame['date'] = pd.to_datetime(frame['date'])
+    frame['description'] = frame['description'].fillna('')
+    for column in ('amount_minor', 'year'):
+        frame[column] = frame[column].astype('int64')
+    return pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+
+def export_transactions(engine, out_dir, compression=DEFAULT_COMPRESSION, chunksize=CHUNK_SIZE):
+    """Write all transactions, archived years included, to a partitioned Parquet dataset
+
+    Returns the row count.
+    """
+    _require_pyarrow()
+    root = os.path.join(out_dir, TRANSACTIONS_DIR)
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    schema = transaction_schema()
+    rows = 0
+    with engine.connect() as connection:
+        frames = (frame for source in transaction_tables(connection)
+                  for frame in pd.read_sql(_transactions_query(source), connection, chunksize=chunksize))
+        for index, frame in enumerate(frames):
+            table = _to_arrow(frame, schema)
+            pq.write_to_dataset(
+                table,
+                root_path=root,
+                partition_cols=['year', 'account_id'],
+                compression=compression,
+                basename_template=f"part-{index}-{uuid.uuid4().hex}-{{i}}.parquet",
+            )
+            rows += table.num_rows
+    return rows
+
+def _export_table(engine, query, path, compression):
+    with engine.connect() as connection:
+        frame = pd.read_sql(query, connection)
+    if 'type' in frame:
+        frame['type'] = frame['type'].map(lambda value: getattr(value, 'value', value))
+    feather.write_feather(frame, path, compression=compression)
+    return len(frame)
+
+def export_all(engine, out_dir, compression=DEFAULT_COMPRESSION):
+    """Export transactions, categories and exchange rates, returning row counts"""
+    _require_pyarrow()
+    os.makedirs(out_dir, exist_ok=True)
+    return {
+        'transactions': export_transactions(engine, out_dir, compression),
+        'accounts': _export_table(engine, select(Account.id, Account.name, Account.currency, User.username)
+                                  .join(User, User.id == Account.user_id),
+                                  os.path.join(out_dir, ACCOUNTS_FILE), compression),
+        'categories': _export_table(engine, select(Category.id, Category.name, Category.type),
+                                    os.path.join(out_dir, CATEGORIES_FILE), compression),
+        'exchange_rates': _export_table(engine, select(ExchangeRate.from_currency, ExchangeRate.to_currency,
+                                                       ExchangeRate.rate, ExchangeRate.updated_at),
+                                        os.path.join(out_dir, RATES_FILE), compression),
+    }
+
+def transactions_dataset(export_dir):
+    """Open the exported transactions as a pyarrow dataset for lazy scanning"""
+    _require_pyarrow()
+    return ds.dataset(os.path.join(export_dir, TRANSACTIONS_DIR), format='parquet',
+                      partitioning='hive', schema=transaction_schema())
+
+def load_transactions(export_dir, years=None, account_ids=None, columns=None, filters=None):
+    """Load exported transactions into a DataFrame
+
+    years and account_ids prune partitions; filters are extra
+    (column, op, value) predicates pushed down to the Parquet reader.
+    """
+    _require_pyarrow()
+    predicates = list(filters or [])
+    if years is not None:
+        predicates.append(('year', 'in', list(years)))
+    if account_ids is not None:
+        predicates.append(('account_id', 'in', list(account_ids)))
+    table = pq.read_table(
+        os.path.join(export_dir, TRANSACTIONS_DIR),
+        columns=columns,
+        filters=predicates or None,
+        partitioning='hive',
+        schema=transaction_schema(),
+    )
+    return table.to_pandas()
+
+def load_accounts(export_dir):
+    _require_pyarrow()
+    return feather.read_feather(os.path.join(export_dir, ACCOUNTS_FILE))
+
+def load_categories(export_dir):
+    _require_pyarrow()
+    return feather.read_feather(os.path.join(export_dir, CATEGORIES_FILE))
+
+def load_rates(export_dir):
+    _require_pyarrow()
+    return feather.read_feather(os.path.join(export_dir, RATES_FILE))
+
+def _account_map(session, export_dir, account_map=None):
+    """Exported account id -> (account id, user id) in this database
+
+    By username and account name, unless account_map gives the target
+    account id for each exported one. Accounts with no match map to None.
+    """
+    if account_map is not None:
+        users = dict(session.execute(select(Account.id, Account.user_id)
+                                     .where(Account.id.in_(set(account_map.values())))).all())
+        return {exported: (target, users[target]) if target in users else None
+                for exported, target in account_map.items()}
+    if not os.path.exists(os.path.join(export_dir, ACCOUNTS_FILE)):
+        raise ValueError(f"{export_dir} has no {ACCOUNTS_FILE}; export it again or pass account_map")
+    targets = {}
+    for account_id, user_id, username, name in session.execute(
+            select(Account.id, Account.user_id, User.username, Account.name)
+            .join(User, User.id == Account.user_id).order_by(Account.id)):
+        targets.setdefault((username, name), (account_id, user_id))
+    return {int(row['id']): targets.get((row['username'], row['name']))
+            for row in load_accounts(export_dir).to_dict('records')}
+
+def _category_map(session, export_dir):
+    """Exported category id -> category id in this database, by name and type"""
+    targets = {}
+    for category_id, name, category_type in session.execute(
+            select(Category.id, Category.name, Category.type).order_by(Category.id)):
+        targets.setdefault((name, category_type), category_id)
+    return {int(row['id']): targets.get((row['name'], TransactionType(row['type'])))
+            for row in load_categories(export_dir).to_dict('records')}
+
+def import_transactions(session, export_dir, filters=None, batch_size=CHUNK_SIZE, account_map=None):
+    """Bulk insert exported transactions into this database's accounts
+
+    Rows go to the account with the same username and account name (or
+    the one account_map gives for their exported account id), in the
+    category with the same name and type, under new ids. Rows whose
+    content matches a stored transaction (by fingerprint) are skipped, so
+    an export can be imported again or merged into a database that has
+    some of its transactions already. Affected balance checkpoints are
+    flagged, budget counters adjusted, and the accounts' balances updated
+    once per batch, instead of per row. Returns (rows inserted, duplicates
+    skipped).
+    """
+    _require_pyarrow()
+    accounts = _account_map(session, export_dir, account_map)
+    categories = _category_map(session, export_dir)
+    dataset = transactions_dataset(export_dir)
+    expression = pq.filters_to_expression(filters) if filters else None
+    inserted = 0
+    duplicates = 0
+    # Identical rows in different batches are numbered as one sequence
+    occurrences = defaultdict(int)
+    connection = session.connection()
+    for batch in dataset.to_batches(filter=expression, batch_size=batch_size):
+        rows = []
+        for row in batch.to_pylist():
+            target = accounts.get(row['account_id'])
+            if target is None:
+                raise ValueError(f"Exported account {row['account_id']} has no account with the same "
+                                 f"username and name in this database")
+            category_id = categories.get(row['category_id'])
+            if category_id is None:
+                raise ValueError(f"Category {row['category']} of the export is not in this database")
+            rows.append({
+                'date': row['date'],
+                'type': TransactionType(row['type']),
+                'category_id': category_id,
+                'amount': row['amount_minor'] / 100.0,
+                'currency': row['currency'],
+                'description': row['description'],
+                'account_id': target[0],
+                'user_id': target[1],
+            })
+        if not rows:
+            continue
+        rows, skipped = assign_fingerprints(connection, rows, skip_duplicates=True, counts=occurrences)
+        duplicates += len(skipped)
+        if rows:
+            session.execute(Transaction.__table__.insert(), rows)
+            inserted += len(rows)
+            add_to_balances(session, rows)
+            apply_ledger_changes(connection, [
+                (None, {name: row[name] for name in LEDGER_FIELDS}) for row in rows
+            ])
+    return inserted, duplicates
+
+def import_reference_data(session, export_dir):
+    """Add categories missing by name and type, and upsert exchange rates by currency pair"""
+    categories = load_categories(export_dir)
+    existing = set(session.execute(select(Category.name, Category.type)).all())
+    for row in categories.to_dict('records'):
+        key = (row['name'], TransactionType(row['type']))
+        if key not in existing:
+            session.add(Category(name=key[0], type=key[1]))
+            existing.add(key)
+    session.flush()
+    rates = load_rates(export_dir)
+    for row in rates.to_dict('records'):
+        upsert(session, ExchangeRate,
+               {'from_currency': row['from_currency'], 'to_currency': row['to_currency'],
+                'rate': float(row['rate']), 'updated_at': row['updated_at'].to_pydatetime()},
+               index_elements=['from_currency', 'to_currency'], update_columns=['rate', 'updated_at'])
+    return {'categories': len(categories), 'exchange_rates': len(rates)}
@@ -0,0 +1,234 @@
+"""Undoable ledger edits.
+
+Each command keeps only what it needs to apply and revert itself: the
+values of an added or deleted row, the (old, new) pairs of edited fields,
+and the balance change in the account's currency. Undo applies the exact
+inverse delta, so it never rescans transactions and stays correct even if
+exchange rates changed in between. Derived tables (checkpoints, budget
+counters) follow through the flush hooks in models.py.
+
+A row that undo or redo brings back keeps its id unless another row took
+it in the meantime (SQLite reuses the highest rowid); then it gets a new
+one, and the log points every command that refers to it at the new id.
+
+    log = CommandLog(session)
+    command = log.execute(AddTransaction(values, balance_delta=-12.5))
+    log.undo()
+    log.redo()
+"""
+from collections import deque
+from models import Account, Transaction, ExchangeRate, upsert_exchange_rate
+
+# Undo history kept per window
+DEFAULT_HISTORY = 100
+
+TRANSACTION_COLUMNS = [column.name for column in Transaction.__table__.columns]
+
+def _adjust_balance(session, account_id, delta):
+    account = session.get(Account, account_id)
+    account.balance = round((account.balance or 0.0) + delta, 2)
+
+def _insert_transaction(session, transaction_id, values):
+    """Insert a row under its earlier id if that is still free, returning the id it got"""
+    if transaction_id is not None and session.get(Transaction, transaction_id) is not None:
+        transaction_id = None
+    transaction = Transaction(id=transaction_id, **values)
+    session.add(transaction)
+    session.flush()
+    return transaction.id
+
+class Command:
+    """Base class; subclasses implement apply and revert against a session"""
+    __slots__ = ()
+    label = ""
+
+    def apply(self, session):
+        raise NotImplementedError
+
+    def revert(self, session):
+        raise NotImplementedError
+
+    def remap(self, old_id, new_id):
+        """Point references to a transaction that came back under a new id"""
+
+class AddTransaction(Command):
+    __slots__ = ('values', 'balance_delta', 'transaction_id', 'row')
+    label = "add transaction"
+
+    def __init__(self, values, balance_delta):
+        self.values = values
+        self.balance_delta = balance_delta
+        self.transaction_id = None
+        self.row = None  # Table row, so redo puts it back in place
+
+    def apply(self, session):
+        self.transaction_id = _insert_transaction(session, self.transaction_id, self.values)
+        _adjust_balance(session, self.values['account_id'], self.balance_delta)
+
+    def revert(self, session):
+        session.delete(session.get(Transaction, self.transaction_id))
+        _adjust_balance(session, self.values['account_id'], -self.balance_delta)
+
+    def remap(self, old_id, new_id):
+        if self.transaction_id == old_id:
+            self.transaction_id = new_id
+
+class DeleteTransaction(Command):
+    __slots__ = ('values', 'balance_delta', 'row')
+    label = "delete transaction"
+
+    def __init__(self, transaction, balance_delta, row=None):
+        self.values = {name: getattr(transaction, name) for name in TRANSACTION_COLUMNS}
+        self.balance_delta = balance_delta
+        self.row = row
+
+    @property
+    def transaction_id(self):
+        return self.values['id']
+
+    def apply(self, session):
+        session.delete(session.get(Transaction, self.values['id']))
+        _adjust_balance(session, self.values['account_id'], self.balance_delta)
+
+    def revert(self, session):
+        # Numbered again on flush: an identical row added meanwhile may hold the old fingerprint
+        values = {name: value for name, value in self.values.items() if name not in ('id', 'fingerprint')}
+        self.values['id'] = _insert_transaction(session, self.values['id'], values)
+        _adjust_balance(session, self.values['account_id'], -self.balance_delta)
+
+    def remap(self, old_id, new_id):
+        if self.values['id'] == old_id:
+            self.values['id'] = new_id
+
+class EditTransaction(Command):
+    __slots__ = ('transaction_id', 'account_id', 'changes', 'balance_delta')
+    label = "edit transaction"
+
+    def __init__(self, transaction, new_values, balance_delta):
+        self.transaction_id = transaction.id
+        self.account_id = transaction.account_id
+        # Only fields that actually change are kept
+        self.changes = {
+            name: (getattr(transaction, name), value)
+            for name, value in new_values.items() if getattr(transaction, name) != value
+        }
+        self.balance_delta = balance_delta
+
+    def _set(self, session, index, sign):
+        transaction = session.get(Transaction, self.transaction_id)
+        for name, values in self.changes.items():
+            setattr(transaction, name, values[index])
+        _adjust_balance(session, self.account_id, sign * self.balance_delta)
+
+    def apply(self, session):
+        self._set(session, 1, 1)
+
+    def revert(self, session):
+        self._set(session, 0, -1)
+
+    def remap(self, old_id, new_id):
+        if self.transaction_id == old_id:
+            self.transaction_id = new_id
+
+class CurrencyChange(Command):
+    __slots__ = ('account_id', 'old_currency', 'new_currency', 'old_balance', 'new_balance')
+    label = "currency change"
+
+    def __init__(self, account, new_currency, new_balance):
+        self.account_id = account.id
+        self.old_currency = account.currency
+        self.new_currency = new_currency
+        self.old_balance = account.balance
+        self.new_balance = new_balance
+
+    def _set(self, session, currency, balance):
+        account = session.get(Account, self.account_id)
+        account.currency = currency
+        account.balance = balance
+
+    def apply(self, session):
+        self._set(session, self.new_currency, self.new_balance)
+
+    def revert(self, session):
+        self._set(session, self.old_currency, self.old_balance)
+
+class RateChange(Command):
+    __slots__ = ('from_currency', 'to_currency', 'old_rate', 'new_rate')
+    label = "rate change"
+
+    def __init__(self, from_currency, to_currency, old_rate, new_rate):
+        self.from_currency = from_currency
+        self.to_currency = to_currency
+        self.old_rate = old_rate  # None if the pair didn't exist
+        self.new_rate = new_rate
+
+    def apply(self, session):
+        upsert_exchange_rate(session, self.from_currency, self.to_currency, self.new_rate)
+
+    def revert(self, session):
+        if self.old_rate is None:
+            session.query(ExchangeRate)\
+                .filter_by(from_currency=self.from_currency, to_currency=self.to_currency)\
+                .delete(synchronize_session=False)
+        else:
+            upsert_exchange_rate(session, self.from_currency, self.to_currency, self.old_rate)
+
+class CommandLog:
+    """Runs commands in their own commit and keeps undo and redo stacks"""
+    def __init__(self, session, limit=DEFAULT_HISTORY):
+        self.session = session
+        self.undo_stack = deque(maxlen=limit)
+        self.redo_stack = []
+
+    def _run(self, command, step, related=()):
+        """Run one step in its own commit
+
+        related are the commands that ran while the step's row existed;
+        they follow it if it comes back under a new id.
+        """
+        old_id = getattr(command, 'transaction_id', None)
+        try:
+            step(self.session)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        new_id = getattr(command, 'transaction_id', None)
+        if old_id is not None and new_id != old_id:
+            for other in related:
+                other.remap(old_id, new_id)
+
+    @property
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    @property
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def execute(self, command):
+        """Apply a new command; this discards anything that could be redone"""
+        self._run(command, command.apply)
+        self.undo_stack.append(command)
+        self.redo_stack.clear()
+        return command
+
+    def undo(self):
+        """Revert the last command, returning it, or None if there is nothing to undo"""
+        if not self.undo_stack:
+            return None
+        command = self.undo_stack[-1]
+        # Undoing a delete: the commands before it saw the row
+        self._run(command, command.revert, self.undo_stack)
+        self.redo_stack.append(self.undo_stack.pop())
+        return command
+
+    def redo(self):
+        """Apply the last undone command again, returning it, or None"""
+        if not self.redo_stack:
+            return None
+        command = self.redo_stack[-1]
+        # Redoing an add: the commands undone after it saw the row
+        self._run(command, command.apply, self.redo_stack)
+        self.undo_stack.append(self.redo_stack.pop())
+        return command
@@ -0,0 +1,125 @@
+import json
+import os
+import sys
+
+APP_NAME = 'FinanceTracker'
+DB_FILENAME = 'finance_tracker.db'
+CONFIG_FILENAME = 'config.json'
+
+# Environment variables take precedence over the config file
+ENV_DATABASE_URL = 'FINANCE_TRACKER_DATABASE_URL'
+ENV_CONFIG_PATH = 'FINANCE_TRACKER_CONFIG'
+ENV_DATA_DIR = 'FINANCE_TRACKER_DATA_DIR'
+# Debugging aids, off unless set (see sql_instrumentation.py and tracing.py)
+ENV_SQL_DEBUG = 'FINANCE_TRACKER_SQL_DEBUG'
+ENV_SLOW_QUERY_MS = 'FINANCE_TRACKER_SLOW_QUERY_MS'
+ENV_TRACE = 'FINANCE_TRACKER_TRACE'
+
+# Connection pool defaults for server databases (PostgreSQL)
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_POOL_TIMEOUT = 30
+DEFAULT_POOL_RECYCLE = 1800
+
+# Database maintenance thresholds (see maintenance.py)
+DEFAULT_MAINTENANCE_IDLE_SECONDS = 120
+DEFAULT_MAINTENANCE_INTERVAL_MINUTES = 60
+DEFAULT_FREELIST_RATIO = 0.10
+DEFAULT_MIN_FREE_PAGES = 256
+DEFAULT_MAX_VACUUM_PAGES = 4096
+DEFAULT_WAL_CHECKPOINT_BYTES = 4 * 1024 * 1024
+
+def is_frozen():
+    """Return True when running from a PyInstaller bundle"""
+    return getattr(sys, 'frozen', False)
+
+def get_data_dir():
+    """Get the per-user directory for the database, config and caches"""
+    override = os.environ.get(ENV_DATA_DIR)
+    if override:
+        path = override
+    elif sys.platform == 'darwin':
+        path = os.path.join(os.path.expanduser('~'), 'Library', 'Application Support', APP_NAME)
+    elif os.name == 'nt':
+        path = os.path.join(os.environ.get('APPDATA', os.path.expanduser('~')), APP_NAME)
+    else:
+        base = os.environ.get('XDG_DATA_HOME', os.path.join(os.path.expanduser('~'), '.local', 'share'))
+        path = os.path.join(base, 'finance-tracker')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def get_config_path():
+    """Get the path of the JSON config file"""
+    return os.environ.get(ENV_CONFIG_PATH) or os.path.join(get_data_dir(), CONFIG_FILENAME)
+
+def load_config():
+    """Load the config file, returning an empty dict if it does not exist"""
+    path = get_config_path()
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Invalid config file {path}: {str(e)}")
+
+def save_config(updates):
+    """Merge updates into the config file"""
+    config = load_config()
+    config.update(updates)
+    path = get_config_path()
+    with open(path, 'w') as f:
+        json.dump(config, f, indent=2, sort_keys=True)
+    return config
+
+def read_only_uri(path):
+    """SQLite URI opening the file at path read-only (connect with uri=True)
+
+    The path is quoted, so #, ? and % in a directory name stay part of it.
+    """
+    from urllib.parse import quote
+    return f"file:{quote(os.path.abspath(path))}?mode=ro"
+
+def default_database_path():
+    """Default SQLite file: next to the source in development, in the data dir when frozen"""
+    if is_frozen():
+        return os.path.join(get_data_dir(), DB_FILENAME)
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), DB_FILENAME)
+
+def get_database_url(config=None):
+    """Resolve the database URL from the environment, then config, then the default file"""
+    url = os.environ.get(ENV_DATABASE_URL)
+    if url:
+        return url
+    if config is None:
+        config = load_config()
+    return config.get('database_url') or f"sqlite:///{default_database_path()}"
+
+def get_pool_options(config=None):
+    """Pool sizing for server databases, overridable from the config file"""
+    if config is None:
+        config = load_config()
+    return {
+        'pool_size': int(config.get('pool_size', DEFAULT_POOL_SIZE)),
+        'max_overflow': int(config.get('max_overflow', DEFAULT_MAX_OVERFLOW)),
+        'pool_timeout': int(config.get('pool_timeout', DEFAULT_POOL_TIMEOUT)),
+        'pool_recycle': int(config.get('pool_recycle', DEFAULT_POOL_RECYCLE)),
+    }
+
+def get_maintenance_options(config=None):
+    """Thresholds for database maintenance, overridable under "maintenance" in the config file"""
+    if config is None:
+        config = load_config()
+    options = config.get('maintenance', {})
+    return {
+        'idle_seconds': int(options.get('idle_seconds', DEFAULT_MAINTENANCE_IDLE_SECONDS)),
+        'interval_minutes': int(options.get('interval_minutes', DEFAULT_MAINTENANCE_INTERVAL_MINUTES)),
+        'freelist_ratio': float(options.get('freelist_ratio', DEFAULT_FREELIST_RATIO)),
+        'min_free_pages': int(options.get('min_free_pages', DEFAULT_MIN_FREE_PAGES)),
+        'max_vacuum_pages': int(options.get('max_vacuum_pages', DEFAULT_MAX_VACUUM_PAGES)),
+        'wal_checkpoint_bytes': int(options.get('wal_checkpoint_bytes', DEFAULT_WAL_CHECKPOINT_BYTES)),
+    }
+
+def env_flag(name):
+    """True if an environment variable is set to anything but 0/false/no/empty"""
+    return os.environ.get(name, '').strip().lower() not in ('', '0', 'false', 'no', 'off')
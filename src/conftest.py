@@ -0,0 +1,58 @@
+import os
+import tempfile
+
+import config
+
+# Keep the test run away from the real database and the user's data dir
+_TEST_DATA_DIR = tempfile.mkdtemp(prefix='finance_tracker_test_')
+os.environ.setdefault(config.ENV_DATA_DIR, _TEST_DATA_DIR)
+os.environ.setdefault(
+    config.ENV_DATABASE_URL,
+    f"sqlite:///{os.path.join(_TEST_DATA_DIR, config.DB_FILENAME)}"
+)
+
+from collections import namedtuple
+import pytest
+
+TestAccount = namedtuple('TestAccount', ['user_id', 'account_id', 'category_id', 'categories'])
+TestAccount.__test__ = False  # Not a test class, whatever pytest thinks of the name
+
+@pytest.fixture
+def make_account():
+    """Factory for a fresh user with one account and optional transactions
+
+    Any user left with the same name by an earlier test is deleted first.
+    Transactions are dicts of Transaction fields; they default to an SGD
+    expense in the first expense category, and 'category' may name one.
+    Returns TestAccount ids, with categories mapping names to ids.
+    """
+    # Imported here so the environment above is set before models connects
+    from models import (Session, init_db, session_scope, User, Account, Transaction, Category,
+                        TransactionType)
+
+    def make(username, balance=0.0, transactions=(), password='x', currency='SGD'):
+        init_db()
+        with session_scope() as session:
+            for user in session.query(User).filter_by(username=username).all():
+                session.delete(user)
+            session.flush()
+            categories = {category.name: category.id for category in session.query(Category)}
+            category_id = session.query(Category.id).filter_by(type=TransactionType.EXPENSE)\
+                .order_by(Category.id).first()[0]
+            user = User(username=username, email=f"{username}@example.com", password=password)
+            account = Account(name="Default Account", currency=currency, user=user, balance=balance)
+            session.add_all([user, account])
+            session.flush()
+            for values in transactions:
+                values = dict(values)
+                if 'category' in values:
+                    values['category_id'] = categories[values.pop('category')]
+                session.add(Transaction(**{'type': TransactionType.EXPENSE, 'category_id': category_id,
+                                           'currency': 'SGD', 'description': "", **values,
+                                           'user_id': user.id, 'account_id': account.id}))
+            result = TestAccount(user.id, account.id, category_id, categories)
+        Session.remove()
+        return result
+
+    yield make
+    Session.remove()
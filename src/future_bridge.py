@@ -0,0 +1,8 @@
+from PyQt6.QtCore import QObject, pyqtSignal
+
+class FutureBridge(QObject):
+    """Deliver the result of a worker-thread Future to the GUI thread"""
+    finished = pyqtSignal(object)
+
+    def watch(self, future):
+        future.add_done_callback(self.finished.emit)
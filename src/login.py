@@ -1,8 +1,9 @@
 from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                            QLineEdit, QPushButton, QLabel, QMessageBox)
 from PyQt6.QtCore import Qt
-from models import Session, User
+from auth import auth_service
 from biometric import BiometricAuth
+from future_bridge import FutureBridge
 
 class LoginWindow(QMainWindow):
     def __init__(self):
@@ -10,6 +11,10 @@ class LoginWindow(QMainWindow):
         self.setWindowTitle("Finance Tracker - Login")
         self.setFixedSize(400, 300)
         
+        # Password checks run on the auth worker thread
+        self.auth_bridge = FutureBridge(self)
+        self.auth_bridge.finished.connect(self.on_credentials_verified)
+        
         # Main widget and layout
         main_widget = QWidget()
         self.setCentralWidget(main_widget)
@@ -71,44 +76,44 @@ class LoginWindow(QMainWindow):
         
     def handle_login(self):
         if self.username.text() and self.password.text():
-            if self.verify_credentials():
-                if BiometricAuth().authenticate(self):
-                    self.open_main_window()
-                else:
-                    QMessageBox.warning(self, "Error", "Biometric authentication failed")
-            else:
-                QMessageBox.warning(self, "Error", "Invalid credentials")
+            self.verify_credentials()
         else:
             QMessageBox.warning(self, "Error", "Please fill in all fields")
     
     def verify_credentials(self):
-        session = None
+        """Start password verification without blocking the window"""
+        self.set_busy(True)
+        future = auth_service.authenticate(self.username.text(), self.password.text())
+        self.auth_bridge.watch(future)
+    
+    def on_credentials_verified(self, future):
+        """Continue login once the worker thread has checked the password"""
+        self.set_busy(False)
         try:
-            session = Session()
-            user = session.query(User).filter_by(username=self.username.text()).first()
-            
-            if not user:
-                QMessageBox.warning(
-                    self, 
-                    "Login Error",
-                    "User not found. Please sign up first."
-                )
-                return False
-            
-            # TODO: Add password verification here
-            return True
-            
+            success, message, user = future.result()
         except Exception as e:
             QMessageBox.critical(
                 self, 
                 "Database Error",
                 f"Failed to verify credentials: {str(e)}"
             )
-            return False
+            return
+            
+        if not success:
+            QMessageBox.warning(self, "Login Error", message)
+            return
             
-        finally:
-            if session is not None:
-                session.close()
+        if BiometricAuth().authenticate(self):
+            self.open_main_window()
+        else:
+            QMessageBox.warning(self, "Error", "Biometric authentication failed")
+    
+    def set_busy(self, busy):
+        """Disable the form while a password check is running"""
+        self.login_btn.setEnabled(not busy)
+        self.login_btn.setText("Verifying..." if busy else "Login")
+        self.username.setEnabled(not busy)
+        self.password.setEnabled(not busy)
     
     def reset_fields(self):
         self.username.clear()
@@ -1,7 +1,13 @@
 import sys
 from PyQt6.QtWidgets import QApplication, QMessageBox
 from login import LoginWindow
-from models import init_db, Session, User, Account, Transaction, Category, TransactionType, ExchangeRate, Base
+from auth import PasswordAuth
+from models import init_db, DB_PATH, Session, session_scope, User, Account, Transaction, Category, TransactionType, ExchangeRate, Base
+from scheduler import run_due
+from backup import backup_service
+from maintenance import maintenance_scheduler
+from sql_instrumentation import install_from_env
+from tracing import enable_from_env
 from sqlalchemy import UniqueConstraint
 
 def main():
@@ -13,6 +19,11 @@ def main():
         # Initialize database
         init_db()
         
+        # Statement timings and slow-query log, if FINANCE_TRACKER_SQL_DEBUG is set
+        install_from_env()
+        # Latency histograms of UI actions, if FINANCE_TRACKER_TRACE is set
+        enable_from_env()
+        
         # Test database connection
         session = Session()
         try:
@@ -24,12 +35,35 @@ def main():
         finally:
             session.close()
             
+        # Pick the password hashing cost for this machine
+        PasswordAuth.calibrate()
+        
+        # Catch up on recurring transactions due since the last start
+        try:
+            with session_scope() as session:
+                run_due(session)
+        except Exception as e:
+            QMessageBox.warning(None, "Recurring Transactions",
+                                f"Failed to add recurring transactions: {str(e)}")
+            
+        # Snapshot the database in the background if the last backup is a day old
+        if DB_PATH:
+            backup_service.backup_if_stale()
+            
         # Show login window
         window = LoginWindow()
         window.show()
         
         # Start application event loop
-        return app.exec()
+        exit_code = app.exec()
+        
+        # Vacuum, analyze and checkpoint as far as the thresholds call for
+        if DB_PATH:
+            try:
+                maintenance_scheduler.on_close()
+            except Exception as e:
+                print(f"Database maintenance failed: {str(e)}", file=sys.stderr)
+        return exit_code
         
     except Exception as e:
         QMessageBox.critical(None, "Database Error", 
@@ -0,0 +1,185 @@
+"""Routine SQLite maintenance: incremental vacuum, statistics and WAL checkpoints.
+
+Deleted and archived rows leave free pages the file never gives back, the
+planner's statistics go stale as tables grow, and the WAL keeps growing
+until it is checkpointed. run_maintenance() does whichever of these the
+thresholds call for:
+
+- incremental vacuum once free pages exceed both freelist_ratio of the file
+  and min_free_pages, releasing at most max_vacuum_pages per run
+- ANALYZE the first time, then PRAGMA optimize, which only re-analyzes
+  tables whose statistics are out of date
+- a TRUNCATE checkpoint once the WAL is over wal_checkpoint_bytes, or after
+  a vacuum so the file actually shrinks
+
+The scheduler runs it after the account window has seen no edits for
+idle_seconds, at most once per interval_minutes, and always on close. A
+database created before incremental auto-vacuum was enabled is converted
+by a one-off full VACUUM, on close only. Thresholds come from the
+"maintenance" section of config.json; each run is summarised in
+maintenance.log in the data directory.
+
+    python maintenance.py           # what the thresholds call for
+    python maintenance.py --full    # as on close
+"""
+import argparse
+import os
+import time
+from collections import namedtuple
+from datetime import datetime
+import config
+
+LOG_FILENAME = 'maintenance.log'
+AUTO_VACUUM_INCREMENTAL = 2
+
+StepResult = namedtuple('StepResult', ['name', 'seconds', 'detail'])
+MaintenanceReport = namedtuple('MaintenanceReport', [
+    'started_at', 'seconds', 'bytes_before', 'bytes_after', 'reclaimed', 'steps'
+])
+
+def database_size(path):
+    """Bytes used by a database file and its WAL"""
+    return sum(os.path.getsize(name) for name in (path, path + '-wal') if os.path.exists(name))
+
+def _database_path(engine):
+    if engine.dialect.name != 'sqlite' or engine.url.database in (None, '', ':memory:'):
+        raise ValueError("Maintenance applies to SQLite database files; PostgreSQL runs autovacuum itself")
+    return engine.url.database
+
+def _pragma(connection, name):
+    return connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+def _run_to_completion(connection, statement):
+    # incremental_vacuum frees one page per step, and execute() only steps
+    # a statement once unless it returns rows; executescript() steps to the end
+    cursor = connection.connection.cursor()
+    try:
+        cursor.executescript(statement)
+    finally:
+        cursor.close()
+
+def _vacuum(connection, options, full):
+    page_count = _pragma(connection, 'page_count')
+    free = _pragma(connection, 'freelist_count')
+    if free < options['min_free_pages'] or free < page_count * options['freelist_ratio']:
+        return None
+    if _pragma(connection, 'auto_vacuum') != AUTO_VACUUM_INCREMENTAL:
+        if not full:
+            return f"{free:,} free pages; enabling incremental vacuum needs a full VACUUM, left for close"
+        connection.exec_driver_sql(f"PRAGMA auto_vacuum={AUTO_VACUUM_INCREMENTAL}")
+        connection.exec_driver_sql("VACUUM")
+        return f"full VACUUM enabled incremental vacuum, released {free:,} pages"
+    _run_to_completion(connection, f"PRAGMA incremental_vacuum({min(free, options['max_vacuum_pages'])})")
+    released = free - _pragma(connection, 'freelist_count')
+    return f"released {released:,} of {free:,} free pages"
+
+def _analyze(connection):
+    analyzed = connection.exec_driver_sql(
+        "SELECT count(*) FROM sqlite_master WHERE name = 'sqlite_stat1'"
+    ).scalar()
+    if not analyzed:
+        connection.exec_driver_sql("ANALYZE")
+        return "ANALYZE (no statistics yet)"
+    _run_to_completion(connection, "PRAGMA optimize")
+    return "PRAGMA optimize"
+
+def _checkpoint(connection, path, options, force):
+    wal_bytes = os.path.getsize(path + '-wal') if os.path.exists(path + '-wal') else 0
+    if not force and wal_bytes < options['wal_checkpoint_bytes']:
+        return None
+    busy, frames, checkpointed = connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").one()
+    detail = f"checkpointed {checkpointed:,} of {frames:,} WAL frames ({wal_bytes:,} bytes)"
+    return detail + ", readers still active" if busy else detail
+
+def run_maintenance(engine=None, options=None, full=False):
+    """Run the maintenance the thresholds call for, returning a MaintenanceReport
+
+    full also converts an old database to incremental vacuum and always
+    checkpoints. A failing step is reported and the others still run.
+    """
+    if engine is None:
+        from models import ENGINE as engine
+    path = _database_path(engine)
+    options = options or config.get_maintenance_options()
+    started_at = datetime.now()
+    started = time.perf_counter()
+    bytes_before = database_size(path)
+    steps = []
+
+    def step(name, func):
+        step_started = time.perf_counter()
+        try:
+            detail = func()
+        except Exception as e:
+            detail = f"failed: {str(e)}"
+        if detail is not None:
+            steps.append(StepResult(name, time.perf_counter() - step_started, detail))
+        return detail
+
+    # VACUUM and the pragmas can't run inside a transaction
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        vacuumed = step('vacuum', lambda: _vacuum(connection, options, full))
+        step('analyze', lambda: _analyze(connection))
+        step('checkpoint', lambda: _checkpoint(connection, path, options, full or vacuumed is not None))
+
+    bytes_after = database_size(path)
+    report = MaintenanceReport(started_at, time.perf_counter() - started, bytes_before, bytes_after,
+                               bytes_before - bytes_after, steps)
+    _log(report)
+    return report
+
+def format_report(report):
+    steps = "; ".join(f"{step.name} ({step.seconds * 1000:.0f} ms): {step.detail}" for step in report.steps)
+    return (f"{report.started_at.isoformat(timespec='seconds')} {report.seconds * 1000:.0f} ms, "
+            f"reclaimed {report.reclaimed:,} bytes ({report.bytes_after:,} now). {steps}")
+
+def _log(report):
+    with open(os.path.join(config.get_data_dir(), LOG_FILENAME), 'a') as log:
+        log.write(format_report(report) + "\n")
+
+class MaintenanceScheduler:
+    """Runs maintenance when the app is idle, at most once per interval, and on close"""
+    def __init__(self, engine=None, options=None):
+        self.engine = engine
+        self.options = options
+        self.last_run = None
+        self.last_report = None
+
+    def get_options(self):
+        return self.options or config.get_maintenance_options()
+
+    def due(self):
+        interval = self.get_options()['interval_minutes'] * 60
+        return self.last_run is None or time.monotonic() - self.last_run >= interval
+
+    def on_idle(self):
+        """Run if the interval has passed since the last run, else return None"""
+        if not self.due():
+            return None
+        return self.run()
+
+    def on_close(self):
+        return self.run(full=True)
+
+    def run(self, full=False):
+        self.last_run = time.monotonic()
+        self.last_report = run_maintenance(self.engine, self.get_options(), full)
+        return self.last_report
+
+maintenance_scheduler = MaintenanceScheduler()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Vacuum, analyze and checkpoint the SQLite database")
+    parser.add_argument('--full', action='store_true',
+                        help="Also convert to incremental vacuum if needed and always checkpoint")
+    args = parser.parse_args(argv)
+    try:
+        report = run_maintenance(full=args.full)
+    except Exception as e:
+        print(f"maintenance: {str(e)}")
+        return 1
+    print(format_report(report))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
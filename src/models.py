@@ -1,11 +1,16 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Enum, UniqueConstraint
+from sqlalchemy import (create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Enum,
+                        UniqueConstraint, Boolean, Index, Date, event, inspect, select, update, case,
+                        and_, or_, bindparam)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship, scoped_session
+from sqlalchemy.orm import sessionmaker, relationship, scoped_session, Session as OrmSession
+from sqlalchemy.engine import make_url
+from collections import defaultdict
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import datetime, timedelta
 import enum
-import os
-from PyQt6.QtWidgets import QMessageBox, QTableWidgetItem
+import hashlib
+import re
+import config
 
 Base = declarative_base()
 
@@ -13,6 +18,9 @@ class TransactionType(enum.Enum):
     EXPENSE = "EXPENSE"
     INCOME = "INCOME"
 
+# Shared so PostgreSQL creates a single native enum type for both tables
+transaction_type_enum = Enum(TransactionType, name='transaction_type', metadata=Base.metadata)
+
 class User(Base):
     __tablename__ = 'users'
     
@@ -23,6 +31,9 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.now())
     accounts = relationship("Account", back_populates="user", cascade="all, delete-orphan")
     transactions = relationship("Transaction", back_populates="user", cascade="all, delete-orphan")
+    budgets = relationship("Budget", cascade="all, delete-orphan")
+    recurring_templates = relationship("RecurringTemplate", cascade="all, delete-orphan")
+    category_rules = relationship("CategoryRule", cascade="all, delete-orphan")
 
 class Account(Base):
     __tablename__ = 'accounts'
@@ -35,13 +46,17 @@ class Account(Base):
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     user = relationship("User", back_populates="accounts")
     transactions = relationship("Transaction", back_populates="account", cascade="all, delete-orphan")
+    opening_balances = relationship("OpeningBalance", cascade="all, delete-orphan")
+    # SQLite doesn't enforce the foreign key's ON DELETE CASCADE
+    checkpoints = relationship("BalanceCheckpoint", cascade="all, delete-orphan")
+    archived_fingerprints = relationship("ArchivedFingerprint", cascade="all, delete-orphan")
 
 class Transaction(Base):
     __tablename__ = 'transactions'
     
     id = Column(Integer, primary_key=True)
     date = Column(DateTime, nullable=False, default=datetime.now())
-    type = Column(Enum(TransactionType), nullable=False)
+    type = Column(transaction_type_enum, nullable=False)
     category_id = Column(Integer, ForeignKey('categories.id'), nullable=False)
     amount = Column(Float, nullable=False)
     currency = Column(String(3), nullable=False, default='SGD')  # Add currency field
@@ -49,17 +64,25 @@ class Transaction(Base):
     created_at = Column(DateTime, default=datetime.now())
     account_id = Column(Integer, ForeignKey('accounts.id'), nullable=False)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    # Content hash for duplicate detection, see transaction_fingerprint()
+    fingerprint = Column(String(32))
     
     account = relationship("Account", back_populates="transactions")
     user = relationship("User", back_populates="transactions")
     category = relationship("Category")
 
+    __table_args__ = (
+        Index('ix_transactions_account_date', 'account_id', 'date'),
+        Index('ux_transactions_fingerprint', 'fingerprint', unique=True,
+              sqlite_where=fingerprint.isnot(None), postgresql_where=fingerprint.isnot(None)),
+    )
+
 class Category(Base):
     __tablename__ = 'categories'
     
     id = Column(Integer, primary_key=True)
     name = Column(String(50), nullable=False)
-    type = Column(Enum(TransactionType), nullable=False)
+    type = Column(transaction_type_enum, nullable=False)
     created_at = Column(DateTime, default=datetime.now())
 
     def __repr__(self):
@@ -78,9 +101,185 @@ class ExchangeRate(Base):
         UniqueConstraint('from_currency', 'to_currency', name='unique_currency_pair'),
     )
 
-# Improve database configuration
-DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'finance_tracker.db')
-ENGINE = create_engine(f'sqlite:///{DB_PATH}')
+class BalanceCheckpoint(Base):
+    """Per-account, per-month, per-currency sum and count of transactions"""
+    __tablename__ = 'balance_checkpoints'
+
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete='CASCADE'), nullable=False)
+    month = Column(String(7), nullable=False)  # YYYY-MM
+    currency = Column(String(3), nullable=False)
+    total_minor = Column(Integer, nullable=False, default=0)  # Sum of amounts in cents
+    # The same sum in the account's currency, each transaction converted at the
+    # rate when it was written, as the balance was; NULL when unknown
+    booked_minor = Column(Integer)
+    count = Column(Integer, nullable=False, default=0)
+    dirty = Column(Boolean, nullable=False, default=True)
+    verified_at = Column(DateTime)
+
+    __table_args__ = (
+        UniqueConstraint('account_id', 'month', 'currency', name='unique_account_month_currency'),
+    )
+
+class OpeningBalance(Base):
+    """Carried-forward sum of an account's archived transactions in one currency"""
+    __tablename__ = 'opening_balances'
+
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete='CASCADE'), nullable=False)
+    currency = Column(String(3), nullable=False)
+    total_minor = Column(Integer, nullable=False, default=0)  # Sum of amounts in cents
+    booked_minor = Column(Integer)  # As in BalanceCheckpoint
+    count = Column(Integer, nullable=False, default=0)
+    through_year = Column(Integer, nullable=False)  # Last archived year included
+
+    __table_args__ = (
+        UniqueConstraint('account_id', 'currency', name='unique_opening_balance'),
+    )
+
+class ArchivedYear(Base):
+    """A closed year whose transactions were moved to their own database file"""
+    __tablename__ = 'archived_years'
+
+    year = Column(Integer, primary_key=True, autoincrement=False)
+    filename = Column(String(255), nullable=False)  # In the archive directory
+    transactions = Column(Integer, nullable=False, default=0)
+    archived_at = Column(DateTime, default=datetime.now)
+
+class ArchivedFingerprint(Base):
+    """Fingerprint of an archived transaction, so duplicate checks still see it"""
+    __tablename__ = 'archived_fingerprints'
+
+    fingerprint = Column(String(32), primary_key=True)
+    transaction_id = Column(Integer, nullable=False)  # Its id in the year's archive
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete='CASCADE'), nullable=False)
+    year = Column(Integer, nullable=False)
+
+class BudgetPeriod(enum.Enum):
+    WEEKLY = "WEEKLY"
+    MONTHLY = "MONTHLY"
+    YEARLY = "YEARLY"
+
+class Budget(Base):
+    """Spending limit for one category of a user, per period"""
+    __tablename__ = 'budgets'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    category_id = Column(Integer, ForeignKey('categories.id'), nullable=False)
+    period = Column(Enum(BudgetPeriod, name='budget_period'), nullable=False, default=BudgetPeriod.MONTHLY)
+    limit_amount = Column(Float, nullable=False)
+    currency = Column(String(3), nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+    category = relationship("Category")
+    spend = relationship("BudgetSpend", cascade="all, delete-orphan")
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'category_id', 'period', name='unique_user_category_period'),
+    )
+
+class BudgetSpend(Base):
+    """Spent-to-date counter of a budget for one period and currency, kept current on every write"""
+    __tablename__ = 'budget_spend'
+
+    id = Column(Integer, primary_key=True)
+    budget_id = Column(Integer, ForeignKey('budgets.id', ondelete='CASCADE'), nullable=False)
+    period_start = Column(Date, nullable=False)
+    # Expenses are counted in their own currency and converted when read, so
+    # removing one cancels adding it whatever the rates did in between
+    currency = Column(String(3), nullable=False)
+    spent_minor = Column(Integer, nullable=False, default=0)  # Cents
+
+    __table_args__ = (
+        UniqueConstraint('budget_id', 'period_start', 'currency', name='unique_budget_period_currency'),
+    )
+
+class RecurringTemplate(Base):
+    """A transaction repeated on a cron-like schedule (see scheduler.py)"""
+    __tablename__ = 'recurring_templates'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete='CASCADE'), nullable=False)
+    category_id = Column(Integer, ForeignKey('categories.id'), nullable=False)
+    type = Column(transaction_type_enum, nullable=False)
+    amount = Column(Float, nullable=False)  # Signed, like Transaction.amount
+    currency = Column(String(3), nullable=False)
+    description = Column(String(200))
+    schedule = Column(String(100), nullable=False)  # minute hour day-of-month month day-of-week
+    start_date = Column(DateTime, nullable=False, default=datetime.now)
+    end_date = Column(DateTime)
+    last_run = Column(DateTime)  # Occurrences up to here have been materialized
+    active = Column(Boolean, nullable=False, default=True)
+    created_at = Column(DateTime, default=datetime.now)
+
+    category = relationship("Category")
+
+class RuleKind(enum.Enum):
+    CONTAINS = "CONTAINS"
+    REGEX = "REGEX"
+
+class CategoryRule(Base):
+    """Assigns a category to descriptions matching a pattern (see rules.py)"""
+    __tablename__ = 'category_rules'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    category_id = Column(Integer, ForeignKey('categories.id'), nullable=False)
+    kind = Column(Enum(RuleKind, name='rule_kind'), nullable=False, default=RuleKind.CONTAINS)
+    pattern = Column(String(200), nullable=False)
+    priority = Column(Integer, nullable=False, default=0)  # Higher wins when several rules match
+    created_at = Column(DateTime, default=datetime.now)
+
+    category = relationship("Category")
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'kind', 'pattern', name='unique_user_rule_pattern'),
+    )
+
+def create_db_engine(url=None):
+    """Create an engine for the configured database URL with sensible pooling"""
+    settings = config.load_config()
+    url = make_url(url or config.get_database_url(settings))
+    options = {'pool_pre_ping': True}
+    if url.get_backend_name() == 'sqlite':
+        # Worker threads (auth, backups) share pooled connections
+        options['connect_args'] = {'check_same_thread': False}
+    else:
+        options.update(config.get_pool_options(settings))
+    engine = create_engine(url, **options)
+    if url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:'):
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+    return engine
+
+def read_only_engine(url=None):
+    """Engine whose connections can't write, for reports run in other processes"""
+    url = make_url(url or config.get_database_url(config.load_config()))
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            raise ValueError("A read-only connection needs a SQLite database file")
+        import sqlite3
+        uri = config.read_only_uri(url.database)
+        # mode=ro makes SQLite itself refuse writes; WAL lets it read while the app writes
+        return create_engine('sqlite://', creator=lambda: sqlite3.connect(
+            uri, uri=True, check_same_thread=False))
+    # Each transaction starts READ ONLY
+    return create_engine(url, pool_pre_ping=True).execution_options(postgresql_readonly=True)
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # Only takes effect on a new, empty database; older files are converted
+    # by a full VACUUM in maintenance.py
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # Readers (backups, reports) and the writer then don't block each other
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+ENGINE = create_db_engine()
+DATABASE_URL = ENGINE.url
+# Path of the SQLite database file, None when using a server database
+DB_PATH = DATABASE_URL.database if DATABASE_URL.get_backend_name() == 'sqlite' else None
 SessionFactory = sessionmaker(bind=ENGINE)
 Session = scoped_session(SessionFactory)
 
@@ -100,6 +299,13 @@ def session_scope():
 def init_db():
     """Initialize database and create default data"""
     Base.metadata.create_all(ENGINE)
+    add_fingerprint_column(ENGINE)
+    add_budget_spend_currency(ENGINE)
+    add_booked_columns(ENGINE)
+    # create_all only adds indexes with new tables; add new ones to existing tables too
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(ENGINE, checkfirst=True)
     
     session = Session()
     try:
@@ -168,123 +374,498 @@ def get_session():
     """Get a new database session with proper error handling"""
     return Session()
 
-def update_balances(self):
-    """Update balances in all currencies using float"""
-    try:
-        with session_scope() as session:
-            # Get base balance from balance_inquiry
-            self.account = self.balance_inquiry.get_account()
-            if not self.account:
-                QMessageBox.critical(self, "Account Error", "Account not found.")
-                return
-            base_balance = self.balance_inquiry.get_balance()  # Get balance from balance_inquiry
-            
-            # Update balance in all currencies
-            for currency, label in self.balance_labels.items():
-                if currency == self.account.currency:
-                    balance = base_balance
-                else:
-                    balance = self.convert_amount(base_balance, self.account.currency, currency)
-                label.setText(f"{currency} {balance:,.2f}")
-            
-            # Update running balances in transaction table
-            running_balance_sgd = 0.0
-            running_balance_account = 0.0
-            
-            for row in range(self.transactions_table.rowCount()):
-                # Get amount from amount column
-                amount_text = self.transactions_table.item(row, 3).text()
-                #curr = amount_text.split()[0]  # Get currency
-                curr, amount = amount_text.split()  # Split currency and amount
-                try:
-                    ## Parse amount using the improved method
-                    #amount = self.parse_amount_string(amount_text)
-                    
-                    # Convert to SGD and account currency
-                    if curr != 'SGD':
-                        amount_sgd = self.convert_amount(amount, curr, 'SGD')
-                    else:
-                        amount_sgd = amount
-                        
-                    if curr != self.account.currency:
-                        amount_account = self.convert_amount(amount, curr, self.account.currency)
-                    else:
-                        amount_account = amount
-                    
-                    running_balance_sgd = round(running_balance_sgd + amount_sgd, 2)
-                    running_balance_account = round(running_balance_account + amount_account, 2)
-                    
-                    # Update balance column
-                    balance_text = f"SGD {running_balance_sgd:,.2f} / {self.account.currency} {running_balance_account:,.2f}"
-                    balance_item = QTableWidgetItem(balance_text)
-                    balance_item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
-                    self.transactions_table.setItem(row, 4, balance_item)
-                    
-                except ValueError as e:
-                    QMessageBox.warning(
-                        self, 
-                        "Conversion Error", 
-                        f"Error processing amount in row {row + 1}: {str(e)}"
-                    )
-                    
-            # Update charts
-            self.update_charts()
-            
-    except Exception as e:
-        QMessageBox.critical(
-            self, 
-            "Error", 
-            f"Failed to update balances: {str(e)}"
-        )
+def dialect_insert(session, model):
+    """INSERT construct supporting ON CONFLICT for the session's or connection's database"""
+    bind = session if hasattr(session, 'dialect') else session.get_bind()
+    dialect = bind.dialect.name
+    # Imported here so SQLite-only processes (the CLI) don't load the PostgreSQL dialect
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(model)
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert(model)
+    raise NotImplementedError(f"Upsert is not supported on {dialect}")
 
-def add_transaction_to_table(self, transaction, running_balance=None):
-    try:
-        row_position = self.transactions_table.rowCount()
-        self.transactions_table.insertRow(row_position)
-        
-        # Format date
-        date_item = QTableWidgetItem(transaction.date.strftime("%Y-%m-%d"))
-        self.transactions_table.setItem(row_position, 0, date_item)
-        
-        # Transaction type
-        type_item = QTableWidgetItem(transaction.type.value)
-        self.transactions_table.setItem(row_position, 1, type_item)
-        
-        # Category
-        category = self.session.query(Category).get(transaction.category_id)
-        category_item = QTableWidgetItem(category.name if category else "Unknown")
-        self.transactions_table.setItem(row_position, 2, category_item)
-        
-        # Amount with currency
-        amount = float(transaction.amount)
-        amount_str = f"{transaction.currency} {abs(amount):,.2f}"
-        if amount < 0:
-            amount_str = f"{transaction.currency} -{abs(amount):,.2f}"
-        amount_item = QTableWidgetItem(amount_str)
-        amount_item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
-        self.transactions_table.setItem(row_position, 3, amount_item)
-        
-        # Calculate running balance
-        if running_balance is not None:
-            new_balance = running_balance
-        else:
-            if row_position == 0:
-                new_balance = amount
-            else:
-                # Get the balance from the database, not the screen
-                prev_balance = self.balance_inquiry.get_balance()
-                new_balance = round(prev_balance + amount, 2)
-
-        # Format balance
-        balance_item = QTableWidgetItem(f"{transaction.currency} {new_balance:,.2f}")
-        balance_item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
-        self.transactions_table.setItem(row_position, 4, balance_item)
-        
-        # Color code amounts
-        if amount < 0:
-            amount_item.setForeground(Qt.GlobalColor.red)
+def upsert(session, model, values, index_elements, update_columns):
+    """Insert rows or update them on conflict, on SQLite and PostgreSQL
+
+    Accepts a session or a connection; values may be a dict or a list of dicts.
+    """
+    stmt = dialect_insert(session, model).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={column: stmt.excluded[column] for column in update_columns}
+    )
+    session.execute(stmt)
+
+def convert_amount(session, amount, from_curr, to_curr):
+    """Convert amount between currencies using the stored rates"""
+    return Converter(session).convert(amount, from_curr, to_curr)
+
+class Converter:
+    """convert_amount that looks each currency pair's rate up only once"""
+    def __init__(self, session):
+        self.session = session
+        self.rates = {}
+
+    def _rates(self, from_curr, to_curr):
+        pair = (from_curr, to_curr)
+        if pair not in self.rates:
+            # Core select so this also works on a bare connection inside flush events
+            rate = self.session.execute(
+                select(ExchangeRate.rate).filter_by(from_currency=from_curr, to_currency=to_curr)
+            ).scalar()
+            reverse_rate = None
+            if not rate:
+                reverse_rate = self.session.execute(
+                    select(ExchangeRate.rate).filter_by(from_currency=to_curr, to_currency=from_curr)
+                ).scalar()
+            self.rates[pair] = (rate, reverse_rate)
+        return self.rates[pair]
+
+    def convert(self, amount, from_curr, to_curr):
+        if from_curr == to_curr:
+            return round(float(amount), 2)
+        rate, reverse_rate = self._rates(from_curr, to_curr)
+        if rate:
+            return round(float(amount) * rate, 2)
+        if reverse_rate:
+            return round(float(amount) / reverse_rate, 2)
+        raise ValueError(f"No exchange rate found for {from_curr} to {to_curr}")
+
+    def minor(self, total_minor, from_curr, to_curr):
+        """Cents converted to cents of another currency, or None without a rate"""
+        try:
+            return round(self.convert(total_minor / 100.0, from_curr, to_curr) * 100)
+        except ValueError:
+            return None
+
+def month_key(date):
+    """Checkpoint key for the month containing date"""
+    return date.strftime('%Y-%m')
+
+def budget_period_start(date, period):
+    """First day of the budget period containing date"""
+    day = date.date() if isinstance(date, datetime) else date
+    if period == BudgetPeriod.WEEKLY:
+        return day - timedelta(days=day.weekday())
+    if period == BudgetPeriod.YEARLY:
+        return day.replace(month=1, day=1)
+    return day.replace(day=1)
+
+def apply_budget_spend(connection, changes):
+    """Adjust the spent-to-date counters of budgets matching changed expenses
+
+    Costs one indexed lookup per distinct (user, category) and one upsert,
+    however much history the budget covers.
+    """
+    entries = [
+        (values, sign)
+        for change in changes
+        for values, sign in zip(change, (-1, 1))
+        if values is not None and values['amount'] is not None and values['amount'] < 0
+    ]
+    if not entries:
+        return
+    pairs = {(values['user_id'], values['category_id']) for values, _ in entries}
+    budgets = connection.execute(
+        select(Budget.__table__).where(or_(*[
+            and_(Budget.user_id == user_id, Budget.category_id == category_id)
+            for user_id, category_id in pairs
+        ]))
+    ).all()
+    if not budgets:
+        return
+    budgets_by_pair = defaultdict(list)
+    for budget in budgets:
+        budgets_by_pair[(budget.user_id, budget.category_id)].append(budget)
+
+    deltas = defaultdict(int)
+    for values, sign in entries:
+        for budget in budgets_by_pair.get((values['user_id'], values['category_id']), ()):
+            period_start = budget_period_start(values['date'], budget.period)
+            # Periods before the budget existed have no counter to adjust
+            if period_start < budget_period_start(budget.created_at, budget.period):
+                continue
+            deltas[(budget.id, period_start, values['currency'])] += sign * round(-values['amount'] * 100)
+
+    rows = [
+        {'budget_id': budget_id, 'period_start': period_start, 'currency': currency, 'spent_minor': delta}
+        for (budget_id, period_start, currency), delta in deltas.items() if delta
+    ]
+    if not rows:
+        return
+    stmt = dialect_insert(connection, BudgetSpend).values(rows)
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=['budget_id', 'period_start', 'currency'],
+        set_={'spent_minor': BudgetSpend.__table__.c.spent_minor + stmt.excluded.spent_minor}
+    ))
+
+def mark_checkpoints_dirty(connection, changes):
+    """Flag the checkpoints of changed transactions for re-summing
+
+    The change is also booked: converted to the account's currency at
+    today's rate, as the balance is updated, and added to booked_minor.
+    Without a rate the checkpoint's booked total becomes unknown (NULL).
+    """
+    entries = [
+        (values, sign)
+        for change in changes
+        for values, sign in zip(change, (-1, 1))
+        if values is not None
+    ]
+    if not entries:
+        return
+    currencies = dict(connection.execute(
+        select(Account.id, Account.currency)
+        .where(Account.id.in_({values['account_id'] for values, _ in entries}))
+    ).all())
+    converter = Converter(connection)
+    booked = {}
+    for values, sign in entries:
+        key = (values['account_id'], month_key(values['date']), values['currency'])
+        delta = None
+        if values['amount'] is not None and values['account_id'] in currencies:
+            delta = converter.minor(round(values['amount'] * 100), values['currency'],
+                                    currencies[values['account_id']])
+        total = booked.get(key, 0)
+        booked[key] = None if delta is None or total is None else total + sign * delta
+    stmt = dialect_insert(connection, BalanceCheckpoint).values([
+        {'account_id': account_id, 'month': month, 'currency': currency,
+         'total_minor': 0, 'booked_minor': booked[(account_id, month, currency)], 'count': 0, 'dirty': True}
+        for account_id, month, currency in sorted(booked)
+    ])
+    table = BalanceCheckpoint.__table__
+    # NULL plus anything stays NULL, so an unknown booked total stays unknown
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=['account_id', 'month', 'currency'],
+        set_={'dirty': stmt.excluded.dirty,
+              'booked_minor': table.c.booked_minor + stmt.excluded.booked_minor}
+    ))
+
+def rebook_account(connection, account_id, old_currency, new_currency):
+    """Convert an account's booked totals when its currency changes
+
+    Converted at today's rate, as the balance is.
+    """
+    converter = Converter(connection)
+    for model in (BalanceCheckpoint, OpeningBalance):
+        table = model.__table__
+        rows = connection.execute(
+            select(table.c.id, table.c.booked_minor)
+            .where(table.c.account_id == account_id, table.c.booked_minor.isnot(None))
+        ).all()
+        if rows:
+            connection.execute(
+                table.update().where(table.c.id == bindparam('row_id')).values(booked_minor=bindparam('value')),
+                [{'row_id': row_id, 'value': converter.minor(booked_minor, old_currency, new_currency)}
+                 for row_id, booked_minor in rows]
+            )
+
+# Transaction fields the derived ledger tables (checkpoints, budgets) depend on
+LEDGER_FIELDS = ('user_id', 'account_id', 'category_id', 'date', 'amount', 'currency')
+
+def _committed_values(transaction):
+    """Ledger fields as they are in the database, before pending edits"""
+    state = inspect(transaction)
+    values = {}
+    for name in LEDGER_FIELDS:
+        history = state.attrs[name].load_history()
+        if history.deleted:
+            values[name] = history.deleted[0]
+        elif history.unchanged:
+            values[name] = history.unchanged[0]
         else:
-            amount_item.setForeground(Qt.GlobalColor.darkGreen)
-            
-    except Exception as e:
-        QMessageBox.critical(self, "Error", f"Failed to add transaction to table: {str(e)}")
+            values[name] = getattr(transaction, name)
+    return values
+
+def _current_values(transaction):
+    return {name: getattr(transaction, name) for name in LEDGER_FIELDS}
+
+def apply_ledger_changes(connection, changes):
+    """Update derived ledger tables for (old, new) transaction value pairs
+
+    old is None for inserts and new is None for deletes. Bulk writes that
+    bypass the ORM call this directly.
+    """
+    mark_checkpoints_dirty(connection, changes)
+    apply_budget_spend(connection, changes)
+
+def add_to_balances(session, rows):
+    """Add bulk-inserted transaction rows to their accounts' balances
+
+    Each amount is converted to the account's currency at today's rate, as
+    for a transaction entered in the UI, and every account is updated with
+    a single UPDATE. Raises ValueError for a currency without a rate.
+    """
+    currencies = dict(session.execute(
+        select(Account.id, Account.currency).where(Account.id.in_({row['account_id'] for row in rows}))
+    ).all())
+    converter = Converter(session)
+    deltas = defaultdict(float)
+    for row in rows:
+        deltas[row['account_id']] += converter.convert(row['amount'], row['currency'],
+                                                       currencies[row['account_id']])
+    if not deltas:
+        return
+    session.execute(
+        update(Account.__table__)
+        .where(Account.id.in_(deltas))
+        .values(balance=Account.balance + case(
+            *[(Account.id == account_id, round(delta, 2)) for account_id, delta in deltas.items()]
+        ))
+    )
+    # Balances were changed behind the ORM's back
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Account) and obj.id in deltas:
+            session.expire(obj, ['balance'])
+
+@event.listens_for(OrmSession, 'before_flush')
+def _collect_ledger_changes(session, flush_context, instances):
+    # Committed values of edited and deleted rows must be read before the flush
+    session.info['ledger_old_values'] = {
+        obj: _committed_values(obj)
+        for obj in list(session.dirty) + list(session.deleted)
+        if isinstance(obj, Transaction) and (obj in session.deleted or session.is_modified(obj))
+    }
+    session.info['ledger_currency_changes'] = {}
+    for obj in session.dirty:
+        if isinstance(obj, Account):
+            history = inspect(obj).attrs.currency.history
+            if history.deleted and history.added and history.deleted[0] != history.added[0]:
+                session.info['ledger_currency_changes'][obj.id] = (history.deleted[0], history.added[0])
+
+@event.listens_for(OrmSession, 'after_flush')
+def _apply_ledger_changes(session, flush_context):
+    old_values = session.info.pop('ledger_old_values', {})
+    # Derived rows of accounts deleted in this flush go with them
+    deleted_accounts = {obj.id for obj in session.deleted if isinstance(obj, Account)}
+    changes = [(None, _current_values(obj)) for obj in session.new if isinstance(obj, Transaction)]
+    for obj, old in old_values.items():
+        changes.append((old, None if obj in session.deleted else _current_values(obj)))
+    changes = [
+        (old, new) for old, new in changes
+        if (old or new)['account_id'] not in deleted_accounts
+    ]
+    # Before booking this flush's changes, which are already in the new currency
+    for account_id, (old_currency, new_currency) in session.info.pop('ledger_currency_changes', {}).items():
+        rebook_account(session.connection(), account_id, old_currency, new_currency)
+    if changes:
+        apply_ledger_changes(session.connection(), changes)
+
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+def normalize_description(text):
+    """Lowercase words only, so "POS  Coffee-Bean #12" == "pos coffee bean 12" """
+    return " ".join(_NON_WORD.sub(" ", (text or "").lower()).split())
+
+# Transaction fields that make up its fingerprint
+FINGERPRINT_FIELDS = ('account_id', 'date', 'amount', 'currency', 'description')
+# Fingerprints looked up per IN query
+FINGERPRINT_LOOKUP_SIZE = 500
+
+def _fingerprint_key(values):
+    return (f"{values['account_id']}|{values['date']:%Y-%m-%d}|{int(round(values['amount'] * 100))}|"
+            f"{values['currency']}|{normalize_description(values.get('description'))}")
+
+def _hash_fingerprint(key, occurrence):
+    if occurrence > 1:
+        key = f"{key}|{occurrence}"
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+def transaction_fingerprint(values, occurrence=1):
+    """Hash of a transaction's account, day, amount, currency and description
+
+    The nth identical transaction gets occurrence n, so deliberate repeats
+    (two coffees on the same day) have distinct fingerprints while the same
+    statement imported twice collides.
+    """
+    return _hash_fingerprint(_fingerprint_key(values), occurrence)
+
+def _fingerprint_owner(connection, fingerprint, exclude_id=None):
+    """Id of the stored or archived transaction with a fingerprint, or None
+
+    exclude_id skips a stored transaction, such as the one being edited.
+    """
+    query = select(Transaction.id).where(Transaction.fingerprint == fingerprint)
+    if exclude_id is not None:
+        query = query.where(Transaction.id != exclude_id)
+    row_id = connection.execute(query).scalar()
+    if row_id is None:
+        row_id = connection.execute(
+            select(ArchivedFingerprint.transaction_id).where(ArchivedFingerprint.fingerprint == fingerprint)
+        ).scalar()
+    return row_id
+
+def _existing_fingerprints(connection, fingerprints):
+    """The given fingerprints already taken, by stored or archived transactions"""
+    fingerprints = list(fingerprints)
+    existing = set()
+    for start in range(0, len(fingerprints), FINGERPRINT_LOOKUP_SIZE):
+        chunk = fingerprints[start:start + FINGERPRINT_LOOKUP_SIZE]
+        for model in (Transaction, ArchivedFingerprint):
+            existing.update(fingerprint for fingerprint, in connection.execute(
+                select(model.fingerprint).where(model.fingerprint.in_(chunk))
+            ))
+    return existing
+
+def find_duplicate(connection, values, exclude_id=None):
+    """Id of an existing transaction identical to values, or None
+
+    Archived transactions count too; their id is the one in the archive.
+    """
+    return _fingerprint_owner(connection, transaction_fingerprint(values), exclude_id)
+
+def next_fingerprint(connection, values, exclude_id=None):
+    """Fingerprint for values numbered past the identical transactions already stored"""
+    key = _fingerprint_key(values)
+    occurrence = 1
+    while True:
+        fingerprint = _hash_fingerprint(key, occurrence)
+        if _fingerprint_owner(connection, fingerprint, exclude_id) is None:
+            return fingerprint
+        occurrence += 1
+
+def assign_fingerprints(connection, rows, skip_duplicates=False, counts=None):
+    """Set the fingerprint of each row dict for a bulk insert
+
+    Identical rows within the batch are numbered in order; pass the same
+    counts dict to number them across several batches of one import. With
+    skip_duplicates, rows whose fingerprint is already stored are dropped,
+    so importing the same file twice adds nothing; otherwise they are
+    numbered past the stored ones. Costs one indexed IN query per
+    FINGERPRINT_LOOKUP_SIZE rows. Returns (rows to insert, duplicates).
+    """
+    if counts is None:
+        counts = defaultdict(int)
+    keys = []
+    for row in rows:
+        key = _fingerprint_key(row)
+        counts[key] += 1
+        row['fingerprint'] = _hash_fingerprint(key, counts[key])
+        keys.append(key)
+    existing = _existing_fingerprints(connection, [row['fingerprint'] for row in rows])
+    if not existing:
+        return rows, []
+    if skip_duplicates:
+        return ([row for row in rows if row['fingerprint'] not in existing],
+                [row for row in rows if row['fingerprint'] in existing])
+    for row, key in zip(rows, keys):
+        if row['fingerprint'] not in existing:
+            continue
+        occurrence = counts[key]
+        while True:
+            occurrence += 1
+            fingerprint = _hash_fingerprint(key, occurrence)
+            if fingerprint not in existing and not _existing_fingerprints(connection, [fingerprint]):
+                break
+        counts[key] = occurrence
+        existing.add(fingerprint)
+        row['fingerprint'] = fingerprint
+    return rows, []
+
+@event.listens_for(OrmSession, 'before_flush')
+def _fingerprint_transactions(session, flush_context, instances):
+    # Transactions added or edited through the ORM get their fingerprint here,
+    # unless one was set explicitly. A restored (undeleted) transaction gets
+    # the next free occurrence too, since its old one may have been taken
+    new = [obj for obj in session.new if isinstance(obj, Transaction) and obj.fingerprint is None]
+    if new:
+        rows, _ = assign_fingerprints(session.connection(),
+                                      [{name: getattr(obj, name) for name in FINGERPRINT_FIELDS} for obj in new])
+        for obj, row in zip(new, rows):
+            obj.fingerprint = row['fingerprint']
+    for obj in session.dirty:
+        if not isinstance(obj, Transaction) or obj in session.deleted:
+            continue
+        state = inspect(obj)
+        if state.attrs.fingerprint.history.has_changes():
+            continue
+        if any(state.attrs[name].history.has_changes() for name in FINGERPRINT_FIELDS):
+            obj.fingerprint = next_fingerprint(session.connection(),
+                                               {name: getattr(obj, name) for name in FINGERPRINT_FIELDS},
+                                               exclude_id=obj.id)
+
+def add_fingerprint_column(engine):
+    """Add and fill transactions.fingerprint on databases created before it
+
+    Existing identical transactions are numbered in id order, as if they
+    had been entered one by one.
+    """
+    columns = {column['name'] for column in inspect(engine).get_columns('transactions')}
+    if 'fingerprint' in columns:
+        return
+    table = Transaction.__table__
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ALTER TABLE transactions ADD COLUMN fingerprint VARCHAR(32)")
+        counts = defaultdict(int)
+        updates = []
+        rows = connection.execute(
+            select(table.c.id, *[table.c[name] for name in FINGERPRINT_FIELDS]).order_by(table.c.id)
+        ).mappings()
+        for row in rows.all():
+            key = _fingerprint_key(row)
+            counts[key] += 1
+            updates.append({'row_id': row['id'], 'value': _hash_fingerprint(key, counts[key])})
+        if updates:
+            connection.execute(
+                table.update().where(table.c.id == bindparam('row_id')).values(fingerprint=bindparam('value')),
+                updates
+            )
+
+def add_budget_spend_currency(engine):
+    """Recount budget_spend per currency on databases created before it
+
+    The old counters were converted to the budget's currency at each write,
+    so they can't be split by currency; they are rebuilt from the expenses.
+    """
+    columns = {column['name'] for column in inspect(engine).get_columns('budget_spend')}
+    if 'currency' in columns:
+        return
+    table = BudgetSpend.__table__
+    with engine.begin() as connection:
+        table.drop(connection)
+        table.create(connection)
+        rows = []
+        for budget in connection.execute(select(Budget.__table__)).all():
+            first = budget_period_start(budget.created_at, budget.period)
+            totals = defaultdict(int)
+            for date, currency, amount in connection.execute(
+                    select(Transaction.date, Transaction.currency, Transaction.amount)
+                    .where(Transaction.user_id == budget.user_id, Transaction.category_id == budget.category_id,
+                           Transaction.amount < 0,
+                           Transaction.date >= datetime.combine(first, datetime.min.time()))):
+                totals[(budget_period_start(date, budget.period), currency)] += round(-amount * 100)
+            rows.extend({'budget_id': budget.id, 'period_start': period_start, 'currency': currency,
+                         'spent_minor': total}
+                        for (period_start, currency), total in totals.items() if total)
+        if rows:
+            connection.execute(table.insert(), rows)
+
+def add_booked_columns(engine):
+    """Add booked_minor to checkpoints and opening balances made before it
+
+    It starts out NULL: those totals are valued at today's rates until
+    their checkpoints are rebuilt.
+    """
+    with engine.begin() as connection:
+        for table in (BalanceCheckpoint.__table__, OpeningBalance.__table__):
+            columns = {column['name'] for column in inspect(connection).get_columns(table.name)}
+            if 'booked_minor' not in columns:
+                connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN booked_minor INTEGER")
+
+def upsert_exchange_rate(session, from_currency, to_currency, rate):
+    """Add or update the rate for a currency pair in a single statement"""
+    upsert(
+        session,
+        ExchangeRate,
+        {
+            'from_currency': from_currency,
+            'to_currency': to_currency,
+            'rate': rate,
+            'updated_at': datetime.utcnow(),
+        },
+        index_elements=['from_currency', 'to_currency'],
+        update_columns=['rate', 'updated_at']
+    )
@@ -0,0 +1,170 @@
+"""Read-through cache for small keyed queries.
+
+Each entry remembers the version of every table it was read from. Any
+INSERT, UPDATE or DELETE that SQLAlchemy executes bumps the version of its
+table, whether it comes from an ORM flush or a Core bulk statement, and
+commits and rollbacks bump the tables written in that transaction again so
+values read mid-transaction by other sessions can't outlive it. A lookup
+whose versions moved is a miss and reloads.
+
+Those counters only see this process's writes. On SQLite every entry also
+remembers PRAGMA data_version, read from a dedicated connection, which
+changes whenever any other connection commits, as in analytics.py. Other
+databases have no such counter, so their entries expire after DEFAULT_TTL
+seconds instead.
+
+Values are plain data (ids, tuples), never ORM instances, so they can be
+shared between sessions and threads.
+
+    category_id = cached_category_id(session, "Food")
+    print(query_cache.stats())
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+from sqlalchemy import event, select
+from models import ENGINE, Account, Category, ExchangeRate, User
+
+DEFAULT_MAXSIZE = 1024
+# Seconds an entry lives where commits by other processes can't be seen
+DEFAULT_TTL = 30.0
+
+RateRow = namedtuple('RateRow', ['from_currency', 'to_currency', 'rate', 'updated_at'])
+
+class QueryCache:
+    """LRU of query results, invalidated by per-table version counters
+
+    data_version, if given, is called on every lookup and its value is
+    part of each entry's versions; ttl, if given, expires entries that
+    many seconds after they were loaded.
+    """
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=None, data_version=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data_version = data_version
+        self._entries = OrderedDict()  # key -> (versions, value, load time)
+        self._versions = defaultdict(int)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def version(self, table):
+        return self._versions[table]
+
+    def bump(self, tables):
+        """Invalidate every entry read from any of these tables"""
+        with self._lock:
+            for table in tables:
+                self._versions[table] += 1
+
+    def get(self, key, tables, loader):
+        """Return the cached value for key, calling loader() on a miss"""
+        with self._lock:
+            versions = tuple(self._versions[table] for table in tables)
+            if self.data_version is not None:
+                versions += (self.data_version(),)
+            loaded_at = time.monotonic()
+            entry = self._entries.get(key)
+            if (entry is not None and entry[0] == versions
+                    and (self.ttl is None or loaded_at - entry[2] < self.ttl)):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # Loaded outside the lock; versions from before the load make a
+        # concurrent write invalidate the entry rather than be missed
+        value = loader()
+        with self._lock:
+            self._entries[key] = (versions, value, loaded_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        """Drop all entries and reset the statistics"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'evictions': self.evictions,
+        }
+
+def _sqlite_data_version(path):
+    connection = None
+    def data_version():
+        nonlocal connection
+        # Opened on first use, so importing doesn't create the database file.
+        # Never writes, so its data_version moves on every commit by anyone
+        if connection is None:
+            connection = sqlite3.connect(path, check_same_thread=False)
+        return connection.execute('PRAGMA data_version').fetchone()[0]
+    return data_version
+
+def install(engine, cache):
+    """Bump table versions from every write executed on engine
+
+    Also sets how the cache notices commits by other processes: PRAGMA
+    data_version on an SQLite file, otherwise a TTL.
+    """
+    database = engine.url.database
+    if engine.url.get_backend_name() == 'sqlite' and database and database != ':memory:':
+        cache.data_version = _sqlite_data_version(database)
+    elif engine.url.get_backend_name() != 'sqlite':
+        cache.ttl = DEFAULT_TTL
+
+    @event.listens_for(engine, 'after_execute')
+    def _after_execute(conn, clauseelement, multiparams, params, execution_options, result):
+        if getattr(clauseelement, 'is_dml', False):
+            table = clauseelement.table.name
+            cache.bump([table])
+            conn.info.setdefault('query_cache_tables', set()).add(table)
+
+    def _end_transaction(conn):
+        tables = conn.info.pop('query_cache_tables', None)
+        if tables:
+            cache.bump(tables)
+
+    event.listen(engine, 'commit', _end_transaction)
+    event.listen(engine, 'rollback', _end_transaction)
+
+query_cache = QueryCache()
+install(ENGINE, query_cache)
+
+def cached_category_id(session, name):
+    """Id of the category with this name, or None"""
+    return query_cache.get(
+        ('category_id', name), ('categories',),
+        lambda: session.execute(select(Category.id).filter_by(name=name).limit(1)).scalar()
+    )
+
+def cached_exchange_rates(session):
+    """All exchange rates as RateRow tuples"""
+    return query_cache.get(
+        ('exchange_rates',), ('exchange_rates',),
+        lambda: [RateRow._make(row) for row in session.execute(select(
+            ExchangeRate.from_currency, ExchangeRate.to_currency,
+            ExchangeRate.rate, ExchangeRate.updated_at
+        ))]
+    )
+
+def cached_account_id(session, username):
+    """Id of the user's first account, or None"""
+    return query_cache.get(
+        ('account_id', username), ('users', 'accounts'),
+        lambda: session.execute(
+            select(Account.id).join(User, User.id == Account.user_id)
+            .filter(User.username == username).order_by(Account.id).limit(1)
+        ).scalar()
+    )
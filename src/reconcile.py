@@ -0,0 +1,187 @@
+"""Balance reconciliation against per-month checkpoints.
+
+Account.balance is maintained incrementally by the UI. The reconciler keeps
+a sum and count of transactions per account, month and currency in
+balance_checkpoints. Writes through the ORM flag the checkpoints they touch
+as dirty (see models.mark_checkpoints_dirty), so verifying a large ledger
+only re-sums the months that changed since the last run. They also book
+each change in the account's currency at that day's rate, like the balance,
+so a later rate change isn't reported as drift.
+
+    python reconcile.py               # verify every account
+    python reconcile.py --repair      # also fix drifted balances
+"""
+import argparse
+from collections import defaultdict, namedtuple
+from datetime import datetime
+from sqlalchemy import func, extract
+from models import (Account, Transaction, BalanceCheckpoint, OpeningBalance, session_scope,
+                    init_db, Converter)
+
+# Drift below this is rounding from converting each transaction separately
+DEFAULT_TOLERANCE = 0.01
+
+ReconcileResult = namedtuple('ReconcileResult', [
+    'account_id', 'stored_balance', 'expected_balance', 'drift',
+    'months', 'months_resummed'
+])
+
+def month_range(month):
+    """Start and end datetimes of a YYYY-MM month"""
+    year, month_number = (int(part) for part in month.split('-'))
+    start = datetime(year, month_number, 1)
+    if month_number == 12:
+        end = datetime(year + 1, 1, 1)
+    else:
+        end = datetime(year, month_number + 1, 1)
+    return start, end
+
+def _minor_units_sum():
+    """SQL expression summing amounts as whole cents"""
+    return func.coalesce(func.sum(func.round(Transaction.amount * 100)), 0)
+
+class Reconciler:
+    def __init__(self, session, tolerance=DEFAULT_TOLERANCE):
+        self.session = session
+        self.tolerance = tolerance
+
+    def refresh_checkpoints(self, account_id):
+        """Bring an account's checkpoints up to date, returning how many were re-summed"""
+        has_baseline = self.session.query(BalanceCheckpoint.id)\
+            .filter(BalanceCheckpoint.account_id == account_id,
+                    BalanceCheckpoint.verified_at.isnot(None))\
+            .first() is not None
+        if not has_baseline:
+            return self._rebuild_checkpoints(account_id)
+
+        # Flags are set with Core statements, so reload any rows already in the session
+        dirty = self.session.query(BalanceCheckpoint)\
+            .filter_by(account_id=account_id, dirty=True)\
+            .populate_existing()\
+            .all()
+        now = datetime.now()
+        for checkpoint in dirty:
+            start, end = month_range(checkpoint.month)
+            total, count = self.session.query(_minor_units_sum(), func.count(Transaction.id))\
+                .filter(Transaction.account_id == account_id,
+                        Transaction.currency == checkpoint.currency,
+                        Transaction.date >= start,
+                        Transaction.date < end)\
+                .one()
+            checkpoint.total_minor = int(total)
+            checkpoint.count = count
+            checkpoint.dirty = False
+            checkpoint.verified_at = now
+        return len(dirty)
+
+    def _rebuild_checkpoints(self, account_id):
+        """Compute every checkpoint of an account with one grouped scan"""
+        year = extract('year', Transaction.date)
+        month = extract('month', Transaction.date)
+        rows = self.session.query(year, month, Transaction.currency,
+                                  _minor_units_sum(), func.count(Transaction.id))\
+            .filter(Transaction.account_id == account_id)\
+            .group_by(year, month, Transaction.currency)\
+            .all()
+
+        self.session.query(BalanceCheckpoint)\
+            .filter_by(account_id=account_id)\
+            .delete(synchronize_session=False)
+        # Nothing records the rates of the past, so history is booked at today's
+        account_currency = self.session.get(Account, account_id).currency
+        converter = Converter(self.session)
+        now = datetime.now()
+        self.session.add_all([
+            BalanceCheckpoint(
+                account_id=account_id,
+                month=f"{int(row_year):04d}-{int(row_month):02d}",
+                currency=currency,
+                total_minor=int(total),
+                booked_minor=converter.minor(int(total), currency, account_currency),
+                count=count,
+                dirty=False,
+                verified_at=now
+            )
+            for row_year, row_month, currency, total, count in rows
+        ])
+        self.session.flush()
+        return len(rows)
+
+    def expected_balance(self, account):
+        """Balance implied by the checkpoints and any archived opening balance
+
+        Sums are taken as booked, in the account's currency at the rates
+        when they were written; only sums whose booked value is unknown are
+        valued at the current exchange rate.
+        """
+        booked = 0
+        unbooked = defaultdict(int)
+        for model in (BalanceCheckpoint, OpeningBalance):
+            for currency, booked_minor, total_minor in self.session.query(
+                        model.currency, model.booked_minor, model.total_minor)\
+                    .filter_by(account_id=account.id):
+                if booked_minor is None:
+                    unbooked[currency] += total_minor
+                else:
+                    booked += booked_minor
+        converter = Converter(self.session)
+        balance = booked / 100.0
+        for currency, total_minor in unbooked.items():
+            balance += converter.convert(total_minor / 100.0, currency, account.currency)
+        return round(balance, 2)
+
+    def verify_account(self, account):
+        """Refresh checkpoints and compare them with the stored balance"""
+        resummed = self.refresh_checkpoints(account.id)
+        months = self.session.query(func.count(func.distinct(BalanceCheckpoint.month)))\
+            .filter_by(account_id=account.id)\
+            .scalar()
+        expected = self.expected_balance(account)
+        stored = round(float(account.balance or 0.0), 2)
+        return ReconcileResult(account.id, stored, expected, round(stored - expected, 2),
+                               months, resummed)
+
+    def verify(self, account_id=None):
+        """Verify one account, or all of them"""
+        query = self.session.query(Account).order_by(Account.id)
+        if account_id is not None:
+            query = query.filter_by(id=account_id)
+        return [self.verify_account(account) for account in query.all()]
+
+    def is_drifted(self, result):
+        return abs(result.drift) > self.tolerance
+
+    def repair(self, account_id=None):
+        """Reset drifted balances to the checkpoint totals, returning the repaired results"""
+        repaired = []
+        for result in self.verify(account_id):
+            if self.is_drifted(result):
+                account = self.session.get(Account, result.account_id)
+                account.balance = result.expected_balance
+                repaired.append(result)
+        return repaired
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify account balances against transactions")
+    parser.add_argument('--account', type=int, help="Only check this account id")
+    parser.add_argument('--repair', action='store_true', help="Fix drifted balances")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    init_db()
+    with session_scope() as session:
+        reconciler = Reconciler(session, args.tolerance)
+        results = reconciler.verify(args.account)
+        drifted = [result for result in results if reconciler.is_drifted(result)]
+        for result in results:
+            status = "DRIFT" if reconciler.is_drifted(result) else "OK"
+            print(f"Account {result.account_id}: stored {result.stored_balance:,.2f}, "
+                  f"expected {result.expected_balance:,.2f}, drift {result.drift:,.2f} "
+                  f"({result.months_resummed}/{result.months} months re-summed) {status}")
+        if args.repair and drifted:
+            reconciler.repair(args.account)
+            print(f"Repaired {len(drifted)} account(s)")
+    return 1 if drifted and not args.repair else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
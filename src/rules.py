@@ -0,0 +1,338 @@
+"""User-defined categorization rules, compiled into one matcher.
+
+A rule assigns a category to descriptions that contain a substring
+("GRAB" -> Transport) or match a regular expression. Instead of trying
+each rule in turn, a RuleSet compiles all of a user's rules once:
+
+- substring rules into an Aho-Corasick automaton, so a description is
+  scanned once, one step per character, however many rules there are
+- regex rules behind the same kind of automaton, over the literal text
+  each regex requires, so only the few rules that could match are run;
+  regexes without such text are joined into a single alternation
+
+Rules are grouped by the type of their category, so an income row is only
+matched against income categories. When several rules match, the one
+with the highest priority wins, then the oldest. Matching ignores case.
+
+    rule_set = load_rules(session, user_id)
+    category_id = rule_set.match("GRAB *TRIP 1234", TransactionType.EXPENSE)
+    python rules.py --user alice --add GRAB Transport
+"""
+import argparse
+import re
+from collections import deque, namedtuple
+from sqlalchemy import select
+from models import CategoryRule, Category, RuleKind, TransactionType
+
+RuleRow = namedtuple('RuleRow', ['id', 'kind', 'pattern', 'priority', 'category_id', 'category', 'type'])
+
+class SubstringMatcher:
+    """Aho-Corasick automaton over case-folded patterns
+
+    Every node keeps the entries ending there or at any of its suffixes, and
+    the best-ranked of them, so a scan never walks the output links and
+    stays linear in the length of the text.
+    """
+    def __init__(self, entries):
+        """entries are (pattern, rank, value); the lowest rank wins"""
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [()]
+        for pattern, rank, value in entries:
+            node = 0
+            for char in pattern.casefold():
+                child = self.goto[node].get(char)
+                if child is None:
+                    child = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append(())
+                    self.goto[node][char] = child
+                node = child
+            self.outputs[node] += ((rank, value),)
+
+        # Breadth first, so a node's failure target is finished before it
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                target = self.fail[node]
+                while target and char not in self.goto[target]:
+                    target = self.fail[target]
+                self.fail[child] = self.goto[target].get(char, 0)
+                self.outputs[child] += self.outputs[self.fail[child]]
+                queue.append(child)
+        self.best = [min(outputs) if outputs else None for outputs in self.outputs]
+
+    def _nodes(self, text):
+        goto, fail = self.goto, self.fail
+        node = 0
+        for char in text.casefold():
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            yield node
+
+    def search(self, text):
+        """(rank, value) of the best pattern occurring in text, or None"""
+        best = self.best
+        found = None
+        for node in self._nodes(text):
+            candidate = best[node]
+            if candidate is not None and (found is None or candidate[0] < found[0]):
+                found = candidate
+        return found
+
+    def search_all(self, text):
+        """Every (rank, value) whose pattern occurs in text"""
+        outputs = self.outputs
+        found = set()
+        for node in self._nodes(text):
+            if outputs[node]:
+                found.update(outputs[node])
+        return found
+
+_QUANTIFIERS = '*?{'
+# {m}, {m,}, {m,n} or {,n}; any other brace is literal
+_REPEAT = re.compile(r'\{(?:\d+(?:,\d*)?|,\d+)\}')
+_BREAKS = '.^$+'
+
+def required_literal(pattern):
+    """Longest plain text every match of pattern must contain, or None
+
+    Only looks outside groups and character classes, and gives up on a
+    top-level alternation; good enough to prefilter typical rules like
+    "^sp\\s+group" (-> "group") and never wrong.
+    """
+    runs = []
+    run = ""
+    depth = 0
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == '\\' and index + 1 < len(pattern):
+            escaped = pattern[index + 1]
+            index += 2
+            if depth:
+                continue
+            if escaped.isalnum():  # \d, \b, \1 ... are not literal text
+                runs.append(run)
+                run = ""
+            else:
+                run += escaped
+            continue
+        if char == '[':
+            # Skip the class, whose first character may be a literal ]
+            index += 1
+            if index < len(pattern) and pattern[index] == '^':
+                index += 1
+            if index < len(pattern) and pattern[index] == ']':
+                index += 1
+            while index < len(pattern) and pattern[index] != ']':
+                index += 2 if pattern[index] == '\\' else 1
+            index += 1
+            if not depth:
+                runs.append(run)
+                run = ""
+            continue
+        index += 1
+        if char == '(':
+            depth += 1
+            runs.append(run)
+            run = ""
+        elif char == ')':
+            depth = max(depth - 1, 0)
+        elif depth:
+            continue
+        elif char == '|':
+            return None
+        elif char == '{' and not _REPEAT.match(pattern, index - 1):
+            run += char
+        elif char in _QUANTIFIERS:
+            if char == '{':
+                index = _REPEAT.match(pattern, index - 1).end()
+            runs.append(run[:-1])  # The quantified character is optional
+            run = ""
+        elif char in _BREAKS:
+            runs.append(run)
+            run = ""
+        else:
+            run += char
+    runs.append(run)
+    longest = max(runs, key=len)
+    return longest or None
+
+class RegexMatcher:
+    """Regex rules behind a literal prefilter
+
+    A rule whose matches must contain some literal text is only run on
+    descriptions the Aho-Corasick scan finds that text in; the remaining
+    rules are joined into one case-insensitive alternation, each wrapped in
+    a lookahead so that one scan sees every position's matches, including
+    ones that overlap.
+    """
+    def __init__(self, entries):
+        anchored = []
+        combined = []
+        self.groups = {}
+        for index, (pattern, rank, value) in enumerate(sorted(entries, key=lambda entry: entry[1])):
+            compiled = re.compile(pattern, re.IGNORECASE)
+            # Whitespace in a verbose pattern isn't literal
+            literal = None if compiled.flags & re.VERBOSE else required_literal(pattern)
+            if literal is None:
+                name = f"rule{index}"
+                self.groups[name] = (rank, value)
+                combined.append(f"(?=(?P<{name}>{pattern}))")
+            else:
+                anchored.append((literal, rank, (value, compiled)))
+        self.prefilter = SubstringMatcher(anchored)
+        self.pattern = re.compile("|".join(combined), re.IGNORECASE) if combined else None
+        self.best = min(self.groups.values(), default=None)
+
+    def search(self, text):
+        """(rank, value) of the best rule matching text, or None
+
+        The lookaheads consume nothing, so finditer tries every position,
+        and at each one the alternation takes the best-ranked rule, as the
+        alternatives are in rank order.
+        """
+        found = None
+        if self.pattern is not None:
+            for match in self.pattern.finditer(text):
+                candidate = self.groups[match.lastgroup]
+                if found is None or candidate[0] < found[0]:
+                    found = candidate
+                    if found == self.best:
+                        break
+        for rank, (value, compiled) in sorted(self.prefilter.search_all(text), key=lambda entry: entry[0]):
+            if found is not None and found[0] < rank:
+                break
+            if compiled.search(text):
+                return rank, value
+        return found
+
+class RuleSet:
+    """A user's rules compiled into a matcher per transaction type"""
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.matchers = {}
+        for transaction_type in (None, *TransactionType):
+            entries = {RuleKind.CONTAINS: [], RuleKind.REGEX: []}
+            for rule in self.rules:
+                if transaction_type is None or rule.type == transaction_type:
+                    # Highest priority first, then the oldest rule
+                    entries[rule.kind].append((rule.pattern, (-rule.priority, rule.id), rule.category_id))
+            self.matchers[transaction_type] = (SubstringMatcher(entries[RuleKind.CONTAINS]),
+                                               RegexMatcher(entries[RuleKind.REGEX]))
+
+    def __len__(self):
+        return len(self.rules)
+
+    def match(self, description, transaction_type=None):
+        """Category id of the best rule matching description, or None"""
+        if not description or not self.rules:
+            return None
+        found = None
+        for matcher in self.matchers[transaction_type]:
+            candidate = matcher.search(description)
+            if candidate is not None and (found is None or candidate[0] < found[0]):
+                found = candidate
+        return found[1] if found else None
+
+    def match_many(self, rows):
+        """match() for each (description, transaction type) pair"""
+        return [self.match(description, transaction_type) for description, transaction_type in rows]
+
+def list_rules(session, user_id):
+    """A user's rules as RuleRow tuples, highest priority first"""
+    return [RuleRow(*row) for row in session.execute(
+        select(CategoryRule.id, CategoryRule.kind, CategoryRule.pattern, CategoryRule.priority,
+               CategoryRule.category_id, Category.name, Category.type)
+        .join(Category, Category.id == CategoryRule.category_id)
+        .where(CategoryRule.user_id == user_id)
+        .order_by(CategoryRule.priority.desc(), CategoryRule.id)
+    )]
+
+def load_rules(session, user_id):
+    """Compile a user's rules; one query, then no database access to match"""
+    return RuleSet(list_rules(session, user_id))
+
+def validate_pattern(pattern, kind):
+    pattern = (pattern or "").strip()
+    if not pattern:
+        raise ValueError("Rule pattern cannot be empty")
+    if kind == RuleKind.REGEX:
+        try:
+            # Compiled as it will be inside the alternation
+            compiled = re.compile(f"(?:{pattern})")
+        except re.error as e:
+            raise ValueError(f"Invalid regular expression {pattern!r}: {str(e)}")
+        # Groups would renumber once the patterns are joined together
+        if compiled.groups:
+            raise ValueError("Use (?:...) instead of capturing groups in rule patterns")
+    return pattern
+
+def add_rule(session, user_id, pattern, category_id, kind=RuleKind.CONTAINS, priority=0):
+    """Save a rule, replacing the category and priority of an identical pattern"""
+    kind = RuleKind(kind)
+    pattern = validate_pattern(pattern, kind)
+    if session.get(Category, category_id) is None:
+        raise ValueError(f"Category {category_id} not found")
+    rule = session.query(CategoryRule).filter_by(user_id=user_id, kind=kind, pattern=pattern).first()
+    if rule is None:
+        rule = CategoryRule(user_id=user_id, kind=kind, pattern=pattern)
+        session.add(rule)
+    rule.category_id = category_id
+    rule.priority = int(priority)
+    session.flush()
+    return rule
+
+def delete_rule(session, user_id, rule_id):
+    rule = session.query(CategoryRule).filter_by(user_id=user_id, id=rule_id).first()
+    if rule is None:
+        raise ValueError(f"Rule {rule_id} not found")
+    session.delete(rule)
+
+def main(argv=None):
+    from models import User, session_scope, init_db
+    parser = argparse.ArgumentParser(description="Manage and test categorization rules")
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--add', nargs=2, metavar=('PATTERN', 'CATEGORY'))
+    parser.add_argument('--regex', action='store_true', help="PATTERN is a regular expression")
+    parser.add_argument('--priority', type=int, default=0, help="Higher wins when several rules match")
+    parser.add_argument('--delete', type=int, metavar='ID')
+    parser.add_argument('descriptions', nargs='*', help="Descriptions to categorize")
+    args = parser.parse_args(argv)
+
+    init_db()
+    try:
+        with session_scope() as session:
+            user = session.query(User).filter_by(username=args.user).first()
+            if user is None:
+                raise ValueError(f"User {args.user} not found")
+            if args.add:
+                pattern, name = args.add
+                category = session.query(Category).filter_by(name=name).first()
+                if category is None:
+                    raise ValueError(f"Category {name} not found")
+                add_rule(session, user.id, pattern, category.id,
+                         RuleKind.REGEX if args.regex else RuleKind.CONTAINS, args.priority)
+            if args.delete is not None:
+                delete_rule(session, user.id, args.delete)
+            session.flush()
+            rules = list_rules(session, user.id)
+            if args.descriptions:
+                rule_set = RuleSet(rules)
+                names = dict(session.query(Category.id, Category.name))
+                for description in args.descriptions:
+                    print(f"{description}\t{names.get(rule_set.match(description), '-')}")
+            else:
+                for rule in rules:
+                    print(f"{rule.id}\t{rule.kind.value.lower()}\t{rule.pattern}\t{rule.category}\t{rule.priority}")
+    except Exception as e:
+        print(f"rules: {str(e)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,215 @@
+"""Recurring transactions on cron-like schedules.
+
+A RecurringTemplate holds a five-field schedule (minute hour day-of-month
+month day-of-week, as in crontab). run_due materializes every occurrence
+since each template's last run with one bulk insert, then applies all
+balance changes with a single UPDATE, so catching up on months of rent and
+salary costs a couple of statements rather than one write per entry.
+
+    python scheduler.py               # materialize everything due now
+"""
+import argparse
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import case, update
+from models import (Account, RecurringTemplate, Transaction, TransactionType, LEDGER_FIELDS,
+                    apply_ledger_changes, assign_fingerprints, convert_amount, session_scope, init_db)
+
+# Stops a too-frequent schedule from flooding the ledger; the rest is picked up next run
+MAX_OCCURRENCES = 10000
+
+# (name, lowest, highest) of each schedule field
+FIELDS = [
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day of month', 1, 31),
+    ('month', 1, 12),
+    ('day of week', 0, 7),
+]
+
+RunResult = namedtuple('RunResult', ['templates', 'inserted', 'accounts'])
+
+def _parse_field(text, name, lowest, highest):
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step < 1:
+                raise ValueError(f"Invalid step in {name} field: {text}")
+        if part == '*':
+            start, end = lowest, highest
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-', 1))
+        else:
+            start = int(part)
+            end = highest if step > 1 else start
+        if start < lowest or end > highest or start > end:
+            raise ValueError(f"{name.capitalize()} out of range: {text}")
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronRule:
+    """A parsed five-field schedule"""
+    def __init__(self, schedule):
+        fields = schedule.split()
+        if len(fields) != 5:
+            raise ValueError(f"Schedule needs 5 fields (minute hour day month weekday): {schedule}")
+        try:
+            parsed = [_parse_field(text, *spec) for text, spec in zip(fields, FIELDS)]
+        except ValueError as e:
+            if str(e).startswith('invalid literal'):
+                raise ValueError(f"Invalid schedule: {schedule}")
+            raise
+        self.schedule = schedule
+        self.minutes = sorted(parsed[0])
+        self.hours = sorted(parsed[1])
+        self.days = parsed[2]
+        self.months = parsed[3]
+        # Cron counts Sunday as 0 or 7; Python's weekday() has Monday as 0
+        self.weekdays = {(day - 1) % 7 for day in parsed[4]}
+        # As in Vixie cron, a day matches either field when both are
+        # restricted, and a field starting with * (even */2) isn't
+        self.any_day = fields[2].startswith('*')
+        self.any_weekday = fields[4].startswith('*')
+
+    def matches_day(self, day):
+        if day.month not in self.months:
+            return False
+        in_days = day.day in self.days
+        in_weekdays = day.weekday() in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def occurrences(self, start, end):
+        """Datetimes matching the schedule with start <= occurrence <= end"""
+        day = start.date()
+        while day <= end.date():
+            if day.month not in self.months:
+                # Skip straight to the first day of the next month
+                day = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+                continue
+            if self.matches_day(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        moment = datetime(day.year, day.month, day.day, hour, minute)
+                        if moment > end:
+                            return
+                        if moment >= start:
+                            yield moment
+            day += timedelta(days=1)
+
+def add_template(session, user_id, account_id, category_id, amount, currency, schedule,
+                 description="", start_date=None, end_date=None):
+    """Create a recurring template; negative amounts are expenses"""
+    CronRule(schedule)
+    template = RecurringTemplate(
+        user_id=user_id,
+        account_id=account_id,
+        category_id=category_id,
+        type=TransactionType.EXPENSE if amount < 0 else TransactionType.INCOME,
+        amount=amount,
+        currency=currency,
+        description=description,
+        schedule=schedule,
+        start_date=start_date or datetime.now(),
+        end_date=end_date,
+    )
+    session.add(template)
+    session.flush()
+    return template
+
+def due_occurrences(template, now, limit=MAX_OCCURRENCES):
+    """Occurrences of a template not yet materialized, up to now"""
+    if template.last_run is not None:
+        start = template.last_run.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    else:
+        start = template.start_date
+    end = min(now, template.end_date) if template.end_date else now
+    occurrences = []
+    for moment in CronRule(template.schedule).occurrences(start, end):
+        occurrences.append(moment)
+        if len(occurrences) >= limit:
+            break
+    return occurrences
+
+def run_due(session, now=None, user_id=None, limit=MAX_OCCURRENCES):
+    """Materialize every due occurrence of active templates in one bulk insert"""
+    now = now or datetime.now()
+    query = session.query(RecurringTemplate).filter_by(active=True)
+    if user_id is not None:
+        query = query.filter_by(user_id=user_id)
+    templates = query.all()
+    if not templates:
+        return RunResult(0, 0, 0)
+
+    currencies = dict(session.query(Account.id, Account.currency)
+                      .filter(Account.id.in_({template.account_id for template in templates})))
+    rows = []
+    deltas = defaultdict(float)
+    ran = 0
+    for template in templates:
+        occurrences = due_occurrences(template, now, limit)
+        if occurrences:
+            ran += 1
+            # Converted once per template, not per occurrence
+            converted = convert_amount(session, template.amount, template.currency,
+                                       currencies[template.account_id])
+            deltas[template.account_id] += converted * len(occurrences)
+            rows.extend(
+                {
+                    'date': moment,
+                    'type': template.type,
+                    'category_id': template.category_id,
+                    'amount': template.amount,
+                    'currency': template.currency,
+                    'description': template.description,
+                    'created_at': now,
+                    'account_id': template.account_id,
+                    'user_id': template.user_id,
+                }
+                for moment in occurrences
+            )
+        # A capped run resumes after the last occurrence it materialized
+        template.last_run = occurrences[-1] if len(occurrences) >= limit else now
+        if template.end_date and template.last_run >= template.end_date:
+            template.active = False
+    if not rows:
+        return RunResult(0, 0, 0)
+
+    connection = session.connection()
+    # Occurrences matching a transaction entered by hand are still added
+    rows, _ = assign_fingerprints(connection, rows)
+    connection.execute(Transaction.__table__.insert(), rows)
+    connection.execute(
+        update(Account.__table__)
+        .where(Account.id.in_(deltas))
+        .values(balance=Account.balance + case(
+            *[(Account.id == account_id, round(delta, 2)) for account_id, delta in deltas.items()]
+        ))
+    )
+    apply_ledger_changes(connection, [(None, {name: row[name] for name in LEDGER_FIELDS})
+                                      for row in rows])
+    # Balances were changed behind the ORM's back
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Account) and obj.id in deltas:
+            session.expire(obj, ['balance'])
+    session.flush()
+    return RunResult(ran, len(rows), len(deltas))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Materialize due recurring transactions")
+    parser.add_argument('--user', type=int, help="Only run this user's templates")
+    args = parser.parse_args(argv)
+
+    init_db()
+    with session_scope() as session:
+        result = run_due(session, user_id=args.user)
+    print(f"Added {result.inserted} transaction(s) from {result.templates} template(s) "
+          f"across {result.accounts} account(s)")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
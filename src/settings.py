@@ -1,8 +1,11 @@
+from models import ENGINE, BudgetPeriod, session_scope
+
 class SettingsScreen:
     def __init__(self):
         self.expense_types = []
         self.income_types = []
         self.budget = 0
+        self.analytics = None
 
     def add_expense_type(self, expense_type):
         self.expense_types.append(expense_type)
@@ -10,13 +13,32 @@ class SettingsScreen:
     def add_income_type(self, income_type):
         self.income_types.append(income_type)
 
-    def set_budget(self, budget):
+    def set_budget(self, budget, user_id=None, category_id=None, currency='SGD',
+                   period=BudgetPeriod.MONTHLY):
+        """Set the overall budget, or persist a budget for one category"""
         self.budget = budget
+        if user_id is None or category_id is None:
+            return None
+        from budgets import set_budget
+        with session_scope() as session:
+            return set_budget(session, user_id, category_id, budget, currency, period).id
 
-    def generate_report(self):
-        # Logic to generate reports based on the data
-        pass
+    def generate_report(self, base_currency='SGD', account_id=None):
+        """Build category-by-month, currency exposure and savings rate reports"""
+        from analytics import AnalyticsEngine
+        # Kept between calls so unchanged data isn't loaded again
+        if self.analytics is None:
+            self.analytics = AnalyticsEngine(ENGINE)
+        return self.analytics.report(base_currency, account_id)
+
+    def generate_statements(self, month, output_dir, fmt='html', per='account', workers=None):
+        """Write every user's statements for a 'YYYY-MM' month, returning JobResults"""
+        from statements import month_range, plan_jobs, generate_statements
+        start, end = month_range(month)
+        with session_scope() as session:
+            jobs = plan_jobs(session, start, end, output_dir, fmt, per)
+        return list(generate_statements(jobs, workers=workers))
 
     def display_settings(self):
         # Logic to display the settings interface
-        pass
\ No newline at end of file
+        pass
@@ -2,7 +2,8 @@ from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                            QLineEdit, QPushButton, QLabel, QMessageBox)
 from PyQt6.QtCore import Qt
 from models import User, Session, Account
-import hashlib
+from auth import auth_service
+from login import FutureBridge
 
 class SignupWindow(QMainWindow):
     def __init__(self, parent=None):
@@ -11,6 +12,10 @@ class SignupWindow(QMainWindow):
         self.setWindowTitle("Finance Tracker - Sign Up")
         self.setFixedSize(400, 400)
         
+        # Password hashing runs on the auth worker thread
+        self.hash_bridge = FutureBridge(self)
+        self.hash_bridge.finished.connect(self.create_user)
+        
         # Main widget and layout
         main_widget = QWidget()
         self.setCentralWidget(main_widget)
@@ -48,10 +53,10 @@ class SignupWindow(QMainWindow):
         # Buttons
         button_layout = QHBoxLayout()
         
-        signup_btn = QPushButton("Sign Up")
-        signup_btn.setStyleSheet("background-color: #4CAF50; color: white; padding: 8px;")
-        signup_btn.clicked.connect(self.handle_signup)
-        button_layout.addWidget(signup_btn)
+        self.signup_btn = QPushButton("Sign Up")
+        self.signup_btn.setStyleSheet("background-color: #4CAF50; color: white; padding: 8px;")
+        self.signup_btn.clicked.connect(self.handle_signup)
+        button_layout.addWidget(self.signup_btn)
         
         cancel_btn = QPushButton("Cancel")
         cancel_btn.setStyleSheet("padding: 8px;")
@@ -84,10 +89,24 @@ class SignupWindow(QMainWindow):
                 QMessageBox.warning(self, "Error", "Email already registered")
                 return
             
-            # Hash the password
-            hashed_password = hashlib.sha256(
-                self.password.text().encode()
-            ).hexdigest()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to create account: {str(e)}")
+            return
+        finally:
+            if session:
+                session.close()
+        
+        # Hash the password off the UI thread, then create the user
+        self.signup_btn.setEnabled(False)
+        self.hash_bridge.watch(auth_service.hash_password(self.password.text()))
+
+    def create_user(self, future):
+        """Create the user and default account once the password is hashed"""
+        self.signup_btn.setEnabled(True)
+        session = None
+        try:
+            hashed_password = future.result()
+            session = Session()
             
             # Create new user
             new_user = User(
@@ -0,0 +1,205 @@
+"""SQL statement timing, call-site counts and N+1 detection.
+
+Hooks before/after_cursor_execute on an engine and records, for every
+statement shape, how often it ran, how long it took and from which line
+of the app. The same shape run many times from one call site within a
+short window is reported as a likely N+1 query. Statements slower than
+the threshold are appended to a slow-query log with their EXPLAIN QUERY
+PLAN (SQLite only).
+
+Off by default; enable with FINANCE_TRACKER_SQL_DEBUG=1 (and optionally
+FINANCE_TRACKER_SLOW_QUERY_MS=20). The numbers show up in the SQL Debug
+panel of the Settings tab.
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from sqlalchemy import event
+import config
+
+DEFAULT_SLOW_QUERY_MS = 50.0
+SLOW_LOG_FILENAME = 'slow_queries.log'
+# Same statement from the same line this many times in the window is an N+1
+N_PLUS_ONE_THRESHOLD = 10
+N_PLUS_ONE_WINDOW = 50
+
+THIS_FILE = os.path.abspath(__file__)
+APP_DIR = os.path.dirname(THIS_FILE)
+_WHITESPACE = re.compile(r'\s+')
+_PARAM_LIST = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+
+def normalize(statement):
+    """Collapse whitespace and IN-lists so statements of one shape compare equal"""
+    return _PARAM_LIST.sub('(?, ...)', _WHITESPACE.sub(' ', statement).strip())
+
+_app_files = {}
+
+def _is_app_file(filename):
+    result = _app_files.get(filename)
+    if result is None:
+        path = os.path.abspath(filename)
+        result = _app_files[filename] = path.startswith(APP_DIR + os.sep) and path != THIS_FILE
+    return result
+
+def call_site():
+    """file:line (function) of the innermost app frame outside this module"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        if _is_app_file(frame.f_code.co_filename):
+            return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} ({frame.f_code.co_name})"
+        frame = frame.f_back
+    return "<unknown>"
+
+class StatementStats:
+    __slots__ = ('count', 'total', 'max', 'call_sites')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.call_sites = Counter()
+
+class SqlInstrumentation:
+    """Collects statement statistics from an engine's cursor events"""
+    def __init__(self, engine, slow_query_ms=DEFAULT_SLOW_QUERY_MS, slow_log_path=None,
+                 n_plus_one_threshold=N_PLUS_ONE_THRESHOLD, window=N_PLUS_ONE_WINDOW):
+        self.engine = engine
+        self.slow_query_ms = slow_query_ms
+        self.slow_log_path = slow_log_path or os.path.join(config.get_data_dir(), SLOW_LOG_FILENAME)
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.window = window
+        self._lock = threading.Lock()
+        self.installed = False
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.statements = {}
+            self.call_sites = Counter()
+            self.n_plus_one = Counter()  # (call site, statement) -> times flagged
+            self.slow_queries = 0
+            self._recent = deque()
+            self._recent_counts = Counter()
+
+    def install(self):
+        if not self.installed:
+            event.listen(self.engine, 'before_cursor_execute', self._before)
+            event.listen(self.engine, 'after_cursor_execute', self._after)
+            self.installed = True
+
+    def uninstall(self):
+        if self.installed:
+            event.remove(self.engine, 'before_cursor_execute', self._before)
+            event.remove(self.engine, 'after_cursor_execute', self._after)
+            self.installed = False
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info['sql_instrumentation_start'] = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop('sql_instrumentation_start', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        shape = normalize(statement)
+        site = call_site()
+        with self._lock:
+            stats = self.statements.get(shape)
+            if stats is None:
+                stats = self.statements[shape] = StatementStats()
+            stats.count += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.call_sites[site] += 1
+            self.call_sites[site] += 1
+
+            key = (site, shape)
+            self._recent.append(key)
+            self._recent_counts[key] += 1
+            if len(self._recent) > self.window:
+                oldest = self._recent.popleft()
+                self._recent_counts[oldest] -= 1
+                if not self._recent_counts[oldest]:
+                    del self._recent_counts[oldest]
+            if self._recent_counts[key] == self.n_plus_one_threshold:
+                self.n_plus_one[key] += 1
+
+        if elapsed * 1000 >= self.slow_query_ms:
+            self._log_slow(conn, statement, parameters, executemany, elapsed, site)
+
+    def _explain(self, conn, statement, parameters, executemany):
+        if executemany or conn.dialect.name != 'sqlite':
+            return None
+        if not statement.lstrip().upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')):
+            return None
+        # A separate cursor, so the statement's own results are untouched
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            return [row[-1] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def _log_slow(self, conn, statement, parameters, executemany, elapsed, site):
+        try:
+            plan = self._explain(conn, statement, parameters, executemany)
+        except Exception as e:
+            plan = [f"(EXPLAIN failed: {str(e)})"]
+        lines = [
+            f"{datetime.now().isoformat(timespec='seconds')} {elapsed * 1000:.1f} ms at {site}",
+            f"  {normalize(statement)}",
+        ]
+        if not executemany:
+            lines.append(f"  params: {str(parameters)[:200]}")
+        lines.extend(f"  plan: {step}" for step in plan or [])
+        with self._lock:
+            self.slow_queries += 1
+            with open(self.slow_log_path, 'a') as log:
+                log.write("\n".join(lines) + "\n")
+
+    @property
+    def total_queries(self):
+        return sum(stats.count for stats in self.statements.values())
+
+    def report(self, limit=20):
+        """The statements that took the most time in total, slowest first"""
+        with self._lock:
+            rows = [
+                {
+                    'statement': shape,
+                    'count': stats.count,
+                    'total_ms': stats.total * 1000,
+                    'avg_ms': stats.total * 1000 / stats.count,
+                    'max_ms': stats.max * 1000,
+                    'top_call_site': stats.call_sites.most_common(1)[0][0],
+                }
+                for shape, stats in self.statements.items()
+            ]
+        rows.sort(key=lambda row: row['total_ms'], reverse=True)
+        return rows[:limit]
+
+    def n_plus_one_suspects(self):
+        """(call site, statement, times flagged) for repeated per-row queries"""
+        with self._lock:
+            return [(site, shape, count) for (site, shape), count in self.n_plus_one.most_common()]
+
+_instrumentation = None
+
+def get_instrumentation():
+    """The installed instrumentation, or None when disabled"""
+    return _instrumentation
+
+def install_from_env(engine=None):
+    """Install on the app engine if FINANCE_TRACKER_SQL_DEBUG is set"""
+    global _instrumentation
+    if _instrumentation is None and config.env_flag(config.ENV_SQL_DEBUG):
+        if engine is None:
+            from models import ENGINE as engine
+        slow_query_ms = float(os.environ.get(config.ENV_SLOW_QUERY_MS) or DEFAULT_SLOW_QUERY_MS)
+        _instrumentation = SqlInstrumentation(engine, slow_query_ms)
+        _instrumentation.install()
+    return _instrumentation
@@ -0,0 +1,133 @@
+"""Match bank statement lines against transactions already in the ledger.
+
+Existing transactions in the statement's date range are indexed in a dict
+keyed by (currency, amount bucket, date bucket). Buckets are as wide as the
+tolerances, so every transaction within tolerance of a line is in one of
+the nine buckets around the line's own and each line costs a constant
+number of lookups. The candidate pairs are then sorted by how close they
+are and assigned greedily, one transaction per line, which keeps the whole
+match at O(n log n).
+
+A line is ambiguous when several unassigned transactions fit it equally
+well and they differ (in date, amount or description); identical
+candidates are interchangeable and the oldest is taken. Ambiguous lines
+are left for the user to review rather than guessed.
+
+    lines = read_statement_csv('statement.csv')
+    result = match_statement(session, account_id, lines, day_tolerance=3)
+"""
+import csv
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from archive import iter_rows_in_range
+from models import normalize_description
+
+DEFAULT_DAY_TOLERANCE = 2
+DEFAULT_AMOUNT_TOLERANCE = 0.0
+
+StatementLine = namedtuple('StatementLine', ['line', 'date', 'amount', 'currency', 'description'])
+Match = namedtuple('Match', ['line', 'transaction', 'days_off', 'amount_off'])
+MatchResult = namedtuple('MatchResult', [
+    'matched',                 # Match tuples
+    'unmatched',               # Statement lines with no transaction within tolerance
+    'ambiguous',               # (line, [candidate rows]) left for review
+    'unmatched_transactions',  # Ledger rows in range that no line matched
+])
+
+def to_minor(amount):
+    return int(round(amount * 100))
+
+def read_statement_csv(path, default_currency='SGD'):
+    """Statement lines from a CSV with Date, Amount and optional Currency/Description columns
+
+    Amounts are signed as in the ledger: money out is negative.
+    """
+    lines = []
+    with open(path, newline='') as file:
+        for number, record in enumerate(csv.DictReader(file), start=2):
+            try:
+                lines.append(StatementLine(
+                    number,
+                    datetime.strptime(record["Date"].strip(), "%Y-%m-%d").date(),
+                    float(record["Amount"].replace(",", "")),
+                    (record.get("Currency") or default_currency).strip().upper(),
+                    record.get("Description") or "",
+                ))
+            except Exception as e:
+                raise ValueError(f"{path}:{number}: {str(e)}")
+    return lines
+
+class TransactionIndex:
+    """Ledger rows hashed by currency, amount bucket and date bucket"""
+    def __init__(self, rows, day_tolerance, amount_tolerance_minor):
+        # Width tolerance + 1 so anything within tolerance is at most one bucket away
+        self.day_width = day_tolerance + 1
+        self.amount_width = amount_tolerance_minor + 1
+        self.day_tolerance = day_tolerance
+        self.amount_tolerance = amount_tolerance_minor
+        self.buckets = defaultdict(list)
+        for row in rows:
+            self.buckets[self._key(row.currency, to_minor(row.amount), row.date.toordinal())].append(row)
+
+    def _key(self, currency, amount_minor, day):
+        return currency, amount_minor // self.amount_width, day // self.day_width
+
+    def candidates(self, line):
+        """(days off, cents off, row) for every row within tolerance of a line"""
+        amount_minor = to_minor(line.amount)
+        day = line.date.toordinal()
+        currency, amount_bucket, day_bucket = self._key(line.currency, amount_minor, day)
+        found = []
+        for amount_step in (-1, 0, 1):
+            for day_step in (-1, 0, 1):
+                for row in self.buckets.get((currency, amount_bucket + amount_step, day_bucket + day_step), ()):
+                    days_off = abs(row.date.toordinal() - day)
+                    amount_off = abs(to_minor(row.amount) - amount_minor)
+                    if days_off <= self.day_tolerance and amount_off <= self.amount_tolerance:
+                        found.append((days_off, amount_off, row))
+        return found
+
+def _identity(row):
+    return row.date.date(), to_minor(row.amount), normalize_description(row.description)
+
+def match_statement(session, account_id, lines, day_tolerance=DEFAULT_DAY_TOLERANCE,
+                    amount_tolerance=DEFAULT_AMOUNT_TOLERANCE):
+    """Match statement lines one-to-one with the account's transactions"""
+    if not lines:
+        return MatchResult([], [], [], [])
+    start = datetime.combine(min(line.date for line in lines), datetime.min.time()) - timedelta(days=day_tolerance)
+    end = datetime.combine(max(line.date for line in lines), datetime.min.time()) + timedelta(days=day_tolerance + 1)
+    rows = list(iter_rows_in_range(session, account_id, start, end))
+    index = TransactionIndex(rows, day_tolerance, to_minor(amount_tolerance))
+
+    pairs = []
+    for line in lines:
+        described = normalize_description(line.description)
+        for days_off, amount_off, row in index.candidates(line):
+            # Same description breaks ties between otherwise equal candidates
+            score = (days_off, amount_off, normalize_description(row.description) != described)
+            pairs.append((score, line.line, row.id, line, row))
+    pairs.sort(key=lambda pair: pair[:3])
+
+    by_line = defaultdict(list)
+    for pair in pairs:
+        by_line[pair[1]].append(pair)
+
+    taken = set()
+    decided = set()
+    matched = []
+    ambiguous = []
+    for score, line_number, row_id, line, row in pairs:
+        if line_number in decided or row_id in taken:
+            continue
+        tied = [pair[4] for pair in by_line[line_number] if pair[0] == score and pair[2] not in taken]
+        decided.add(line_number)
+        if len({_identity(candidate) for candidate in tied}) > 1:
+            ambiguous.append((line, tied))
+            continue
+        taken.add(row_id)
+        matched.append(Match(line, row, score[0], score[1] / 100.0))
+
+    unmatched = [line for line in lines if line.line not in decided]
+    unmatched_transactions = [row for row in rows if row.id not in taken]
+    return MatchResult(matched, unmatched, ambiguous, unmatched_transactions)
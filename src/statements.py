@@ -0,0 +1,283 @@
+"""Periodic statements for every user or account, generated in parallel.
+
+generate_statements() fans jobs out over a ProcessPoolExecutor. Each worker
+process opens its own read-only engine once (see models.read_only_engine)
+and reuses it for every job it runs, so the app can keep writing while
+statements are produced and a worker can never change the ledger. A job
+is one account, or one user with a section per account; it writes one
+HTML or PDF file with the period's transactions, totals and charts, and
+reports how long it took.
+
+    jobs = plan_jobs(session, datetime(2024, 5, 1), datetime(2024, 6, 1), 'statements/')
+    for result in generate_statements(jobs):
+        print(format_result(result))
+
+    python statements.py --month 2024-05 --format pdf --output statements/
+"""
+import argparse
+import base64
+import html
+import io
+import multiprocessing
+import os
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from sqlalchemy import select, func
+from models import Account, ArchivedYear, Category, OpeningBalance, Transaction, User, read_only_engine
+
+FORMATS = ('html', 'pdf')
+
+StatementJob = namedtuple('StatementJob', ['username', 'account_ids', 'start', 'end', 'fmt', 'path'])
+JobResult = namedtuple('JobResult', ['job', 'seconds', 'transactions', 'error'])
+StatementLine = namedtuple('StatementLine', ['date', 'category', 'description', 'amount', 'currency', 'balance'])
+AccountStatement = namedtuple('AccountStatement', [
+    'name', 'currency', 'opening', 'income', 'expenses', 'closing', 'lines', 'by_category', 'balances'
+])
+
+def month_range(month):
+    """[start, end) of a 'YYYY-MM' month"""
+    start = datetime.strptime(month, "%Y-%m")
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start, end
+
+def plan_jobs(session, start, end, output_dir, fmt='html', per='account', usernames=None):
+    """One job per account, or per user with per='user'"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported statement format {fmt}")
+    if per not in ('account', 'user'):
+        raise ValueError(f"Statements are per account or per user, not {per}")
+    query = select(User.username, Account.id).join(Account, Account.user_id == User.id)\
+        .order_by(User.username, Account.id)
+    if usernames:
+        query = query.where(User.username.in_(usernames))
+    accounts = defaultdict(list)
+    for username, account_id in session.execute(query):
+        accounts[username].append(account_id)
+    period = f"{start:%Y-%m-%d}_{end:%Y-%m-%d}"
+    jobs = []
+    for username, account_ids in accounts.items():
+        if per == 'user':
+            groups = [(f"{username}_{period}", account_ids)]
+        else:
+            groups = [(f"{username}_{account_id}_{period}", [account_id]) for account_id in account_ids]
+        for stem, ids in groups:
+            jobs.append(StatementJob(username, tuple(ids), start, end, fmt,
+                                     os.path.join(output_dir, f"{stem}.{fmt}")))
+    return jobs
+
+def _rates(session):
+    from analytics import rate_to
+    from models import ExchangeRate
+    rates = {(from_curr, to_curr): rate for from_curr, to_curr, rate in session.execute(
+        select(ExchangeRate.from_currency, ExchangeRate.to_currency, ExchangeRate.rate))}
+    return lambda from_curr, to_curr: rate_to(rates, from_curr, to_curr)
+
+def _opening_totals(session, account_id, start):
+    """Cents per currency dated before start, archived years included"""
+    from archive import iter_rows_in_range
+    totals = defaultdict(int)
+    last_archived = session.execute(select(func.max(ArchivedYear.year))).scalar()
+    if last_archived is not None and start < datetime(last_archived + 1, 1, 1):
+        # Starts inside the archives, which only have rows, not subtotals
+        for row in iter_rows_in_range(session, account_id, end=start):
+            totals[row.currency] += int(round(row.amount * 100))
+        return totals
+    for currency, total_minor in session.execute(
+            select(OpeningBalance.currency, OpeningBalance.total_minor)
+            .where(OpeningBalance.account_id == account_id)):
+        totals[currency] += total_minor
+    for currency, total_minor in session.execute(
+            select(Transaction.currency, func.sum(func.round(Transaction.amount * 100)))
+            .where(Transaction.account_id == account_id, Transaction.date < start)
+            .group_by(Transaction.currency)):
+        totals[currency] += int(total_minor or 0)
+    return totals
+
+def build_account_statement(session, account, start, end, rate, categories):
+    """Totals and lines of one account for [start, end), in the account's currency"""
+    from archive import iter_rows_in_range
+    opening = round(sum(total / 100.0 * rate(currency, account.currency)
+                        for currency, total in _opening_totals(session, account.id, start).items()), 2)
+    balance = opening
+    income = expenses = 0.0
+    lines = []
+    by_category = defaultdict(float)
+    balances = [(f"{start:%Y-%m-%d}", opening)]
+    for row in iter_rows_in_range(session, account.id, start, end):
+        amount = row.amount * rate(row.currency, account.currency)
+        balance += amount
+        category = categories.get(row.category_id, "Unknown")
+        if amount < 0:
+            expenses -= amount
+            by_category[category] -= amount
+        else:
+            income += amount
+        lines.append(StatementLine(row.date, category, row.description or "", row.amount, row.currency,
+                                   round(balance, 2)))
+        balances.append((f"{row.date:%Y-%m-%d}", round(balance, 2)))
+    return AccountStatement(account.name, account.currency, opening, round(income, 2), round(expenses, 2),
+                            round(balance, 2), lines,
+                            sorted(((name, round(value, 2)) for name, value in by_category.items()),
+                                   key=lambda item: -item[1]),
+                            balances)
+
+def _charts(statement):
+    # Identical charts (an unchanged month, a re-run) are read from the cache
+    from chart_cache import chart_cache
+    return [
+        chart_cache.render('expenses_by_category', statement.by_category, 'png',
+                           {'title': f"{statement.name}: expenses by category"}),
+        chart_cache.render('balance', statement.balances, 'png', {'title': f"{statement.name}: balance"}),
+    ]
+
+def render_html(job, statements):
+    def money(value):
+        return f"{value:,.2f}"
+    parts = [
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>",
+        f"<title>Statement for {html.escape(job.username)}</title>",
+        "<style>body{font-family:sans-serif;margin:2em}table{border-collapse:collapse}"
+        "td,th{padding:2px 8px;border-bottom:1px solid #ddd}td.n{text-align:right}</style></head><body>",
+        f"<h1>Statement for {html.escape(job.username)}</h1>",
+        f"<p>{job.start:%Y-%m-%d} to {job.end:%Y-%m-%d} (exclusive)</p>",
+    ]
+    for statement in statements:
+        parts.append(f"<h2>{html.escape(statement.name)} ({statement.currency})</h2>")
+        parts.append("<table>" + "".join(
+            f"<tr><th>{label}</th><td class='n'>{money(value)}</td></tr>"
+            for label, value in (("Opening balance", statement.opening), ("Income", statement.income),
+                                 ("Expenses", statement.expenses), ("Closing balance", statement.closing))
+        ) + "</table>")
+        for png in _charts(statement):
+            parts.append(f"<img alt='chart' src='data:image/png;base64,{base64.b64encode(png).decode()}'>")
+        parts.append("<table><tr><th>Date</th><th>Category</th><th>Description</th><th>Amount</th>"
+                     f"<th>Balance ({statement.currency})</th></tr>")
+        parts.extend(
+            f"<tr><td>{line.date:%Y-%m-%d}</td><td>{html.escape(line.category)}</td>"
+            f"<td>{html.escape(line.description)}</td><td class='n'>{money(line.amount)} {line.currency}</td>"
+            f"<td class='n'>{money(line.balance)}</td></tr>"
+            for line in statement.lines
+        )
+        parts.append("</table>")
+    parts.append("</body></html>")
+    with open(job.path, 'w', encoding='utf-8') as file:
+        file.write("\n".join(parts))
+
+# Transaction lines per PDF page
+PDF_LINES_PER_PAGE = 45
+
+def render_pdf(job, statements):
+    """A summary page with charts per account, then pages of transactions"""
+    from matplotlib.backends.backend_pdf import PdfPages
+    from matplotlib.figure import Figure
+    from matplotlib.image import imread
+    with PdfPages(job.path) as pdf:
+        for statement in statements:
+            page = Figure(figsize=(8.27, 11.69))  # A4
+            page.text(0.08, 0.95, f"Statement for {job.username}: {statement.name} ({statement.currency})",
+                      fontsize=14, weight='bold')
+            page.text(0.08, 0.92, f"{job.start:%Y-%m-%d} to {job.end:%Y-%m-%d} (exclusive)", fontsize=10)
+            page.text(0.08, 0.84, "\n".join(
+                f"{label:<16}{value:>14,.2f}"
+                for label, value in (("Opening balance", statement.opening), ("Income", statement.income),
+                                     ("Expenses", statement.expenses), ("Closing balance", statement.closing))
+            ), family='monospace', fontsize=10)
+            for index, png in enumerate(_charts(statement)):
+                ax = page.add_axes([0.08, 0.42 - index * 0.38, 0.84, 0.36])
+                ax.imshow(imread(io.BytesIO(png), format='png'))
+                ax.axis('off')
+            pdf.savefig(page)
+            for offset in range(0, len(statement.lines), PDF_LINES_PER_PAGE):
+                page = Figure(figsize=(8.27, 11.69))
+                page.text(0.05, 0.96, f"{statement.name}: transactions", fontsize=12, weight='bold')
+                page.text(0.05, 0.93, "\n".join(
+                    f"{line.date:%Y-%m-%d}  {line.category[:14]:<14} {line.description[:28]:<28}"
+                    f"{line.amount:>12,.2f} {line.currency}{line.balance:>14,.2f}"
+                    for line in statement.lines[offset:offset + PDF_LINES_PER_PAGE]
+                ), family='monospace', fontsize=7.5, va='top')
+                pdf.savefig(page)
+
+# Set in each worker process by _init_worker
+_engine = None
+
+def _init_worker(database_url):
+    global _engine
+    _engine = read_only_engine(database_url)
+
+def run_job(job):
+    """Build and write one statement in this process, returning a JobResult"""
+    from sqlalchemy.orm import Session as OrmSession
+    started = time.perf_counter()
+    try:
+        with OrmSession(bind=_engine) as session:
+            rate = _rates(session)
+            categories = dict(session.execute(select(Category.id, Category.name)).all())
+            accounts = session.scalars(select(Account).where(Account.id.in_(job.account_ids))
+                                       .order_by(Account.id)).all()
+            statements = [build_account_statement(session, account, job.start, job.end, rate, categories)
+                          for account in accounts]
+        (render_pdf if job.fmt == 'pdf' else render_html)(job, statements)
+        return JobResult(job, time.perf_counter() - started,
+                         sum(len(statement.lines) for statement in statements), None)
+    except Exception as e:
+        return JobResult(job, time.perf_counter() - started, 0, str(e))
+
+def generate_statements(jobs, database_url=None, workers=None):
+    """Run jobs over a pool of worker processes, yielding JobResults as they finish
+
+    workers=0 runs them one by one in this process, which is what a single
+    job would cost anyway.
+    """
+    from models import DATABASE_URL
+    database_url = str(database_url or DATABASE_URL.render_as_string(hide_password=False))
+    for job in jobs:
+        os.makedirs(os.path.dirname(os.path.abspath(job.path)), exist_ok=True)
+    if not jobs:
+        return
+    if workers == 0:
+        _init_worker(database_url)
+        for job in jobs:
+            yield run_job(job)
+        return
+    # Spawned, not forked: the GUI process has Qt and worker threads running
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(database_url,)) as pool:
+        futures = [pool.submit(run_job, job) for job in jobs]
+        for future in as_completed(futures):
+            yield future.result()
+
+def format_result(result):
+    status = f"failed: {result.error}" if result.error else f"{result.transactions:,} transaction(s)"
+    return f"{result.job.path}\t{result.seconds * 1000:.0f} ms\t{status}"
+
+def main(argv=None):
+    from models import session_scope, init_db
+    parser = argparse.ArgumentParser(description="Generate statements for every user or account")
+    parser.add_argument('--month', required=True, help="YYYY-MM")
+    parser.add_argument('--format', choices=FORMATS, default='html')
+    parser.add_argument('--per', choices=('account', 'user'), default='account')
+    parser.add_argument('--user', action='append', help="Only these users (repeatable)")
+    parser.add_argument('--output', default='statements')
+    parser.add_argument('--workers', type=int, help="Worker processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    init_db()
+    try:
+        start, end = month_range(args.month)
+        with session_scope() as session:
+            jobs = plan_jobs(session, start, end, args.output, args.format, args.per, args.user)
+        started = time.perf_counter()
+        failed = 0
+        for result in generate_statements(jobs, workers=args.workers):
+            failed += result.error is not None
+            print(format_result(result))
+        print(f"{len(jobs)} statement(s) in {time.perf_counter() - started:.1f} s, {failed} failed")
+    except Exception as e:
+        print(f"statements: {str(e)}")
+        return 1
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
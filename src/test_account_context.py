@@ -0,0 +1,81 @@
+import os
+import pytest
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from models import ENGINE, Session, Transaction, TransactionType
+from auth import PasswordAuth
+from account_context import load_account_context, DEFAULT_PAGE_SIZE
+from query_cache import query_cache
+
+USERNAME = 'context_test'
+HISTORY_SIZE = DEFAULT_PAGE_SIZE + 50
+
+@contextmanager
+def count_queries():
+    """Collect every statement sent to the database"""
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(ENGINE, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(ENGINE, 'before_cursor_execute', record)
+
+@pytest.fixture
+def user_with_history(make_account, monkeypatch):
+    # Cheap hashes, and no rehash on login during the measured path
+    monkeypatch.setattr(PasswordAuth, 'iterations', 1000)
+    start = datetime(2024, 1, 1)
+    rows = [{'date': start + timedelta(days=i), 'amount': -10.0} for i in range(HISTORY_SIZE)]
+    make_account(USERNAME, balance=-10.0 * HISTORY_SIZE, password=PasswordAuth.hash_password('pw'),
+                 transactions=rows)
+    # Measure cold loads
+    query_cache.clear()
+    return USERNAME
+
+def test_context_loads_in_four_queries(user_with_history):
+    session = Session()
+    with count_queries() as statements:
+        context = load_account_context(session, user_with_history)
+        # Touching the loaded data must not trigger lazy loads
+        assert context.account.currency == 'SGD'
+        assert all(context.category_name(t.category_id) for t in context.first_page)
+        assert context.get_rate('USD', 'SGD') == pytest.approx(1.33)
+    assert len(statements) == 4, statements
+    assert len(context.first_page) == DEFAULT_PAGE_SIZE
+    assert context.has_more
+
+def test_login_to_first_paint_query_count(user_with_history, monkeypatch):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    QtWidgets = pytest.importorskip('PyQt6.QtWidgets')
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    import account
+
+    errors = []
+    monkeypatch.setattr(account.QMessageBox, 'critical', lambda *args: errors.append(args))
+    monkeypatch.setattr(account.QMessageBox, 'warning', lambda *args: errors.append(args))
+
+    with count_queries() as statements:
+        success, _, _ = PasswordAuth.authenticate_user(user_with_history, 'pw')
+        window = account.AccountWindow(user_with_history)
+
+    assert success
+    assert not errors
+    # One query to check the password, four to load the account context
+    assert len(statements) == 5, statements
+    assert window.transactions_table.rowCount() == DEFAULT_PAGE_SIZE
+
+    window.load_remaining_transactions()
+    assert window.transactions_table.rowCount() == HISTORY_SIZE
+    window.close()
+
+def test_history_rows_are_not_tracked(user_with_history):
+    session = Session()
+    context = load_account_context(session, user_with_history)
+    rows = context.first_page + context.load_transactions(offset=DEFAULT_PAGE_SIZE)
+    assert len(rows) == HISTORY_SIZE
+    assert rows[0].amount == -10.0 and rows[0].type == TransactionType.EXPENSE
+    # Only the user and account are in the identity map, not the history
+    assert not any(isinstance(obj, Transaction) for obj in session.identity_map.values())
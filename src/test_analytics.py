@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+from datetime import datetime
+from analytics import AnalyticsEngine, category_by_month, savings_rate, currency_exposure
+from models import ENGINE, init_db, TransactionType
+
+RATES = {('USD', 'SGD'): 1.25}
+
+def make_frame(rows):
+    frame = pd.DataFrame(rows, columns=['date', 'type', 'category', 'currency', 'amount_minor'])
+    frame['date'] = pd.to_datetime(frame['date'])
+    for column in ('type', 'category', 'currency'):
+        frame[column] = frame[column].astype('category')
+    frame['amount_minor'] = frame['amount_minor'].astype('int64')
+    return frame
+
+def test_reports_convert_to_base_currency():
+    frame = make_frame([
+        ('2024-01-05', 'INCOME', 'Salary', 'SGD', 400000),
+        ('2024-01-10', 'EXPENSE', 'Food', 'USD', -10000),
+        ('2024-02-01', 'EXPENSE', 'Food', 'SGD', -5000),
+    ])
+    pivot = category_by_month(frame, RATES, 'SGD')
+    assert pivot.loc['Food', pd.Period('2024-01', 'M')] == pytest.approx(-125.0)
+    assert pivot.loc['Food', pd.Period('2024-02', 'M')] == pytest.approx(-50.0)
+
+    savings = savings_rate(frame, RATES, 'SGD')
+    assert savings.loc[pd.Period('2024-01', 'M'), 'savings_rate'] == pytest.approx((4000 - 125) / 4000, abs=1e-4)
+    assert savings.loc[pd.Period('2024-02', 'M'), 'savings_rate'] == 0.0
+
+    exposure = currency_exposure(frame, RATES, 'SGD')
+    assert exposure.loc['USD', 'amount_SGD'] == pytest.approx(-125.0)
+
+def test_frame_is_cached_until_data_changes(make_account):
+    init_db()
+    analytics = AnalyticsEngine(ENGINE)
+    try:
+        first, _ = analytics.frame()
+        assert first['amount_minor'].dtype == 'int64'
+        assert str(first['currency'].dtype) == 'category'
+        assert analytics.frame()[0] is first
+
+        make_account('analytics_test', transactions=[
+            {'date': datetime(2024, 3, 1), 'type': TransactionType.INCOME, 'amount': 10.0}
+        ])
+
+        second, _ = analytics.frame()
+        assert second is not first
+        assert len(second) == len(first) + 1
+    finally:
+        analytics.close()
@@ -0,0 +1,149 @@
+import os
+import pytest
+from datetime import datetime
+from sqlalchemy import select
+from models import (ENGINE, Session, session_scope, Transaction, Category, OpeningBalance, ArchivedYear,
+                    ArchivedFingerprint, find_duplicate)
+import archive
+from archive import archive_through, iter_rows_in_range, archive_dir, attach_year
+from reconcile import Reconciler
+from cli import import_csv
+from analytics import load_transactions_frame
+from columnar import export_all, load_transactions
+
+USERNAME = 'archive_test'
+# Years no other test writes to, so archiving them only moves this test's rows
+AMOUNTS = {datetime(2001, 3, 1): -10.0, datetime(2001, 9, 1): 250.0,
+           datetime(2002, 6, 1): -40.0, datetime(2024, 2, 1): -5.0, datetime(2024, 3, 1): -7.5}
+
+@pytest.fixture
+def account_id(make_account):
+    rows = [{'date': date, 'amount': amount} for date, amount in AMOUNTS.items()]
+    return make_account(USERNAME, balance=sum(AMOUNTS.values()), transactions=rows).account_id
+
+def attached_schemas(session):
+    return {row[1] for row in session.connection().exec_driver_sql("PRAGMA database_list")}
+
+def test_archive_moves_closed_years_and_carries_balance(account_id):
+    with session_scope() as session:
+        results = archive_through(session, 2002)
+    assert [(result.year, result.transactions) for result in results
+            if result.year in (2001, 2002)] == [(2001, 2), (2002, 1)]
+    assert os.path.exists(os.path.join(archive_dir(), os.path.basename(results[0].path)))
+
+    with session_scope() as session:
+        dates = [date for date, in session.query(Transaction.date).filter_by(account_id=account_id)]
+        assert sorted(dates) == [datetime(2024, 2, 1), datetime(2024, 3, 1)]
+        [opening] = session.query(OpeningBalance).filter_by(account_id=account_id).all()
+        assert (opening.total_minor, opening.count, opening.through_year) == (20000, 3, 2002)
+        # Booked as the rows were written, so rate changes don't revalue it
+        assert opening.booked_minor == 20000
+        assert session.get(ArchivedYear, 2001) is not None
+        [result] = Reconciler(session).verify(account_id)
+        assert result.expected_balance == pytest.approx(187.5)
+        assert not Reconciler(session).is_drifted(result)
+        # Nothing left to move
+        assert archive_through(session, 2002) == []
+
+def test_archives_are_attached_only_when_the_range_reaches_them(account_id):
+    with session_scope() as session:
+        archive_through(session, 2002)
+    ENGINE.dispose()
+
+    session = Session()
+    recent = list(iter_rows_in_range(session, account_id, start=datetime(2024, 1, 1)))
+    assert [row.amount for row in recent] == [-5.0, -7.5]
+    assert not {'archive_2001', 'archive_2002'} & attached_schemas(session)
+
+    rows = list(iter_rows_in_range(session, account_id, end=datetime(2002, 1, 1)))
+    assert [row.amount for row in rows] == [-10.0, 250.0]
+    assert 'archive_2001' in attached_schemas(session)
+    assert 'archive_2002' not in attached_schemas(session)
+
+    everything = list(iter_rows_in_range(session, account_id))
+    assert [row.date for row in everything] == sorted(AMOUNTS)
+    session.close()
+
+def test_archived_rows_still_count_as_duplicates(account_id, tmp_path):
+    with session_scope() as session:
+        archive_through(session, 2002)
+        category = session.query(Category.name).join(Transaction, Transaction.category_id == Category.id)\
+            .filter(Transaction.account_id == account_id).first()[0]
+    path = tmp_path / 'statement.csv'
+    path.write_text("Date,Type,Category,Amount,Currency,Description\n"
+                    f"2001-03-01,EXPENSE,{category},-10.00,SGD,\n"
+                    f"2002-06-01,EXPENSE,{category},-40.00,SGD,\n"
+                    f"2002-06-01,EXPENSE,{category},-40.00,SGD,\n")
+    with session_scope() as session:
+        # Only the second -40.00 of 2002-06-01 is new
+        assert import_csv(session, str(path), account_id) == (1, 2, [])
+        assert find_duplicate(session, {'account_id': account_id, 'date': datetime(2001, 3, 1),
+                                        'amount': -10.0, 'currency': 'SGD', 'description': ""}) is not None
+
+def test_identical_twins_of_archived_rows_are_kept(account_id):
+    with session_scope() as session:
+        archive_through(session, 2002)
+        twin = session.get(Transaction, session.query(Transaction.id).filter_by(account_id=account_id).first()[0])
+        archived_fingerprint = session.execute(
+            select(ArchivedFingerprint.fingerprint).where(ArchivedFingerprint.account_id == account_id,
+                                                         ArchivedFingerprint.year == 2001)
+        ).scalars().first()
+        # A row that slipped in with an archived row's fingerprint, as before duplicate
+        # checks saw archived years
+        session.execute(Transaction.__table__.insert(), [{
+            'date': datetime(2001, 3, 1), 'type': twin.type, 'category_id': twin.category_id,
+            'amount': -10.0, 'currency': 'SGD', 'description': "", 'account_id': account_id,
+            'user_id': twin.user_id, 'fingerprint': archived_fingerprint,
+        }])
+    with session_scope() as session:
+        [result] = archive_through(session, 2001)
+        assert result.transactions == 1
+        rows = list(iter_rows_in_range(session, account_id, end=datetime(2002, 1, 1)))
+        assert [row.amount for row in rows] == [-10.0, -10.0, 250.0]
+
+def test_reused_ids_dont_overwrite_archived_rows(account_id):
+    with session_scope() as session:
+        archive_through(session, 2002)
+        twin = session.get(Transaction, session.query(Transaction.id).filter_by(account_id=account_id).first()[0])
+        session.add(Transaction(date=datetime(2001, 5, 1), type=twin.type, category_id=twin.category_id,
+                                amount=-1.0, currency='SGD', description="late", account_id=account_id,
+                                user_id=twin.user_id))
+        session.flush()
+        late_id = session.query(Transaction.id).filter_by(description="late").scalar()
+        # The archive already holds a different row under the same id
+        connection = session.connection()
+        schema = attach_year(connection, 2001)
+        connection.exec_driver_sql(f"DELETE FROM {schema}.transactions WHERE id = ?", (late_id,))
+        connection.exec_driver_sql(
+            f"INSERT INTO {schema}.transactions (id, date, type, category_id, amount, currency, "
+            f"description, account_id, user_id, fingerprint) "
+            f"SELECT ?, date, type, category_id, 99.0, currency, 'other', account_id, user_id, ? "
+            f"FROM main.transactions WHERE id = ?", (late_id, f"other-{late_id}", late_id))
+    with session_scope() as session:
+        archive_through(session, 2001)
+        descriptions = [description for description, in session.connection().exec_driver_sql(
+            "SELECT description FROM archive_2001.transactions WHERE account_id = ? ORDER BY id", (account_id,))]
+        assert descriptions[-2:] == ["other", "late"]
+
+def test_nothing_is_removed_unless_copied(account_id, monkeypatch, tmp_path):
+    # Empty archive files, not ones earlier tests may have filled with these rows
+    monkeypatch.setattr(archive, 'archive_dir', lambda: str(tmp_path))
+    ENGINE.dispose()
+    monkeypatch.setattr(archive, '_copy_year', lambda *args: None)
+    with session_scope() as session:
+        with pytest.raises(ValueError):
+            archive_through(session, 2002)
+    with session_scope() as session:
+        assert session.query(Transaction).filter_by(account_id=account_id).count() == len(AMOUNTS)
+
+def test_reports_and_exports_include_archived_years(account_id, tmp_path):
+    with session_scope() as session:
+        archive_through(session, 2002)
+    with ENGINE.connect() as connection:
+        frame = load_transactions_frame(connection, account_id)
+    assert sorted(frame['amount_minor']) == sorted(round(amount * 100) for amount in AMOUNTS.values())
+    assert str(frame['category'].dtype) == 'category'
+
+    export_all(ENGINE, str(tmp_path))
+    exported = load_transactions(str(tmp_path), account_ids=[account_id])
+    assert sorted(exported['date']) == sorted(AMOUNTS)
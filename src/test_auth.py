@@ -0,0 +1,62 @@
+import hashlib
+from auth import PasswordAuth, HASH_SCHEME, MIN_ITERATIONS, INVALID_CREDENTIALS
+from models import init_db, session_scope, User
+
+def test_hash_format_and_verify():
+    stored = PasswordAuth.hash_password("s3cret", iterations=1000)
+    scheme, iterations, salt, digest = PasswordAuth.parse_hash(stored)
+    assert scheme == HASH_SCHEME
+    assert iterations == 1000
+    assert len(stored) <= 100, "Hash must fit the users.password column"
+    assert PasswordAuth.verify_password("s3cret", stored)
+    assert not PasswordAuth.verify_password("wrong", stored)
+
+def test_legacy_sha256_hash_verifies_and_needs_rehash():
+    legacy = hashlib.sha256(b"s3cret").hexdigest()
+    assert PasswordAuth.verify_password("s3cret", legacy)
+    assert not PasswordAuth.verify_password("wrong", legacy)
+    assert PasswordAuth.needs_rehash(legacy)
+
+def test_needs_rehash_when_cost_changes(monkeypatch):
+    monkeypatch.setattr(PasswordAuth, 'iterations', 1000)
+    stored = PasswordAuth.hash_password("s3cret")
+    assert not PasswordAuth.needs_rehash(stored)
+    monkeypatch.setattr(PasswordAuth, 'iterations', 2000)
+    assert PasswordAuth.needs_rehash(stored)
+
+def test_calibrate_is_stable(monkeypatch):
+    monkeypatch.setattr(PasswordAuth, 'iterations', PasswordAuth.iterations)
+    first = PasswordAuth.calibrate(target_ms=50, force=True)
+    assert first >= MIN_ITERATIONS
+    assert first % 10000 == 0
+    # Second call reuses the saved value instead of measuring again
+    assert PasswordAuth.calibrate(target_ms=50) == first
+
+def test_authenticate_rehashes_legacy_password(monkeypatch):
+    monkeypatch.setattr(PasswordAuth, 'iterations', 1000)
+    init_db()
+    with session_scope() as session:
+        session.query(User).filter_by(username='auth_test').delete()
+        session.add(User(username='auth_test', email='auth_test@example.com',
+                         password=hashlib.sha256(b"s3cret").hexdigest()))
+
+    success, _, user = PasswordAuth.authenticate_user('auth_test', 's3cret')
+    assert success
+    assert user.password.startswith(HASH_SCHEME + '$1000$')
+
+    success, message, _ = PasswordAuth.authenticate_user('auth_test', 'wrong')
+    assert not success
+    assert message == INVALID_CREDENTIALS
+
+def test_unknown_users_look_like_wrong_passwords(monkeypatch):
+    monkeypatch.setattr(PasswordAuth, 'iterations', 1000)
+    init_db()
+    verified = []
+    verify_password = PasswordAuth.verify_password
+    monkeypatch.setattr(PasswordAuth, 'verify_password',
+                        lambda password, stored: verified.append(stored) or verify_password(password, stored))
+    success, message, user = PasswordAuth.authenticate_user('no_such_user', 's3cret')
+    assert (success, message, user) == (False, INVALID_CREDENTIALS, None)
+    # The same key derivation runs as for an existing user
+    assert verified == [PasswordAuth.dummy_hash()]
+    assert verified[0].startswith(HASH_SCHEME + '$1000$')
@@ -0,0 +1,105 @@
+import os
+import sqlite3
+import pytest
+from datetime import datetime
+from models import (ENGINE, DB_PATH, Session, session_scope, Account, Transaction, Category,
+                    TransactionType)
+from backup import (copy_database, create_backup, list_backups, restore_backup, verify_backup,
+                    archives_path)
+from archive import archive_year, archive_dir, archive_filename, iter_rows_in_range
+
+USERNAME = 'backup_test'
+
+@pytest.fixture
+def account_id(make_account):
+    return make_account(USERNAME).account_id
+
+def add_expense(account_id, amount):
+    with session_scope() as session:
+        account = session.get(Account, account_id)
+        category = session.query(Category).filter_by(type=TransactionType.EXPENSE).first()
+        session.add(Transaction(user_id=account.user_id, account_id=account_id, date=datetime(2024, 6, 1),
+                                type=TransactionType.EXPENSE, category_id=category.id,
+                                amount=amount, currency='SGD', description=""))
+
+def count_transactions(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("SELECT count(*) FROM transactions").fetchone()[0]
+    finally:
+        connection.close()
+
+def test_writes_during_backup_neither_block_nor_leak_in(account_id, tmp_path):
+    add_expense(account_id, -1.0)
+    with ENGINE.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == 'wal'
+    before = count_transactions(DB_PATH)
+    writer = sqlite3.connect(DB_PATH, timeout=0)
+    steps = []
+
+    def progress(remaining, total):
+        if not steps:
+            # Would raise "database is locked" if the copy blocked writers
+            writer.execute("INSERT INTO transactions (date, type, category_id, amount, currency, "
+                           "account_id, user_id) SELECT date, type, category_id, amount, currency, "
+                           "account_id, user_id FROM transactions LIMIT 1")
+            writer.commit()
+        steps.append(remaining)
+
+    dest = str(tmp_path / 'copy.db')
+    copy_database(DB_PATH, dest, pages=1, pause=0, progress=progress)
+    writer.close()
+    assert len(steps) > 1
+    assert count_transactions(dest) == before
+    assert count_transactions(DB_PATH) == before + 1
+    assert verify_backup(dest, require_archives=False).ok  # Archive files are copied by create_backup
+
+def test_rotate_verify_and_restore(account_id, tmp_path):
+    for _ in range(3):
+        result = create_backup(directory=str(tmp_path), keep=2)
+    assert len(list_backups(str(tmp_path))) == 2
+    assert len(result.removed) == 1
+    assert verify_backup(result.path).transactions == count_transactions(DB_PATH)
+
+    add_expense(account_id, -99.0)
+    Session.remove()
+    safety = restore_backup(result.path)
+    with session_scope() as session:
+        assert session.query(Transaction).filter_by(account_id=account_id, amount=-99.0).count() == 0
+    assert count_transactions(safety.path) == count_transactions(result.path) + 1
+
+    damaged = tmp_path / 'damaged.db'
+    damaged.write_bytes(b"not a database" * 100)
+    assert not verify_backup(str(damaged)).ok
+    with pytest.raises(ValueError):
+        restore_backup(str(damaged))
+
+def test_archived_years_are_backed_up_and_restored(make_account, tmp_path):
+    # A year no other test writes to
+    account_id = make_account(USERNAME, balance=-3.0,
+                              transactions=[{'date': datetime(2003, 5, 1), 'amount': -3.0}]).account_id
+    with session_scope() as session:
+        archive_year(session, 2003)
+    filename = archive_filename(2003)
+    result = create_backup(directory=str(tmp_path), keep=0)
+    assert os.path.exists(os.path.join(archives_path(result.path), filename))
+    assert verify_backup(result.path).archives >= 1
+
+    ENGINE.dispose()
+    os.remove(os.path.join(archive_dir(), filename))
+    Session.remove()
+    restore_backup(result.path)
+    with session_scope() as session:
+        rows = list(iter_rows_in_range(session, account_id, end=datetime(2004, 1, 1)))
+    assert [row.amount for row in rows] == [-3.0]
+
+    os.remove(os.path.join(archives_path(result.path), filename))
+    assert f"missing archive {filename}" in verify_backup(result.path).problems
+    with pytest.raises(ValueError):
+        restore_backup(result.path)
+
+def test_snapshots_in_directories_with_uri_characters(account_id, tmp_path):
+    directory = tmp_path / "backups #1 %20?"
+    directory.mkdir()
+    result = create_backup(directory=str(directory), keep=0)
+    assert verify_backup(result.path).transactions == count_transactions(DB_PATH)
@@ -0,0 +1,101 @@
+import pytest
+from datetime import date, datetime
+from sqlalchemy import select
+from models import (Base, create_db_engine, session_scope, add_budget_spend_currency, Transaction,
+                    TransactionType, BudgetPeriod, BudgetSpend, ExchangeRate)
+from budgets import set_budget, check_budget, exceeded_budgets
+
+@pytest.fixture
+def user_ids(make_account):
+    return make_account('budget_test')[:3]
+
+def add_expense(session, ids, amount, date=None, currency='SGD'):
+    user_id, account_id, category_id = ids
+    transaction = Transaction(user_id=user_id, account_id=account_id, date=date or datetime.now(),
+                              type=TransactionType.EXPENSE, category_id=category_id,
+                              amount=amount, currency=currency, description="")
+    session.add(transaction)
+    session.flush()
+    return transaction
+
+def test_new_budget_counts_current_period_once(user_ids):
+    user_id, _, category_id = user_ids
+    with session_scope() as session:
+        add_expense(session, user_ids, -30.0)
+        add_expense(session, user_ids, 50.0)
+        set_budget(session, user_id, category_id, 100, 'SGD')
+    with session_scope() as session:
+        [status] = check_budget(session, user_id, category_id, datetime.now())
+    assert status.spent == pytest.approx(30.0)
+    assert status.remaining == pytest.approx(70.0)
+    assert not status.exceeded
+
+def test_counters_follow_inserts_edits_and_deletes(user_ids):
+    user_id, _, category_id = user_ids
+    with session_scope() as session:
+        set_budget(session, user_id, category_id, 100, 'SGD')
+        set_budget(session, user_id, category_id, 500, 'SGD', BudgetPeriod.YEARLY)
+    with session_scope() as session:
+        first = add_expense(session, user_ids, -60.0)
+        second = add_expense(session, user_ids, -45.5)
+        first_id, second_id = first.id, second.id
+    with session_scope() as session:
+        [status] = exceeded_budgets(session, user_id, category_id, datetime.now())
+        assert status.period == BudgetPeriod.MONTHLY
+        assert status.spent == pytest.approx(105.5)
+
+        session.get(Transaction, first_id).amount = -20.0
+        session.delete(session.get(Transaction, second_id))
+        session.flush()
+        statuses = check_budget(session, user_id, category_id, datetime.now())
+    assert {status.period: status.spent for status in statuses} == {
+        BudgetPeriod.MONTHLY: pytest.approx(20.0), BudgetPeriod.YEARLY: pytest.approx(20.0)
+    }
+
+def test_foreign_expenses_are_converted(user_ids):
+    user_id, _, category_id = user_ids
+    with session_scope() as session:
+        if not session.query(ExchangeRate).filter_by(from_currency='USD', to_currency='SGD').first():
+            session.add(ExchangeRate(from_currency='USD', to_currency='SGD', rate=1.35))
+        set_budget(session, user_id, category_id, 100, 'SGD')
+    with session_scope() as session:
+        rate = session.query(ExchangeRate.rate).filter_by(from_currency='USD', to_currency='SGD').scalar()
+        expense_id = add_expense(session, user_ids, -10.0, currency='USD').id
+        add_expense(session, user_ids, -5.0)
+        [status] = check_budget(session, user_id, category_id, datetime.now())
+    assert status.spent == pytest.approx(round(10.0 * rate, 2) + 5.0)
+
+    # Removing the expense after a rate change takes back exactly what it added
+    with session_scope() as session:
+        session.query(ExchangeRate).filter_by(from_currency='USD', to_currency='SGD').update({'rate': rate * 2})
+        session.delete(session.get(Transaction, expense_id))
+    with session_scope() as session:
+        [status] = check_budget(session, user_id, category_id, datetime.now())
+        counters = dict(session.query(BudgetSpend.currency, BudgetSpend.spent_minor)
+                        .filter_by(budget_id=status.budget_id))
+        session.query(ExchangeRate).filter_by(from_currency='USD', to_currency='SGD').update({'rate': rate})
+    assert counters == {'USD': 0, 'SGD': 500}
+    assert status.spent == pytest.approx(5.0)
+
+def test_old_counters_are_recounted_per_currency(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE budget_spend")
+        connection.exec_driver_sql("CREATE TABLE budget_spend (id INTEGER PRIMARY KEY, budget_id INTEGER, "
+                                   "period_start DATE, spent_minor INTEGER, UNIQUE (budget_id, period_start))")
+        connection.exec_driver_sql("INSERT INTO budgets (id, user_id, category_id, period, limit_amount, currency, "
+                                   "created_at) VALUES (1, 1, 3, 'MONTHLY', 100, 'SGD', '2024-05-10 00:00:00')")
+        for day, amount, currency in (('2024-04-30', -1.0, 'SGD'), ('2024-05-02', -2.0, 'SGD'),
+                                       ('2024-05-20', -3.0, 'USD'), ('2024-06-01', -4.0, 'SGD')):
+            connection.exec_driver_sql(
+                "INSERT INTO transactions (user_id, account_id, category_id, date, type, amount, currency) "
+                f"VALUES (1, 1, 3, '{day} 00:00:00', 'EXPENSE', {amount}, '{currency}')")
+        connection.exec_driver_sql("INSERT INTO budget_spend VALUES (1, 1, '2024-05-01', 603)")
+    add_budget_spend_currency(engine)
+    with engine.connect() as connection:
+        counters = connection.execute(select(BudgetSpend.period_start, BudgetSpend.currency,
+                                             BudgetSpend.spent_minor).order_by(BudgetSpend.id)).all()
+    assert counters == [(date(2024, 5, 1), 'SGD', 200), (date(2024, 5, 1), 'USD', 300),
+                        (date(2024, 6, 1), 'SGD', 400)]
+    engine.dispose()
@@ -0,0 +1,49 @@
+import os
+import time
+import charts
+from chart_cache import ChartCache, chart_key
+
+SERIES = [("Food", 120.0), ("Transport", 45.5)]
+
+def test_unchanged_charts_are_not_rendered_again(tmp_path, monkeypatch):
+    renders = []
+    render_chart = charts.render_chart
+    monkeypatch.setattr(charts, 'render_chart', lambda *args: renders.append(args) or render_chart(*args))
+    cache = ChartCache(str(tmp_path))
+
+    png = cache.render('expenses_by_category', SERIES, 'png', {'title': "May"})
+    assert png.startswith(b"\x89PNG")
+    assert cache.render('expenses_by_category', list(SERIES), 'png', {'title': "May"}) == png
+    # A fresh cache, as in another process, reads the same file
+    assert ChartCache(str(tmp_path)).render('expenses_by_category', SERIES, 'png', {'title': "May"}) == png
+    assert len(renders) == 1 and (cache.hits, cache.misses) == (1, 1)
+
+    # Different data, style or format is a different chart
+    cache.render('expenses_by_category', SERIES[:1], 'png', {'title': "May"})
+    cache.render('expenses_by_category', SERIES, 'png', {'title': "June"})
+    assert cache.render('expenses_by_category', SERIES, 'svg', {'title': "May"}).lstrip().startswith(b"<?xml")
+    assert len(renders) == 4
+    assert chart_key('balance', SERIES, 'png', None) == chart_key('balance', SERIES, 'png', {})
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    cache = ChartCache(str(tmp_path), max_bytes=250)
+    for index, key in enumerate(('a', 'b', 'c')):
+        cache.put(key, 'png', b"x" * 100)
+        os.utime(os.path.join(str(tmp_path), f"{key}.png"), (time.time() - 100 + index,) * 2)
+    # Over budget already: 'a' was the oldest
+    assert sorted(os.listdir(str(tmp_path))) == ['b.png', 'c.png']
+    os.utime(os.path.join(str(tmp_path), 'b.png'), (time.time() - 200,) * 2)
+    assert cache.get('c', 'png') == b"x" * 100  # Touched, so 'b' goes next
+    cache.put('d', 'png', b"x" * 100)
+    assert sorted(os.listdir(str(tmp_path))) == ['c.png', 'd.png']
+    assert cache.clear() == 2
+
+def test_writes_by_other_processes_count_towards_the_limit(tmp_path):
+    # Two caches on one directory, as in two statement workers
+    first = ChartCache(str(tmp_path), max_bytes=1600)
+    second = ChartCache(str(tmp_path), max_bytes=1600)
+    for index, writer in enumerate([first] + [second] * 14 + [first] * 10):
+        writer.put(f"chart{index}", 'png', b"x" * 100)
+        os.utime(os.path.join(str(tmp_path), f"chart{index}.png"), (time.time() - 100 + index,) * 2)
+    # first only wrote 1,100 bytes itself, but notices the directory is over
+    assert sorted(os.listdir(str(tmp_path))) == sorted(f"chart{index}.png" for index in range(9, 25))
@@ -0,0 +1,98 @@
+import json
+import pytest
+from datetime import datetime
+from models import session_scope, Transaction, TransactionType
+import classifier as classifier_module
+from classifier import (CategoryClassifier, load_classifier, classifier_path, tokenize, sync_classifier,
+                        ledger_checksum)
+import cli
+
+USERNAME = 'classifier_test'
+HISTORY = [("GRAB *TRIP 1234", 'Transport'), ("Grab trip 99", 'Transport'), ("MRT top-up", 'Transport'),
+           ("Coffee Bean #12", 'Food'), ("Hawker chicken rice", 'Food'), ("coffee bean", 'Food'),
+           ("SP Group electricity", 'Utilities')]
+
+@pytest.fixture
+def account(make_account):
+    return make_account(USERNAME, transactions=[
+        {'date': datetime(2024, 8, day), 'amount': -1.0 - day, 'category': name, 'description': description}
+        for day, (description, name) in enumerate(HISTORY, start=1)
+    ])
+
+def test_predicts_learns_and_forgets():
+    classifier = CategoryClassifier()
+    assert tokenize("GRAB *TRIP 1234") == ['grab', 'trip']
+    assert classifier.predict("grab") is None  # Nothing learned yet
+    for description, category_id in (("grab trip", 1), ("grab ride", 1), ("coffee", 2)):
+        classifier.learn(description, category_id)
+    assert classifier.predict("GRAB") .category_id == 1
+    assert classifier.predict("coffee shop").category_id == 2
+    assert classifier.predict("coffee", allowed={1}).category_id == 1
+    assert classifier.predict("unknown words") is None
+
+    classifier.forget("coffee", 2)
+    classifier.learn("coffee", 1)
+    assert classifier.predict("coffee").probability == pytest.approx(1.0)
+    assert CategoryClassifier.from_dict(json.loads(json.dumps(classifier.to_dict()))).predict("grab") == \
+        classifier.predict("grab")
+
+def test_saved_model_only_learns_new_rows(account):
+    with session_scope() as session:
+        classifier = load_classifier(session, account.user_id, retrain=True)
+        assert sum(classifier.documents.values()) == len(HISTORY)
+        food = account.categories['Food']
+        assert classifier.predict("COFFEE BEAN #7").category_id == food
+        session.add(Transaction(user_id=account.user_id, account_id=account.account_id,
+                                date=datetime(2024, 8, 20), type=TransactionType.EXPENSE,
+                                category_id=food, amount=-3.0, currency='SGD', description="Toast Box"))
+    with open(classifier_path(account.user_id)) as file:
+        saved = json.load(file)
+    with session_scope() as session:
+        classifier = load_classifier(session, account.user_id)
+        assert classifier.last_transaction_id > saved['last_transaction_id']
+        assert sum(classifier.documents.values()) == len(HISTORY) + 1
+        assert classifier.predict("toast box").category_id == food
+
+def test_model_follows_deletes_and_recategorizations(account):
+    with session_scope() as session:
+        classifier = load_classifier(session, account.user_id, retrain=True)
+        rows = {row.description: row for row in session.query(Transaction).filter_by(account_id=account.account_id)}
+        coffee, trip, other_coffee_id = rows["coffee bean"], rows["Grab trip 99"], rows["Coffee Bean #12"].id
+        # As a window does: the command runs, then the model follows it
+        changes = [(-1, coffee.id, coffee.description, coffee.category_id),
+                   (-1, trip.id, trip.description, trip.category_id),
+                   (1, trip.id, trip.description, account.categories['Food'])]
+        session.delete(coffee)
+        trip.category_id = account.categories['Food']
+        session.flush()
+        assert sync_classifier(session, classifier, account.user_id, changes)
+        assert classifier.checksum == ledger_checksum(session, account.user_id, classifier.last_transaction_id)
+        classifier.save(classifier_path(account.user_id))
+
+    # Changed elsewhere without telling the model: opening it retrains
+    with session_scope() as session:
+        session.delete(session.get(Transaction, other_coffee_id))
+    with session_scope() as session:
+        classifier = load_classifier(session, account.user_id)
+        assert sum(classifier.documents.values()) == len(HISTORY) - 2
+        assert classifier.predict("coffee bean") is None  # Both coffee rows are gone
+
+def test_import_fills_blank_categories(account, tmp_path, monkeypatch):
+    path = tmp_path / 'statement.csv'
+    path.write_text("Date,Type,Category,Amount,Currency,Description\n"
+                    "2024-09-01,EXPENSE,,-14.00,SGD,GRAB *TRIP 5678\n"
+                    "2024-09-02,EXPENSE,Food,-5.00,SGD,Ya Kun\n"
+                    "2024-09-03,EXPENSE,,-2.00,SGD,Unheard of\n")
+    with session_scope() as session:
+        # Nothing suggests a category for line 4, so it is left out
+        assert cli.import_csv(session, str(path), account.account_id) == (2, 0, [4])
+        category_id = session.query(Transaction.category_id).filter_by(
+            account_id=account.account_id, description="GRAB *TRIP 5678").scalar()
+        assert category_id == account.categories['Transport']
+
+    # Nor are suggestions below MIN_PROBABILITY applied
+    monkeypatch.setattr(classifier_module, 'MIN_PROBABILITY', 1.01)
+    path.write_text("Date,Type,Category,Amount,Currency,Description\n"
+                    "2024-09-04,EXPENSE,,-9.00,SGD,GRAB *TRIP 91\n")
+    with session_scope() as session:
+        assert cli.import_csv(session, str(path), account.account_id) == (0, 0, [2])
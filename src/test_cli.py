@@ -0,0 +1,66 @@
+import io
+import os
+import subprocess
+import sys
+import pytest
+from datetime import datetime
+from models import session_scope, Account, Transaction
+import cli
+
+USERNAME = 'cli_test'
+
+@pytest.fixture
+def account_id(make_account):
+    # 100.00 of the balance is an opening amount with no transaction
+    return make_account(USERNAME, balance=70.0, transactions=[
+        {'date': datetime(2024, 5, day), 'amount': amount, 'description': f"item {day}"}
+        for day, amount in ((1, -10.0), (2, -20.0))
+    ]).account_id
+
+def run(*argv):
+    out = io.StringIO()
+    assert cli.main(list(argv), out) == 0
+    return out.getvalue()
+
+def test_csv_export_import_round_trip(account_id, tmp_path):
+    path = tmp_path / 'ledger.csv'
+    run('export', '--user', USERNAME, '--output', str(path))
+    assert path.read_text().splitlines()[0] == "Date,Type,Category,Amount,Currency,Description"
+
+    category = path.read_text().splitlines()[1].split(',')[2]
+    with path.open('a') as file:
+        file.write(f"2024-05-03,EXPENSE,{category},-30.00,SGD,item 3\n")
+    # The exported rows are already in the ledger
+    assert run('import', str(path), '--account', str(account_id)) == "Imported 1 transactions, skipped 2 duplicates\n"
+    with session_scope() as session:
+        assert session.query(Transaction).filter_by(account_id=account_id).count() == 3
+        # The import adds to the balance rather than resetting it from the transactions
+        assert session.get(Account, account_id).balance == pytest.approx(40.0)
+    assert f"{USERNAME}\t{account_id}\tDefault Account\tSGD\t40.00" in run('balance', '--user', USERNAME)
+
+def test_bad_rows_are_reported_not_imported(account_id, tmp_path, capsys):
+    path = tmp_path / 'bad.csv'
+    path.write_text("Date,Type,Category,Amount,Currency,Description\n2024-05-03,EXPENSE,Nope,-1,SGD,\n")
+    assert cli.main(['import', str(path), '--account', str(account_id)], io.StringIO()) == 1
+    assert "bad.csv:2" in capsys.readouterr().err
+    with session_scope() as session:
+        assert session.query(Transaction).filter_by(account_id=account_id).count() == 2
+
+def test_does_not_import_qt(account_id):
+    code = ("import sys, cli; cli.main(['rates']); "
+            "sys.exit(any(name.startswith('PyQt6') or name == 'pandas' for name in sys.modules))")
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(cli.__file__),
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert "SGD\tUSD" in result.stdout
+
+def test_read_only_commands_skip_sqlalchemy_on_sqlite(account_id, monkeypatch):
+    code = ("import sys, cli; cli.main(['balance', '--user', sys.argv[1]]); cli.main(['rates']); "
+            "sys.exit('sqlalchemy' in sys.modules)")
+    result = subprocess.run([sys.executable, '-c', code, USERNAME], cwd=os.path.dirname(cli.__file__),
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    # Same output as through SQLAlchemy
+    expected = run('balance', '--user', USERNAME) + run('rates')
+    monkeypatch.setattr(cli, '_read_only_sqlite', lambda: None)
+    assert run('balance', '--user', USERNAME) + run('rates') == expected == result.stdout
@@ -0,0 +1,87 @@
+import pytest
+from datetime import datetime
+from sqlalchemy.orm import sessionmaker
+from models import (ENGINE, Base, Session, create_db_engine, init_db, Account, Category, Transaction,
+                    TransactionType, User)
+
+pytest.importorskip('pyarrow')
+from columnar import export_all, import_reference_data, import_transactions, load_transactions
+
+USERNAME = 'columnar_test'
+LEDGER = [
+    {'date': datetime(2023, 12, 30), 'amount': -4.5, 'category': 'Food', 'description': "Coffee"},
+    {'date': datetime(2023, 12, 30), 'amount': -4.5, 'category': 'Food', 'description': "Coffee"},
+    {'date': datetime(2024, 1, 2), 'amount': -12.0, 'category': 'Transport', 'description': "Grab"},
+    {'date': datetime(2024, 1, 25), 'amount': 3000.0, 'category': 'Salary', 'description': "Pay",
+     'type': TransactionType.INCOME},
+]
+
+@pytest.fixture
+def export(make_account, tmp_path):
+    """Export directory, and a filter for this test's rows in the shared database"""
+    ids = make_account(USERNAME, balance=sum(row['amount'] for row in LEDGER), transactions=LEDGER)
+    export_all(ENGINE, str(tmp_path / 'export'))
+    return str(tmp_path / 'export'), [('account_id', '=', ids.account_id)]
+
+def ledger(session, username):
+    return sorted(
+        (row.date, row.amount, row.description, row.category.name)
+        for row in session.query(Transaction).join(User).filter(User.username == username)
+    )
+
+def test_reimport_into_the_same_database_skips_everything(export):
+    export_dir, filters = export
+    frame = load_transactions(export_dir, years=[2024], filters=filters)
+    assert sorted(frame['amount_minor']) == [-1200, 300000]
+    init_db()
+    session = Session()
+    assert import_transactions(session, export_dir, filters) == (0, len(LEDGER))
+    session.rollback()
+    Session.remove()
+
+def test_import_maps_ids_into_another_database(export, tmp_path):
+    export_dir, filters = export
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'other.db'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    # Categories in another order and an unrelated transaction holding the
+    # exported ids, so nothing lines up by id
+    session.add_all([Category(name=name, type=TransactionType.EXPENSE) for name in ('Utilities', 'Transport')])
+    other = User(username='someone_else', email='else@example.com', password='x')
+    target = User(username=USERNAME, email=f"{USERNAME}@example.com", password='x')
+    session.add_all([other, Account(name="Default Account", currency='SGD', user=other, balance=0.0),
+                     target, Account(name="Default Account", currency='SGD', user=target, balance=100.0)])
+    session.flush()
+    [other_account] = other.accounts
+    for _ in range(10):
+        session.add(Transaction(user_id=other.id, account_id=other_account.id, date=datetime(2020, 1, 1),
+                                type=TransactionType.EXPENSE, category_id=1, amount=-1.0, currency='SGD',
+                                description="unrelated"))
+    session.commit()
+
+    import_reference_data(session, export_dir)
+    # One row per batch: the two identical coffees still both come across
+    assert import_transactions(session, export_dir, filters, batch_size=1) == (len(LEDGER), 0)
+    session.commit()
+    assert ledger(session, USERNAME) == ledger(Session(), USERNAME)
+    Session.remove()
+    [account] = target.accounts
+    session.refresh(account)
+    # Added to the balance it had, which isn't reset from the transactions
+    assert account.balance == pytest.approx(100.0 + sum(row['amount'] for row in LEDGER))
+    assert session.query(Transaction).filter_by(account_id=other_account.id).count() == 10
+
+    assert import_transactions(session, export_dir, filters) == (0, len(LEDGER))
+    session.close()
+    engine.dispose()
+
+def test_unknown_account_is_an_error(export, tmp_path):
+    export_dir, filters = export
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'empty.db'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    import_reference_data(session, export_dir)
+    with pytest.raises(ValueError, match="same username and name"):
+        import_transactions(session, export_dir, filters)
+    session.close()
+    engine.dispose()
@@ -0,0 +1,159 @@
+import os
+import pytest
+from datetime import datetime
+from models import Session, SessionFactory, Account, Transaction, Category, TransactionType, ExchangeRate
+from classifier import ledger_checksum
+from commands import (CommandLog, AddTransaction, DeleteTransaction, EditTransaction,
+                      CurrencyChange, RateChange)
+
+USERNAME = 'commands_test'
+
+@pytest.fixture
+def ids(make_account):
+    return make_account(USERNAME, balance=100.0)[:3]
+
+def expense(ids, amount):
+    user_id, account_id, category_id = ids
+    return {'user_id': user_id, 'account_id': account_id, 'date': datetime(2024, 3, 1),
+            'type': TransactionType.EXPENSE, 'category_id': category_id,
+            'amount': amount, 'currency': 'SGD', 'description': ""}
+
+def test_undo_redo_round_trip(ids):
+    _, account_id, _ = ids
+    session = Session()
+    log = CommandLog(session)
+    add = log.execute(AddTransaction(expense(ids, -30.0), -30.0))
+    transaction = session.get(Transaction, add.transaction_id)
+    log.execute(EditTransaction(transaction, {'amount': -45.0}, -15.0))
+    log.execute(CurrencyChange(session.get(Account, account_id), 'USD', 100.0))
+    assert session.get(Account, account_id).balance == pytest.approx(100.0)
+    assert session.get(Account, account_id).currency == 'USD'
+
+    log.undo()
+    assert session.get(Account, account_id).balance == pytest.approx(55.0)
+    log.undo()
+    assert session.get(Transaction, add.transaction_id).amount == -30.0
+    log.undo()
+    assert session.get(Transaction, add.transaction_id) is None
+    assert session.get(Account, account_id).balance == pytest.approx(100.0)
+    assert log.undo() is None
+
+    log.redo()
+    log.redo()
+    # Redo brings the row back under its original id
+    assert session.get(Transaction, add.transaction_id).amount == -45.0
+    assert session.get(Account, account_id).balance == pytest.approx(55.0)
+
+    log.execute(DeleteTransaction(session.get(Transaction, add.transaction_id), 45.0))
+    assert not log.can_redo
+    log.undo()
+    assert session.get(Transaction, add.transaction_id).amount == -45.0
+
+def insert_elsewhere(values):
+    """Add a row outside the command log, as another window or the CLI would"""
+    session = SessionFactory()
+    transaction = Transaction(**values)
+    session.add(transaction)
+    session.commit()
+    transaction_id = transaction.id
+    session.close()
+    return transaction_id
+
+def test_rows_brought_back_after_their_id_was_reused_get_a_new_one(ids):
+    session = Session()
+    log = CommandLog(session)
+    kept = log.execute(AddTransaction(expense(ids, -1.0), -1.0))
+    deleted_id = kept.transaction_id + 1
+    log.execute(AddTransaction(expense(ids, -2.0), -2.0))
+    log.execute(DeleteTransaction(session.get(Transaction, deleted_id), 2.0))
+    # SQLite hands the highest id out again
+    assert insert_elsewhere(expense(ids, -7.0)) == deleted_id
+    log.undo()
+    delete = log.redo_stack[-1]
+    assert delete.transaction_id != deleted_id
+    assert session.get(Transaction, delete.transaction_id).amount == -2.0
+    # The add before the delete follows the row to its new id
+    log.undo()
+    assert session.get(Transaction, delete.transaction_id) is None
+    assert session.get(Transaction, deleted_id).amount == -7.0
+
+    # Redoing an add whose id was taken: the edit after it follows
+    added = log.execute(AddTransaction(expense(ids, -3.0), -3.0))
+    log.execute(EditTransaction(session.get(Transaction, added.transaction_id), {'amount': -4.0}, -1.0))
+    log.undo()
+    log.undo()
+    assert insert_elsewhere(expense(ids, -8.0)) == added.transaction_id
+    log.redo()
+    log.redo()
+    assert session.get(Transaction, added.transaction_id).amount == -4.0
+    assert session.get(Transaction, deleted_id).amount == -7.0
+    assert session.query(Transaction).filter_by(account_id=ids[1], amount=-8.0).count() == 1
+
+def test_undeleting_a_row_whose_twin_was_added_meanwhile_renumbers_it(ids):
+    session = Session()
+    log = CommandLog(session)
+    added = log.execute(AddTransaction(expense(ids, -6.0), -6.0))
+    fingerprint = session.get(Transaction, added.transaction_id).fingerprint
+    log.execute(DeleteTransaction(session.get(Transaction, added.transaction_id), 6.0))
+    twin_id = insert_elsewhere(expense(ids, -6.0))
+    with SessionFactory() as other:
+        assert other.get(Transaction, twin_id).fingerprint == fingerprint
+    log.undo()
+    restored = session.get(Transaction, log.redo_stack[-1].transaction_id)
+    assert restored.amount == -6.0
+    assert restored.fingerprint != fingerprint
+    assert session.query(Transaction).filter_by(account_id=ids[1], amount=-6.0).count() == 2
+
+def test_rate_change_undo_removes_new_pair(ids):
+    session = Session()
+    log = CommandLog(session)
+    session.query(ExchangeRate).filter_by(from_currency='SGD', to_currency='JPY').delete()
+    session.commit()
+    log.execute(RateChange('SGD', 'JPY', None, 110.0))
+    assert session.query(ExchangeRate.rate).filter_by(from_currency='SGD', to_currency='JPY').scalar() == 110.0
+    log.undo()
+    assert session.query(ExchangeRate).filter_by(from_currency='SGD', to_currency='JPY').first() is None
+
+def test_window_applies_deltas_without_reloading(ids, monkeypatch):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    QtWidgets = pytest.importorskip('PyQt6.QtWidgets')
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    import account
+
+    errors = []
+    monkeypatch.setattr(account.QMessageBox, 'critical', lambda *args: errors.append(args))
+    monkeypatch.setattr(account.QMessageBox, 'warning', lambda *args: errors.append(args))
+    window = account.AccountWindow(USERNAME)
+    monkeypatch.setattr(window.context, 'load_transactions',
+                        lambda offset=0: pytest.fail("account was reloaded"))
+
+    category = window.session.query(Category).filter_by(id=ids[2]).one()
+    window.type_combo.setCurrentText("Expense")
+    window.category_combo.addItem(category.name)
+    window.category_combo.setCurrentText(category.name)
+    classifier = window.get_classifier()
+    for amount in ("20", "5"):
+        window.amount_input.setText(amount)
+        window.description_input.setText(f"kopi {amount}")
+        window.category_combo.setCurrentText(category.name)
+        window.add_transaction()
+    table = window.transactions_table
+    assert [window.running_balance_at(row) for row in range(table.rowCount())] == [-20.0, -25.0]
+
+    table.setCurrentCell(0, 0)
+    window.delete_transaction()
+    assert table.rowCount() == 1
+    assert window.running_balance_at(0) == -5.0
+    assert window.balance == pytest.approx(95.0)
+
+    window.undo()
+    assert table.rowCount() == 2
+    assert [window.running_balance_at(row) for row in range(2)] == [-20.0, -25.0]
+    assert window.balance == pytest.approx(75.0)
+    window.redo()
+    assert table.rowCount() == 1
+    # The classifier followed every add, delete, undo and redo
+    assert classifier.checksum == ledger_checksum(window.session, window.user_id,
+                                                  classifier.last_transaction_id)
+    assert not errors
+    window.close()
@@ -0,0 +1,71 @@
+import pytest
+from datetime import datetime
+from sqlalchemy import text
+from models import (Base, create_db_engine, session_scope, add_fingerprint_column, find_duplicate,
+                    transaction_fingerprint, assign_fingerprints, Transaction, TransactionType)
+
+USERNAME = 'fingerprint_test'
+
+@pytest.fixture
+def account(make_account):
+    ids = make_account(USERNAME)
+    return {'user_id': ids.user_id, 'account_id': ids.account_id, 'category_id': ids.category_id}
+
+def values(account, day=1, amount=-4.5, description="Coffee Bean #12"):
+    return dict(account, date=datetime(2024, 7, day), type=TransactionType.EXPENSE,
+                amount=amount, currency='SGD', description=description)
+
+def test_repeats_are_numbered_and_reimports_skipped(account):
+    with session_scope() as session:
+        # Two identical coffees on one day are both kept
+        session.add_all([Transaction(**values(account)), Transaction(**values(account))])
+        session.flush()
+        fingerprints = [fingerprint for fingerprint, in session.query(Transaction.fingerprint)
+                        .filter_by(account_id=account['account_id'])]
+        assert len(set(fingerprints)) == 2
+        assert transaction_fingerprint(values(account)) in fingerprints
+        # Description formatting doesn't matter, the day does
+        assert find_duplicate(session, values(account, description="coffee-bean 12")) is not None
+        assert find_duplicate(session, values(account, day=2)) is None
+
+        # A statement with the same two coffees and one new line adds only the new line
+        statement = [values(account), values(account), values(account, amount=-12.0)]
+        rows, duplicates = assign_fingerprints(session.connection(), statement, skip_duplicates=True)
+        assert [row['amount'] for row in rows] == [-12.0]
+        assert len(duplicates) == 2
+
+        # Without skipping, a third coffee is numbered past the stored ones
+        rows, _ = assign_fingerprints(session.connection(), [values(account)])
+        assert rows[0]['fingerprint'] not in fingerprints
+
+def test_edits_refresh_the_fingerprint(account):
+    with session_scope() as session:
+        transaction = Transaction(**values(account))
+        session.add(transaction)
+        session.flush()
+        transaction.amount = -5.0
+        session.flush()
+        assert transaction.fingerprint == transaction_fingerprint(values(account, amount=-5.0))
+
+def test_existing_database_is_backfilled(tmp_path, account):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    Base.metadata.create_all(engine)
+    row = dict(values(account), type='EXPENSE', date='2024-07-01 00:00:00.000000')
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP INDEX ux_transactions_fingerprint")
+        connection.exec_driver_sql("ALTER TABLE transactions DROP COLUMN fingerprint")
+        for _ in range(2):
+            connection.execute(text(
+                "INSERT INTO transactions (user_id, account_id, category_id, date, type, amount, currency, "
+                "description) VALUES (:user_id, :account_id, :category_id, :date, :type, :amount, "
+                ":currency, :description)"
+            ), row)
+
+    add_fingerprint_column(engine)
+    with engine.connect() as connection:
+        fingerprints = [fingerprint for fingerprint, in connection.exec_driver_sql(
+            "SELECT fingerprint FROM transactions ORDER BY id")]
+    assert fingerprints[0] == transaction_fingerprint(values(account))
+    assert len(set(fingerprints)) == 2
+    add_fingerprint_column(engine)  # Already there
+    engine.dispose()
@@ -0,0 +1,60 @@
+import sqlite3
+import config
+from models import create_db_engine
+from maintenance import run_maintenance, MaintenanceScheduler
+
+OPTIONS = dict(config.get_maintenance_options({}), min_free_pages=16)
+
+def fill_and_delete(path, rows=5000):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE IF NOT EXISTS scratch (id INTEGER PRIMARY KEY, payload TEXT)")
+    connection.executemany("INSERT INTO scratch (payload) VALUES (?)", [("x" * 200,)] * rows)
+    connection.commit()
+    connection.execute("DELETE FROM scratch")
+    connection.commit()
+    connection.close()
+
+def pragma(path, name):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute(f"PRAGMA {name}").fetchone()[0]
+    finally:
+        connection.close()
+
+def test_incremental_vacuum_reclaims_space_and_reports(tmp_path):
+    path = str(tmp_path / 'maintained.db')
+    engine = create_db_engine(f"sqlite:///{path}")
+    with engine.connect() as connection:
+        connection.exec_driver_sql("SELECT 1")
+    fill_and_delete(path)
+    assert pragma(path, 'auto_vacuum') == 2
+
+    report = run_maintenance(engine, OPTIONS)
+    steps = {step.name: step.detail for step in report.steps}
+    assert steps['vacuum'].startswith("released")
+    assert steps['analyze'].startswith("ANALYZE")
+    assert 'checkpoint' in steps
+    assert report.reclaimed > 500_000
+    assert pragma(path, 'freelist_count') == 0
+
+    # Below every threshold only the statistics are looked at
+    report = run_maintenance(engine, OPTIONS)
+    assert [step.name for step in report.steps] == ['analyze']
+    engine.dispose()
+
+def test_old_database_is_converted_on_close_only(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    fill_and_delete(path)
+    assert pragma(path, 'auto_vacuum') == 0
+    engine = create_db_engine(f"sqlite:///{path}")
+    scheduler = MaintenanceScheduler(engine, OPTIONS)
+
+    report = scheduler.on_idle()
+    assert "left for close" in report.steps[0].detail
+    assert scheduler.on_idle() is None  # Not due again within the interval
+
+    report = scheduler.on_close()
+    assert report.steps[0].detail.startswith("full VACUUM")
+    assert report.reclaimed > 500_000
+    assert pragma(path, 'auto_vacuum') == 2
+    engine.dispose()
@@ -1,10 +1,10 @@
 import pytest
-from models import init_db, session_scope, User, Account, Transaction, Category, TransactionType
+from models import init_db, session_scope, User, Account, Transaction, Category, TransactionType, DB_PATH
 
 def test_database_initialization():
     # Remove existing test database if present
     import os
-    test_db_path = os.path.join(os.path.dirname(__file__), 'finance_tracker.db')
+    test_db_path = DB_PATH
     if os.path.exists(test_db_path):
         os.remove(test_db_path)
     
@@ -39,7 +39,10 @@ def cleanup():
     yield
     # Cleanup after test
     import os
-    test_db_path = os.path.join(os.path.dirname(__file__), 'finance_tracker.db')
+    from models import Session, ENGINE
+    Session.remove()
+    ENGINE.dispose()  # Don't leave pooled connections on the deleted file
+    test_db_path = DB_PATH
     if os.path.exists(test_db_path):
         os.remove(test_db_path)
 
@@ -0,0 +1,73 @@
+import sqlite3
+import query_cache as query_cache_module
+from models import ENGINE, session_scope, init_db, Category, TransactionType, upsert_exchange_rate
+from query_cache import QueryCache, query_cache, cached_category_id, cached_exchange_rates
+
+def test_lru_eviction_and_stats():
+    cache = QueryCache(maxsize=2)
+    loads = []
+    def load(key):
+        return lambda: loads.append(key) or key.upper()
+    assert cache.get('a', ('t',), load('a')) == 'A'
+    cache.get('b', ('t',), load('b'))
+    cache.get('a', ('t',), load('a'))
+    cache.get('c', ('t',), load('c'))  # evicts b, the least recently used
+    cache.get('b', ('t',), load('b'))
+    assert loads == ['a', 'b', 'c', 'b']
+    cache.bump(['other'])
+    cache.get('b', ('t',), load('b'))
+    cache.bump(['t'])
+    cache.get('b', ('t',), load('b'))
+    assert loads == ['a', 'b', 'c', 'b', 'b']
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['evictions'] == 2
+
+def test_writes_invalidate_cached_queries():
+    init_db()
+    query_cache.clear()
+    with session_scope() as session:
+        name = session.query(Category.name).filter_by(type=TransactionType.EXPENSE).first()[0]
+        category_id = cached_category_id(session, name)
+        assert cached_category_id(session, name) == category_id
+        rates = cached_exchange_rates(session)
+        assert cached_exchange_rates(session) is rates
+    assert query_cache.stats()['hits'] == 2
+
+    with session_scope() as session:
+        # Core upsert, not an ORM flush
+        upsert_exchange_rate(session, 'SGD', 'EUR', 0.5)
+        assert cached_category_id(session, name) == category_id
+        assert ('SGD', 'EUR', 0.5) in [row[:3] for row in cached_exchange_rates(session)]
+        session.add(Category(name='cache_test', type=TransactionType.EXPENSE))
+        session.flush()
+        assert cached_category_id(session, 'cache_test') is not None
+        session.rollback()
+    with session_scope() as session:
+        assert cached_category_id(session, 'cache_test') is None
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(query_cache_module.time, 'monotonic', lambda: now[0])
+    cache = QueryCache(ttl=30)
+    loads = []
+    load = lambda: loads.append(1) or len(loads)
+    assert cache.get('a', ('t',), load) == 1
+    now[0] += 29
+    assert cache.get('a', ('t',), load) == 1
+    now[0] += 1
+    assert cache.get('a', ('t',), load) == 2
+
+def test_commits_by_other_processes_invalidate_cached_queries():
+    init_db()
+    query_cache.clear()
+    with session_scope() as session:
+        upsert_exchange_rate(session, 'SGD', 'JPY', 110.0)
+    with session_scope() as session:
+        assert ('SGD', 'JPY', 110.0) in [row[:3] for row in cached_exchange_rates(session)]
+
+    # A write the engine's event hooks never see, like another process's
+    with sqlite3.connect(ENGINE.url.database) as connection:
+        connection.execute("UPDATE exchange_rates SET rate = 115.0 "
+                           "WHERE from_currency = 'SGD' AND to_currency = 'JPY'")
+    with session_scope() as session:
+        assert ('SGD', 'JPY', 115.0) in [row[:3] for row in cached_exchange_rates(session)]
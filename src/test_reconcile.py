@@ -0,0 +1,88 @@
+import pytest
+from datetime import datetime
+from models import (session_scope, Account, Transaction, Category, TransactionType,
+                    BalanceCheckpoint, ExchangeRate, convert_amount, upsert_exchange_rate)
+from reconcile import Reconciler
+
+@pytest.fixture
+def account_id(make_account):
+    rows = [{'date': datetime(2023, month, day), 'amount': -12.34}
+            for month in range(1, 13) for day in (1, 15)]
+    return make_account('reconcile_test', balance=round(-12.34 * len(rows), 2), transactions=rows).account_id
+
+def add_expense(session, account_id, date, amount, currency='SGD'):
+    account = session.get(Account, account_id)
+    category = session.query(Category).filter_by(type=TransactionType.EXPENSE).first()
+    session.add(Transaction(user_id=account.user_id, account_id=account_id, date=date,
+                            type=TransactionType.EXPENSE, category_id=category.id,
+                            amount=amount, currency=currency, description=""))
+    return account
+
+def test_first_verify_builds_every_month(account_id):
+    with session_scope() as session:
+        [result] = Reconciler(session).verify(account_id)
+    assert result.months == 12
+    assert result.months_resummed == 12
+    assert result.expected_balance == pytest.approx(-296.16)
+    assert result.drift == 0
+
+def test_only_changed_months_are_resummed(account_id):
+    with session_scope() as session:
+        Reconciler(session).verify(account_id)
+    with session_scope() as session:
+        account = add_expense(session, account_id, datetime(2023, 6, 20), -5.0)
+        account.balance -= 5.0
+    with session_scope() as session:
+        [result] = Reconciler(session).verify(account_id)
+        checkpoint = session.query(BalanceCheckpoint)\
+            .filter_by(account_id=account_id, month='2023-06', currency='SGD').one()
+        assert checkpoint.count == 3
+    assert result.months_resummed == 1
+    assert result.drift == 0
+
+def test_repair_fixes_drift(account_id):
+    with session_scope() as session:
+        Reconciler(session).verify(account_id)
+        # Balance subtracted in the wrong currency, as the old delete did
+        add_expense(session, account_id, datetime(2024, 1, 5), -100.0, currency='USD')
+        session.get(Account, account_id).balance -= 100.0
+    with session_scope() as session:
+        reconciler = Reconciler(session)
+        [result] = reconciler.verify(account_id)
+        assert reconciler.is_drifted(result)
+        assert result.months_resummed == 1
+        [repaired] = reconciler.repair(account_id)
+        assert repaired.account_id == account_id
+    with session_scope() as session:
+        reconciler = Reconciler(session)
+        [result] = reconciler.verify(account_id)
+        assert not reconciler.is_drifted(result)
+        assert result.months_resummed == 0
+
+def test_rate_changes_are_not_drift(account_id):
+    with session_scope() as session:
+        Reconciler(session).verify(account_id)
+        # Booked at today's rate, as the UI does
+        add_expense(session, account_id, datetime(2024, 1, 5), -100.0, currency='USD')
+        session.get(Account, account_id).balance -= convert_amount(session, 100.0, 'USD', 'SGD')
+    rate = None
+    try:
+        with session_scope() as session:
+            rate = session.query(ExchangeRate.rate).filter_by(from_currency='USD', to_currency='SGD').scalar()
+            upsert_exchange_rate(session, 'USD', 'SGD', rate + 0.17)
+        with session_scope() as session:
+            [result] = Reconciler(session).verify(account_id)
+            assert result.drift == 0
+            assert result.expected_balance == pytest.approx(-296.16 - round(100 * rate, 2))
+
+            # A new currency converts the balance and the booked totals alike
+            account = session.get(Account, account_id)
+            account.balance = convert_amount(session, account.balance, 'SGD', 'USD')
+            account.currency = 'USD'
+        with session_scope() as session:
+            [result] = Reconciler(session).verify(account_id)
+            assert abs(result.drift) <= 0.01 * result.months
+    finally:
+        if rate is not None:
+            with session_scope() as session:
+                upsert_exchange_rate(session, 'USD', 'SGD', rate)
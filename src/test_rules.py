@@ -0,0 +1,71 @@
+import pytest
+from models import Session, session_scope, Transaction, TransactionType, RuleKind
+from rules import SubstringMatcher, RegexMatcher, RuleSet, RuleRow, add_rule, delete_rule, load_rules, required_literal
+import cli
+
+USERNAME = 'rules_test'
+
+def rule(rule_id, pattern, category_id, kind=RuleKind.CONTAINS, priority=0, type=TransactionType.EXPENSE):
+    return RuleRow(rule_id, kind, pattern, priority, category_id, f"category {category_id}", type)
+
+def test_matcher_finds_overlapping_patterns_in_one_pass():
+    matcher = SubstringMatcher([("he", 3, 'he'), ("she", 2, 'she'), ("hers", 1, 'hers'), ("his", 4, 'his')])
+    assert matcher.search("USHERS") == (1, 'hers')
+    assert matcher.search("ushe") == (2, 'she')
+    assert matcher.search("ahis") == (4, 'his')
+    assert matcher.search("nothing") is None
+    assert SubstringMatcher([]).search("anything") is None
+
+def test_regex_prefilter_literals():
+    assert required_literal(r"^sp\s+group") == "group"
+    assert required_literal(r"colou?r") == "colo"
+    assert required_literal(r"x(?:abc)?yz[0-9]") == "yz"
+    assert required_literal(r"ref\d{4,}x") == "ref"  # Repeat counts aren't text
+    assert required_literal(r"a{b") == "a{b"
+    assert required_literal(r"refund|cashback") is None  # Joined into the alternation instead
+
+def test_overlapping_regex_matches_keep_the_best_rank():
+    # 'x1' matches first and would hide '1234' from a single finditer pass
+    matcher = RegexMatcher([(r'\d{4}', 0, 'HIGH'), (r'[a-z]\d', 1, 'LOW')])
+    assert matcher.search('x1234') == (0, 'HIGH')
+    assert matcher.search('x12') == (1, 'LOW')
+    assert matcher.search('1') is None
+
+def test_priority_type_and_regex_rules():
+    rule_set = RuleSet([
+        rule(1, "grab", 10),
+        rule(2, "grab food", 11, priority=5),
+        rule(3, r"^sp\s+group", 12, kind=RuleKind.REGEX),
+        rule(4, "salary", 20, type=TransactionType.INCOME),
+        rule(5, r"refund|cashback", 21, kind=RuleKind.REGEX, type=TransactionType.INCOME),
+    ])
+    assert rule_set.match("GRAB *TRIP 1234", TransactionType.EXPENSE) == 10
+    assert rule_set.match("GrabFood: grab food order", TransactionType.EXPENSE) == 11
+    assert rule_set.match("SP  Group electricity", TransactionType.EXPENSE) == 12
+    assert rule_set.match("paid to sp group", TransactionType.EXPENSE) is None
+    # Income rules don't categorize expenses
+    assert rule_set.match("Salary advance", TransactionType.EXPENSE) is None
+    assert rule_set.match_many([("ACME SALARY", TransactionType.INCOME),
+                                ("Card cashback", TransactionType.INCOME)]) == [20, 21]
+    assert rule_set.match("Salary advance") == 20
+
+def test_rules_are_stored_and_used_by_import(make_account, tmp_path):
+    user_id, account_id, _, categories = make_account(USERNAME)
+    with session_scope() as session:
+        with pytest.raises(ValueError, match="capturing groups"):
+            add_rule(session, user_id, r"(grab)", categories['Transport'], RuleKind.REGEX)
+        add_rule(session, user_id, "grab", categories['Food'])
+        add_rule(session, user_id, "grab", categories['Transport'])  # Replaces the first
+        stale = add_rule(session, user_id, "netflix", categories['Entertainment'])
+        delete_rule(session, user_id, stale.id)
+        assert len(load_rules(session, user_id)) == 1
+    Session.remove()
+
+    path = tmp_path / 'import.csv'
+    path.write_text("Date,Type,Category,Amount,Currency,Description\n"
+                    "2024-10-01,EXPENSE,,-9.00,SGD,GRAB *TRIP 42\n")
+    with session_scope() as session:
+        assert cli.import_csv(session, str(path), account_id) == (1, 0, [])
+        assert session.query(Transaction.category_id).filter_by(account_id=account_id).scalar() \
+            == categories['Transport']
+    Session.remove()
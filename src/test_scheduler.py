@@ -0,0 +1,47 @@
+import pytest
+from datetime import datetime
+from models import session_scope, Account, Transaction, BalanceCheckpoint
+from scheduler import CronRule, add_template, run_due
+
+@pytest.fixture
+def account_ids(make_account):
+    return make_account('scheduler_test', balance=1000.0)[:3]
+
+def test_cron_rule_fields():
+    rule = CronRule('30 9 1,15 * *')
+    assert list(rule.occurrences(datetime(2024, 1, 1), datetime(2024, 1, 31))) == [
+        datetime(2024, 1, 1, 9, 30), datetime(2024, 1, 15, 9, 30)
+    ]
+    # Mondays, every other month
+    mondays = list(CronRule('0 0 * */2 1').occurrences(datetime(2024, 1, 1), datetime(2024, 3, 10)))
+    assert [moment.day for moment in mondays] == [1, 8, 15, 22, 29, 4]
+    assert all(moment.weekday() == 0 for moment in mondays)
+    # A stepped * still narrows the other day field, as in Vixie cron: odd days that are Mondays
+    odd_mondays = CronRule('0 0 */2 * 1').occurrences(datetime(2024, 1, 1), datetime(2024, 1, 31))
+    assert [moment.day for moment in odd_mondays] == [1, 15, 29]
+    with pytest.raises(ValueError):
+        CronRule('0 25 * * *')
+    with pytest.raises(ValueError):
+        CronRule('monthly')
+
+def test_catch_up_in_one_run(account_ids):
+    user_id, account_id, category_id = account_ids
+    with session_scope() as session:
+        add_template(session, user_id, account_id, category_id, -100.0, 'SGD', '0 0 1 * *',
+                     description="Rent", start_date=datetime(2023, 1, 1))
+    with session_scope() as session:
+        result = run_due(session, now=datetime(2023, 12, 15), user_id=user_id)
+        assert (result.templates, result.inserted, result.accounts) == (1, 12, 1)
+        assert session.get(Account, account_id).balance == pytest.approx(-200.0)
+        dirty = session.query(BalanceCheckpoint).filter_by(account_id=account_id, dirty=True).count()
+        assert dirty == 12
+
+    with session_scope() as session:
+        assert run_due(session, now=datetime(2023, 12, 31), user_id=user_id).inserted == 0
+        result = run_due(session, now=datetime(2024, 2, 1), user_id=user_id)
+        assert result.inserted == 2
+        dates = [date for date, in session.query(Transaction.date)
+                 .filter_by(account_id=account_id).order_by(Transaction.date)]
+    assert dates[0] == datetime(2023, 1, 1)
+    assert dates[-1] == datetime(2024, 2, 1)
+    assert len(dates) == len(set(dates)) == 14
@@ -0,0 +1,28 @@
+from sqlalchemy import create_engine, text
+from sql_instrumentation import SqlInstrumentation, normalize
+
+def test_counts_n_plus_one_and_slow_log(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'instrumented.db'}")
+    log_path = tmp_path / 'slow.log'
+    instrumentation = SqlInstrumentation(engine, slow_query_ms=0, slow_log_path=str(log_path),
+                                         n_plus_one_threshold=5)
+    instrumentation.install()
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)"))
+        connection.execute(text("INSERT INTO items (name) VALUES ('a'), ('b')"))
+        for item_id in range(8):
+            connection.execute(text("SELECT name FROM items WHERE id = :id"), {'id': item_id})
+    instrumentation.uninstall()
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+    [top] = [row for row in instrumentation.report() if row['statement'].startswith('SELECT name')]
+    assert top['count'] == 8
+    assert top['top_call_site'].startswith('test_sql_instrumentation.py:')
+    [(site, statement, flagged)] = instrumentation.n_plus_one_suspects()
+    assert statement == top['statement'] and flagged == 1
+    assert instrumentation.total_queries == 10
+    assert 'SEARCH items USING INTEGER PRIMARY KEY' in log_path.read_text()
+
+def test_normalize_collapses_in_lists():
+    assert normalize("SELECT *\n  FROM t WHERE id IN (?, ?, ?)") == normalize("SELECT * FROM t WHERE id IN (?,?)")
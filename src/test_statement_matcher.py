@@ -0,0 +1,53 @@
+import pytest
+from datetime import date, datetime
+from models import Session, TransactionType
+from statement_matcher import StatementLine, TransactionIndex, match_statement, normalize_description
+from transaction_rows import TransactionRow
+
+USERNAME = 'matcher_test'
+LEDGER = [
+    (datetime(2024, 4, 1), -12.50, "Coffee Bean"),
+    (datetime(2024, 4, 3), -40.00, "Grocer"),
+    (datetime(2024, 4, 10), -8.00, "Taxi"),
+    (datetime(2024, 4, 10), -8.00, "Bus pass"),
+    (datetime(2024, 4, 20), 3000.00, "Salary"),
+    (datetime(2024, 4, 24), -99.00, "Never on the statement"),
+]
+
+@pytest.fixture
+def account_id(make_account):
+    return make_account(USERNAME, transactions=[
+        {'date': when, 'amount': amount, 'description': description} for when, amount, description in LEDGER
+    ]).account_id
+
+def test_match_within_tolerances(account_id):
+    lines = [
+        StatementLine(2, date(2024, 4, 2), -12.50, 'SGD', "COFFEE-BEAN #1"),   # a day late
+        StatementLine(3, date(2024, 4, 3), -40.01, 'SGD', "GROCER"),           # a cent off
+        StatementLine(4, date(2024, 4, 10), -8.00, 'SGD', "CARD PAYMENT"),     # taxi or bus?
+        StatementLine(5, date(2024, 4, 21), 3000.00, 'SGD', "SALARY"),
+        StatementLine(6, date(2024, 4, 25), -5.00, 'SGD', "Unknown"),
+    ]
+    session = Session()
+    result = match_statement(session, account_id, lines, day_tolerance=1, amount_tolerance=0.01)
+    session.close()
+
+    assert {match.line.line: match.transaction.description for match in result.matched} == {
+        2: "Coffee Bean", 3: "Grocer", 5: "Salary"
+    }
+    [(line, candidates)] = result.ambiguous
+    assert line.line == 4
+    assert sorted(row.description for row in candidates) == ["Bus pass", "Taxi"]
+    assert [line.line for line in result.unmatched] == [6]
+    assert sorted(row.description for row in result.unmatched_transactions) == [
+        "Bus pass", "Never on the statement", "Taxi"
+    ]
+
+def test_identical_candidates_are_interchangeable():
+    rows = [TransactionRow(row_id, datetime(2024, 1, 5), TransactionType.EXPENSE, 1, -3.0, 'SGD',
+                           "Toll", 1, 1) for row_id in (1, 2)]
+    index = TransactionIndex(rows, day_tolerance=0, amount_tolerance_minor=0)
+    line = StatementLine(2, date(2024, 1, 5), -3.0, 'SGD', "toll")
+    assert len(index.candidates(line)) == 2
+    assert index.candidates(line._replace(date=date(2024, 1, 6))) == []
+    assert normalize_description("POS  Coffee-Bean #12") == "pos coffee bean 12"
@@ -0,0 +1,69 @@
+import os
+import sqlite3
+import pytest
+from sqlalchemy.engine import URL
+from sqlalchemy.exc import OperationalError
+from datetime import datetime
+from models import read_only_engine, session_scope, TransactionType
+from statements import month_range, plan_jobs, generate_statements
+
+USERNAMES = ('statement_a', 'statement_b')
+
+@pytest.fixture
+def users(make_account):
+    for index, username in enumerate(USERNAMES):
+        make_account(username, transactions=[
+            {'date': date, 'amount': amount, 'category': category, 'description': description,
+             'type': TransactionType.INCOME if amount > 0 else TransactionType.EXPENSE}
+            for date, amount, category, description in (
+                (datetime(2024, 4, 28), 1000.0, 'Salary', "April pay"),
+                (datetime(2024, 5, 2), -12.5, 'Food', "Lunch <b>"),
+                (datetime(2024, 5, 9), -40.0 * (index + 1), 'Transport', "Grab"),
+                (datetime(2024, 6, 1), -99.0, 'Food', "Next month"))
+        ])
+
+def test_statements_are_generated_in_worker_processes(users, tmp_path):
+    start, end = month_range('2024-05')
+    assert (start, end) == (datetime(2024, 5, 1), datetime(2024, 6, 1))
+    with session_scope() as session:
+        jobs = plan_jobs(session, start, end, str(tmp_path), 'html', usernames=list(USERNAMES))
+        jobs += plan_jobs(session, start, end, str(tmp_path), 'pdf', per='user', usernames=['statement_a'])
+    assert len(jobs) == 3
+
+    results = list(generate_statements(jobs, workers=2))
+    assert [result.error for result in results] == [None] * 3
+    assert all(result.transactions == 2 and result.seconds > 0 for result in results)
+
+    page = (tmp_path / os.path.basename(jobs[1].path)).read_text()
+    # Opening 1000.00, then -12.50 and -80.00
+    assert "1,000.00" in page and "907.50" in page
+    assert "Lunch &lt;b&gt;" in page and "Next month" not in page
+    assert "data:image/png;base64," in page
+    assert (tmp_path / os.path.basename(jobs[2].path)).read_bytes().startswith(b"%PDF")
+
+def test_failures_are_reported_per_job(users, tmp_path):
+    with session_scope() as session:
+        [job] = plan_jobs(session, *month_range('2024-05'), str(tmp_path), usernames=['statement_b'])
+    blocked = job._replace(path=str(tmp_path))  # A directory can't be written as a file
+    [result] = generate_statements([blocked], workers=0)
+    assert result.error is not None
+
+    # Workers' connections can't write
+    engine = read_only_engine()
+    with engine.connect() as connection, pytest.raises(OperationalError, match="readonly"):
+        connection.exec_driver_sql("DELETE FROM transactions")
+    engine.dispose()
+
+def test_read_only_engine_opens_paths_with_uri_characters(tmp_path):
+    directory = tmp_path / "data #1 %20"
+    directory.mkdir()
+    path = directory / "ledger.db"
+    connection = sqlite3.connect(str(path))
+    connection.execute("CREATE TABLE marker (value TEXT)")
+    connection.execute("INSERT INTO marker VALUES ('here')")
+    connection.commit()
+    connection.close()
+    engine = read_only_engine(URL.create('sqlite', database=str(path)))
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("SELECT value FROM marker").scalar() == 'here'
+    engine.dispose()
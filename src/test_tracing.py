@@ -0,0 +1,46 @@
+import json
+import pytest
+from sqlalchemy import create_engine, text
+from tracing import LatencyHistogram, Tracer, NULL_SPAN, bucket_index, bucket_lower_bound
+import tracing
+
+def test_histogram_buckets_are_within_two_percent():
+    for value in (0, 1, 127, 128, 255, 1000, 123456, 10**9):
+        low = bucket_lower_bound(bucket_index(value))
+        assert low <= value and value - low <= max(1, value / 64)
+    histogram = LatencyHistogram()
+    for value in range(1, 10001):
+        histogram.record(value)
+    assert histogram.percentile(50) == pytest.approx(5000, rel=0.02)
+    assert histogram.percentile(99) == pytest.approx(9900, rel=0.02)
+    assert histogram.to_dict()['max_us'] == 10000
+    assert len(histogram.counts) < 600
+
+def test_nested_spans_and_db_time(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'traced.db'}")
+    tracer = Tracer()
+    monkeypatch.setattr(tracing, 'tracer', tracer)
+
+    @tracing.traced()
+    def add_transaction(self):
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        with tracer.span('render'):
+            pass
+
+    assert tracer.span('render') is NULL_SPAN
+    add_transaction(None)
+    assert tracer.histograms == {}
+
+    tracer.enable(engine)
+    # Extra signal arguments (like clicked's checked flag) are dropped
+    add_transaction(None, False)
+    add_transaction(None)
+    tracer.disable()
+    add_transaction(None)
+
+    spans = tracer.snapshot()
+    assert set(spans) == {'add_transaction', 'add_transaction/db', 'add_transaction/render'}
+    assert spans['add_transaction']['count'] == 2
+    path = tracer.dump(str(tmp_path / 'traces.json'))
+    assert json.load(open(path))['spans']['add_transaction/db']['count'] == 2
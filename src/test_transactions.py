@@ -0,0 +1,77 @@
+import pytest
+import transactions
+from models import TransactionType
+from transactions import TransactionManager
+
+def test_balances_follow_adds_edits_and_deletes():
+    manager = TransactionManager()
+    income = manager.add_transaction("100.10", 'SGD', TransactionType.INCOME, 1)
+    expense = manager.add_transaction("40.05", 'SGD', TransactionType.EXPENSE, 2)
+    manager.add_transaction("10", 'USD', TransactionType.EXPENSE, 2)
+    assert manager.get_balance('SGD') == pytest.approx(60.05)
+    assert manager.get_balance('USD') == pytest.approx(-10.0)
+    assert manager.get_balance('EUR') == 0.0
+
+    # Moving a transaction to another currency moves it between totals
+    record = manager.edit_transaction(expense.id, "5", 'USD', TransactionType.EXPENSE, 3)
+    assert (record.amount, record.currency, record.category_id) == (-5.0, 'USD', 3)
+    assert manager.get_balance('SGD') == pytest.approx(100.10)
+    assert manager.get_balance('USD') == pytest.approx(-15.0)
+
+    deleted = manager.delete_transaction(income.id)
+    assert deleted.type == TransactionType.INCOME
+    assert manager.get_balance('SGD') == 0.0
+    assert [t.amount for t in manager.get_transactions()] == [-5.0, -10.0]
+    with pytest.raises(ValueError):
+        manager.edit_transaction(income.id, "1", 'SGD', TransactionType.INCOME, 1)
+
+def test_ids_stay_valid_across_bulk_deletes_and_compaction(monkeypatch):
+    monkeypatch.setattr(transactions, 'COMPACT_MIN_DELETED', 10)
+    manager = TransactionManager()
+    ids = [manager.add_transaction("1", 'SGD', TransactionType.EXPENSE, 1).id
+           for _ in range(100)]
+    assert manager.bulk_delete(ids[:30] + [999]) == 30
+    # Compacted: only live transactions remain in the arrays
+    assert len(manager) == 70
+    assert manager.nbytes() == 30 * 70
+    assert manager.get_balance('SGD') == pytest.approx(-70.0)
+
+    assert manager.bulk_edit({ids[50]: {'amount': 20.0, 'type': TransactionType.INCOME},
+                              ids[99]: {'currency': 'USD'}}) == 2
+    assert manager.get_transaction(ids[50]).amount == 20.0
+    assert manager.get_balance('SGD') == pytest.approx(-68.0 + 20.0)
+    assert manager.get_balance('USD') == pytest.approx(-1.0)
+    assert [t.id for t in manager.get_transactions()] == ids[30:]
+    with pytest.raises(ValueError):
+        manager.bulk_edit({ids[0]: {'amount': 5.0}})
+    assert ids[0] not in manager and ids[30] in manager
+
+def test_explicit_ids_must_increase():
+    manager = TransactionManager()
+    manager.add_transaction("1", 'SGD', TransactionType.EXPENSE, 1, transaction_id=10)
+    manager.delete_transaction(10)
+    # Slots are found by bisecting the ids, so they can't go back, even to a deleted one
+    for transaction_id in (5, 10):
+        with pytest.raises(ValueError):
+            manager.add_transaction("1", 'SGD', TransactionType.EXPENSE, 1, transaction_id=transaction_id)
+    assert manager.add_transaction("1", 'SGD', TransactionType.EXPENSE, 1).id == 11
+    assert 10 not in manager and len(manager) == 1
+
+def test_bulk_edit_is_validated_and_all_or_nothing():
+    manager = TransactionManager()
+    first, second, third = (manager.add_transaction("10", 'SGD', TransactionType.EXPENSE, 1).id
+                            for _ in range(3))
+    for bad in ({third: {'amount': 'ten'}}, {third: {'amount': 0}},
+                {third: {'colour': 'red'}}, {third: {'type': 'EXPENSE'}}, {999: {'amount': 1}}):
+        with pytest.raises(ValueError):
+            manager.bulk_edit({first: {'amount': 99}, **bad})
+    # The valid edit ahead of the bad one wasn't applied either
+    assert manager.get_transaction(first).amount == -10.0
+    assert manager.get_balance('SGD') == pytest.approx(-30.0)
+
+    # Changing only the type flips the sign; amounts follow the type like in add_transaction
+    assert manager.bulk_edit({first: {'type': TransactionType.INCOME},
+                              second: {'amount': '1,234.567'}}) == 2
+    assert manager.get_transaction(first).amount == 10.0
+    assert manager.get_transaction(second).amount == -1234.57
+    assert manager.get_balance('SGD') == pytest.approx(10.0 - 1234.57 - 10.0)
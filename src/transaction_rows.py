@@ -0,0 +1,66 @@
+"""Read-only transaction rows.
+
+Views, exports and reports only read a handful of fields, so they select
+columns with Core and get plain named tuples back: no identity map,
+instance state, relationship attributes or lazy-load hooks per row.
+Rows can't be modified or flushed; load the ORM Transaction to edit one.
+
+    for row in iter_transaction_rows(session, account_id=account.id):
+        print(row.date, row.amount, row.currency)
+"""
+from collections import namedtuple
+from sqlalchemy import select
+from models import Transaction
+
+ROW_COLUMNS = [
+    Transaction.id,
+    Transaction.date,
+    Transaction.type,
+    Transaction.category_id,
+    Transaction.amount,
+    Transaction.currency,
+    Transaction.description,
+    Transaction.account_id,
+    Transaction.user_id,
+]
+
+TransactionRow = namedtuple('TransactionRow', [column.key for column in ROW_COLUMNS])
+
+# Rows fetched from the cursor at a time when streaming
+DEFAULT_BATCH_SIZE = 1000
+
+def transaction_rows_query(account_id=None, offset=0, limit=None, start=None, end=None):
+    """Core select of transaction columns in date order, optionally in [start, end)"""
+    query = select(*ROW_COLUMNS).order_by(Transaction.date, Transaction.id)
+    if account_id is not None:
+        query = query.where(Transaction.account_id == account_id)
+    if start is not None:
+        query = query.where(Transaction.date >= start)
+    if end is not None:
+        query = query.where(Transaction.date < end)
+    if offset:
+        query = query.offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+def iter_transaction_rows(session, account_id=None, offset=0, limit=None,
+                          batch_size=DEFAULT_BATCH_SIZE, start=None, end=None, schema=None):
+    """Stream rows in batches from a session or connection
+
+    schema reads the transactions table of an attached database instead.
+    """
+    options = {'yield_per': batch_size}
+    if schema is not None:
+        options['schema_translate_map'] = {None: schema}
+    result = session.execute(
+        transaction_rows_query(account_id, offset, limit, start, end),
+        execution_options=options
+    )
+    for batch in result.partitions():
+        yield from map(TransactionRow._make, batch)
+
+def load_transaction_rows(session, account_id=None, offset=0, limit=None):
+    """All matching rows as a list of TransactionRow"""
+    result = session.execute(transaction_rows_query(account_id, offset, limit))
+    return list(map(TransactionRow._make, result))